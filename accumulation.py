@@ -0,0 +1,189 @@
+import dataclasses
+import hashlib
+import json
+import os
+import time
+from typing import Callable, Self
+import numpy as np
+
+from camera import Camera
+from denoise import denoise_render
+from flat_scene import FlatScene
+from process_renderer import render_image_in_processes
+from render_settings import RenderSettings
+
+METADATA_FILE = 'metadata.json'
+COLOR_SUM_FILE = 'color_sum.npy'
+SAMPLE_COUNTS_FILE = 'sample_counts.npy'
+CONVERGED_FILE = 'converged.npy'
+#settings that only change how the work is split up and traced, a render with the same seed comes out the same
+#with any of them, so a checkpoint can be resumed after changing them
+SCHEDULING_SETTINGS = ('tile_size', 'min_tile_size', 'tile_cost_prepass', 'max_rays_per_batch', 'packet_traversal',
+                       'backend')
+
+
+def _update_digest(digest, value):
+    #hashes what a value holds rather than how it is laid out in memory. a pickle also records which objects
+    #are shared, so the same scene built fresh or loaded from the compiled cache, or in another process, can
+    #pickle differently
+    if isinstance(value, np.ndarray):
+        digest.update(f'ndarray {value.dtype.str} {value.shape}'.encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif value is None or isinstance(value, (bool, int, float, complex, str, bytes, np.generic)):
+        digest.update(f'{type(value).__name__} {value!r}'.encode())
+    elif isinstance(value, (list, tuple)):
+        digest.update(f'{type(value).__name__} {len(value)}'.encode())
+        for item in value:
+            _update_digest(digest, item)
+    elif isinstance(value, (dict, set, frozenset)):
+        #ordered by the items' own reprs, string hashes and so set order change from process to process
+        if isinstance(value, dict):
+            items = sorted(value.items(), key=lambda item: repr(item[0]))
+        else:
+            items = sorted(value, key=repr)
+        digest.update(f'{type(value).__name__} {len(items)}'.encode())
+        for item in items:
+            _update_digest(digest, item)
+    else:
+        #objects by class and the state they would pickle, which leaves out caches and counters
+        digest.update(f'{type(value).__module__}.{type(value).__qualname__}'.encode())
+        _update_digest(digest, value.__getstate__())
+
+
+def render_key(camera: Camera, scene: FlatScene, settings: RenderSettings) -> str:
+    #the sample target and the denoiser are left out so a resumed render can ask for more samples or a filtered image
+    defaults = {field.name: field.default for field in dataclasses.fields(RenderSettings)
+                if field.name in SCHEDULING_SETTINGS}
+    settings = dataclasses.replace(settings, samples_per_pixel=0, denoise=False, **defaults)
+    digest = hashlib.blake2b(digest_size=16)
+    _update_digest(digest, (camera, scene, settings))
+    return digest.hexdigest()
+
+
+class AccumulationBuffer:
+    #running sum of every sample and the number of samples per pixel, memory mapped from a checkpoint directory
+    def __init__(self, path: str, width: int, height: int, key: str):
+        self.path = path
+        self.key = key
+        os.makedirs(path, exist_ok=True)
+        metadata = self._read_metadata()
+        if metadata is None:
+            mode = 'w+'
+            self.passes = 0
+        elif (metadata['key'], metadata['width'], metadata['height']) == (key, width, height):
+            mode = 'r+'
+            self.passes = metadata['passes']
+        else:
+            #samples from another scene or other settings are never thrown away without asking
+            raise ValueError(f'Checkpoint {path} is from a different scene, camera or settings, '
+                             f'remove it or pick another directory to start over')
+        self.color_sum = np.lib.format.open_memmap(os.path.join(path, COLOR_SUM_FILE), mode=mode,
+                                                   dtype=np.float64, shape=(height, width, 3))
+        self.sample_counts = np.lib.format.open_memmap(os.path.join(path, SAMPLE_COUNTS_FILE), mode=mode,
+                                                       dtype=np.int64, shape=(height, width))
+        #pixels adaptive sampling has found to be within tolerance, checkpoints from before it are started empty
+        converged_path = os.path.join(path, CONVERGED_FILE)
+        converged_mode = mode if os.path.exists(converged_path) else 'w+'
+        self.converged = np.lib.format.open_memmap(converged_path, mode=converged_mode, dtype=bool,
+                                                   shape=(height, width))
+        if mode == 'w+':
+            self.checkpoint()
+
+    @classmethod
+    def open(cls, path: str) -> Self:
+        with open(os.path.join(path, METADATA_FILE)) as file:
+            metadata = json.load(file)
+        return cls(path, metadata['width'], metadata['height'], metadata['key'])
+
+    def _read_metadata(self) -> dict | None:
+        try:
+            with open(os.path.join(self.path, METADATA_FILE)) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def add(self, color_sum: np.ndarray, sample_counts: np.ndarray):
+        self.color_sum += color_sum
+        self.sample_counts += sample_counts
+        self.passes += 1
+
+    def merge(self, other: Self):
+        if other.key != self.key or other.color_sum.shape != self.color_sum.shape:
+            raise ValueError(f'Checkpoint {other.path} is from a different scene or settings than {self.path}')
+        self.color_sum += other.color_sum
+        self.sample_counts += other.sample_counts
+        self.converged |= other.converged
+        self.passes += other.passes
+
+    def checkpoint(self):
+        self.color_sum.flush()
+        self.sample_counts.flush()
+        self.converged.flush()
+        #metadata is replaced last and atomically so it never describes buffers that were not flushed
+        height, width = self.sample_counts.shape
+        metadata = {'key': self.key, 'width': width, 'height': height, 'passes': self.passes}
+        temporary_path = os.path.join(self.path, METADATA_FILE + '.tmp')
+        with open(temporary_path, 'w') as file:
+            json.dump(metadata, file)
+        os.replace(temporary_path, os.path.join(self.path, METADATA_FILE))
+
+    def image(self) -> np.ndarray:
+        counts = np.maximum(self.sample_counts, 1)[..., None]
+        return (self.color_sum / counts).astype(np.float32)
+
+    def denoised_image(self, camera: Camera, scene: FlatScene, settings: RenderSettings) -> np.ndarray:
+        return denoise_render(self.image(), camera, scene, settings)
+
+
+def merge_checkpoints(output_path: str, input_paths: list[str]) -> AccumulationBuffer:
+    if not input_paths:
+        raise ValueError('No checkpoints to merge')
+    inputs = [AccumulationBuffer.open(path) for path in input_paths]
+    height, width = inputs[0].sample_counts.shape
+    merged = AccumulationBuffer(output_path, width, height, inputs[0].key)
+    for buffer in inputs:
+        merged.merge(buffer)
+    merged.checkpoint()
+    return merged
+
+
+def render_resumable(camera: Camera,
+                     scene: FlatScene,
+                     settings: RenderSettings,
+                     checkpoint_path: str,
+                     samples_per_pass: int = 4,
+                     checkpoint_interval: float = 60.0,
+                     seed: int | None = None,
+                     render_pass: Callable = render_image_in_processes,
+                     on_preview: Callable[[AccumulationBuffer], None] | None = None,
+                     preview_interval: float = 0.0) -> AccumulationBuffer:
+    #keeps adding passes until every pixel has settings.samples_per_pixel samples, or with adaptive sampling until
+    #the rest have converged, resuming any matching checkpoint. on_preview is handed the buffer after a pass once
+    #preview_interval seconds went by since the last one, 0 means after every pass
+    buffer = AccumulationBuffer(checkpoint_path, settings.width, settings.height, render_key(camera, scene, settings))
+    run_entropy = np.random.SeedSequence(seed).entropy
+    last_checkpoint = last_preview = time.monotonic()
+    #a pass can only stop a pixel early with samples to spare past min_samples_per_pixel, adaptive passes get
+    #room for as many again
+    if settings.adaptive_sampling:
+        samples_per_pass = max(samples_per_pass, 2 * settings.min_samples_per_pixel)
+    while (unfinished := (buffer.sample_counts < settings.samples_per_pixel) & ~buffer.converged).any():
+        remaining = settings.samples_per_pixel - int(buffer.sample_counts[unfinished].min())
+        #passes accumulate raw samples, only the finished image is denoised
+        pass_settings = dataclasses.replace(settings, samples_per_pixel=min(samples_per_pass, remaining), denoise=False)
+        #a new seed per pass so resumed and merged runs never repeat samples
+        pass_seed = int(np.random.SeedSequence([run_entropy, buffer.passes]).generate_state(1, np.uint64)[0])
+        image, sample_counts = render_pass(camera, scene, pass_settings, seed=pass_seed)
+        buffer.add(image * sample_counts[..., None], sample_counts)
+        if settings.adaptive_sampling:
+            #the pass stopped these short of its target because they were within adaptive_tolerance
+            buffer.converged |= sample_counts < pass_settings.samples_per_pixel
+
+        if time.monotonic() - last_checkpoint >= checkpoint_interval:
+            buffer.checkpoint()
+            last_checkpoint = time.monotonic()
+        if on_preview is not None and time.monotonic() - last_preview >= preview_interval:
+            on_preview(buffer)
+            last_preview = time.monotonic()
+    buffer.checkpoint()
+    return buffer
@@ -0,0 +1,96 @@
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Iterator
+import numpy as np
+
+from camera import Camera
+from flat_scene import FlatScene
+from process_renderer import render_image_in_processes
+from render_settings import RenderSettings
+
+
+def transform_matrix(translate=(0.0, 0.0, 0.0),
+                     rotate_degrees=(0.0, 0.0, 0.0),
+                     scale: float = 1.0,
+                     pivot=(0.0, 0.0, 0.0)) -> np.ndarray:
+    #scale, then rotate about x, y and z in that order, all around pivot, then translate
+    x, y, z = np.deg2rad(np.asarray(rotate_degrees, dtype=np.float64))
+    rotate_x = np.array([[1.0, 0.0, 0.0], [0.0, np.cos(x), -np.sin(x)], [0.0, np.sin(x), np.cos(x)]])
+    rotate_y = np.array([[np.cos(y), 0.0, np.sin(y)], [0.0, 1.0, 0.0], [-np.sin(y), 0.0, np.cos(y)]])
+    rotate_z = np.array([[np.cos(z), -np.sin(z), 0.0], [np.sin(z), np.cos(z), 0.0], [0.0, 0.0, 1.0]])
+    linear = rotate_z @ rotate_y @ rotate_x * scale
+    pivot = np.asarray(pivot, dtype=np.float64)
+
+    matrix = np.eye(4)
+    matrix[:3, :3] = linear
+    matrix[:3, 3] = pivot - linear @ pivot + np.asarray(translate, dtype=np.float64)
+    return matrix
+
+
+def interpolate_keyframes(keyframes: list[dict], frame: float) -> dict:
+    #keyframes are dicts with a 'frame' and numbers or lists of numbers, blended linearly between the two
+    #around frame and held before the first and after the last
+    keyframes = sorted(keyframes, key=lambda keyframe: keyframe['frame'])
+    if frame <= keyframes[0]['frame']:
+        return dict(keyframes[0])
+    if frame >= keyframes[-1]['frame']:
+        return dict(keyframes[-1])
+    after = next(index for index, keyframe in enumerate(keyframes) if keyframe['frame'] > frame)
+    before = keyframes[after - 1]
+    after = keyframes[after]
+    weight = (frame - before['frame']) / (after['frame'] - before['frame'])
+
+    blended = dict(before)
+    for name, value in before.items():
+        if name in after and isinstance(value, (int, float, list, tuple)) and not isinstance(value, bool):
+            blended[name] = ((1.0 - weight) * np.asarray(value, dtype=np.float64)
+                             + weight * np.asarray(after[name], dtype=np.float64)).tolist()
+    blended['frame'] = frame
+    return blended
+
+
+def keyframe_transform(keyframe: dict) -> np.ndarray:
+    return transform_matrix(keyframe.get('translate', (0.0, 0.0, 0.0)),
+                            keyframe.get('rotate_degrees', (0.0, 0.0, 0.0)),
+                            keyframe.get('scale', 1.0),
+                            keyframe.get('pivot', (0.0, 0.0, 0.0)))
+
+
+@dataclass
+class Animation:
+    #camera_at builds the camera of a frame, object_keyframes holds transform keyframes per top level object
+    frame_count: int
+    camera_at: Callable[[int], Camera]
+    object_keyframes: dict[int, list[dict]] = field(default_factory=dict)
+
+    def transforms(self, frame: int) -> dict[int, np.ndarray]:
+        return {object_index: keyframe_transform(interpolate_keyframes(keyframes, frame))
+                for object_index, keyframes in self.object_keyframes.items()}
+
+
+@dataclass
+class FrameStatistics:
+    frame: int
+    update_seconds: float
+    render_seconds: float
+    bvh_rebuilt: bool
+
+
+def render_animation(animation: Animation,
+                     scene: FlatScene,
+                     settings: RenderSettings,
+                     seed: int | None = None,
+                     render_frame: Callable = render_image_in_processes) -> Iterator[tuple[np.ndarray, FrameStatistics]]:
+    #frames are yielded as they finish, the scene is moved in place and its bvh refitted between them
+    run_entropy = np.random.SeedSequence(seed).entropy
+    for frame in range(animation.frame_count):
+        start = time.perf_counter()
+        bvh_rebuilt = scene.transform_objects(animation.transforms(frame))
+        camera = animation.camera_at(frame)
+        update_seconds = time.perf_counter() - start
+
+        frame_seed = int(np.random.SeedSequence([run_entropy, frame]).generate_state(1, np.uint64)[0])
+        start = time.perf_counter()
+        image, _ = render_frame(camera, scene, settings, seed=frame_seed)
+        render_seconds = time.perf_counter() - start
+        yield image, FrameStatistics(frame, update_seconds, render_seconds, bvh_rebuilt)
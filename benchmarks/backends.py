@@ -0,0 +1,103 @@
+import argparse
+import sys
+import time
+import numpy as np
+
+from benchmarks.run import camera_rays
+from benchmarks.scenes import SCENES
+from flat_bvh import FlatBVH
+from flat_scene import FlatScene
+from jit_kernels import numba
+from ray import RayBatch
+from render_settings import RenderSettings
+from sampler import sampler_key
+from wavefront import render_image
+
+#hit times and barycentrics are summed in a different order by the kernels, so they only agree to rounding
+TOLERANCE = 1e-9
+
+
+def ray_sets(camera, scene: FlatScene, settings: RenderSettings) -> dict[str, RayBatch]:
+    #camera rays, and rays leaving where they landed in uniformly random directions at random times, which
+    #reach every part of the bvh and every moment of a moving sphere
+    rays, _ = camera_rays(camera, settings, sampler_key(0), 0)
+    closest_time, _, _, _ = scene.closest_hits(rays, time_min=1e-3, time_max=float('inf'))
+    points = rays.position(np.where(np.isfinite(closest_time), closest_time, 0.0))
+    rng = np.random.default_rng(0)
+    bounces = RayBatch(points, rng.normal(size=points.shape), rng.uniform(0.0, 1.0, len(points)))
+    return {'camera': rays, 'bounce': bounces}
+
+
+def compare_hits(scene: FlatScene, rays: RayBatch, coherent: bool) -> tuple[list[str], float, float]:
+    #returns the disagreements, then the seconds numpy and the kernels took
+    results = {}
+    seconds = {}
+    for backend in ('numpy', 'numba'):
+        start = time.perf_counter()
+        results[backend] = scene.closest_hits(rays, time_min=1e-3, time_max=float('inf'), coherent=coherent,
+                                              backend=backend)
+        seconds[backend] = time.perf_counter() - start
+    numpy_time, numpy_primitive, numpy_u, numpy_v = results['numpy']
+    numba_time, numba_primitive, numba_u, numba_v = results['numba']
+    problems = []
+    primitive_mismatches = np.count_nonzero(numpy_primitive != numba_primitive)
+    if primitive_mismatches:
+        problems.append(f'{primitive_mismatches} rays hit different primitives')
+    hit = (numpy_primitive == numba_primitive) & (numpy_primitive >= 0)
+    for name, numpy_values, numba_values in (('time', numpy_time, numba_time), ('u', numpy_u, numba_u),
+                                             ('v', numpy_v, numba_v)):
+        error = np.abs(numpy_values[hit] - numba_values[hit]) / np.maximum(np.abs(numpy_values[hit]), 1.0)
+        if error.max(initial=0.0) > TOLERANCE:
+            problems.append(f'{name} differs by up to {error.max():.2e}')
+    return problems, seconds['numpy'], seconds['numba']
+
+
+def check_scene(scene_name: str, settings: RenderSettings) -> list[str]:
+    camera, objects = SCENES[scene_name](settings.width / settings.height)
+    scene = FlatScene(FlatBVH(objects))
+    #the first call loads or compiles the kernels and is left out of the timings
+    scene.closest_hits(RayBatch(np.zeros((1, 3)), np.ones((1, 3)), np.zeros(1)), 1e-3, float('inf'), backend='numba')
+    problems = []
+    for pose in ('rest', 'moved'):
+        if pose == 'moved':
+            #moving the first object refits the bvh the kernels walk
+            matrix = np.eye(4)
+            matrix[:3, 3] = (0.3, 0.2, -0.1)
+            scene.transform_objects({0: matrix})
+        for ray_set, rays in ray_sets(camera, scene, settings).items():
+            ray_problems, numpy_seconds, numba_seconds = compare_hits(scene, rays, coherent=ray_set == 'camera')
+            problems += [f'{scene_name} {pose} {ray_set}: {problem}' for problem in ray_problems]
+            print(f'{scene_name} {pose} {ray_set}: numpy {numpy_seconds * 1e3:.1f}ms, '
+                  f'numba {numba_seconds * 1e3:.1f}ms, x{numpy_seconds / numba_seconds:.1f}')
+
+    images = {}
+    for backend in ('numpy', 'numba'):
+        backend_settings = RenderSettings(settings.width, settings.height, settings.samples_per_pixel, backend=backend)
+        images[backend], _ = render_image(camera, scene, backend_settings, seed=0)
+    image_error = float(np.abs(images['numpy'] - images['numba']).max())
+    if image_error > 1e-4:
+        problems.append(f'{scene_name}: rendered images differ by up to {image_error:.2e}')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that the numba kernels find the same hits as numpy')
+    parser.add_argument('--scenes', nargs='+', choices=sorted(SCENES), default=sorted(SCENES))
+    parser.add_argument('--width', type=int, default=96)
+    parser.add_argument('--height', type=int, default=54)
+    parser.add_argument('--samples', type=int, default=2)
+    arguments = parser.parse_args()
+    if numba is None:
+        sys.exit('numba is not installed, there is only the numpy backend')
+
+    settings = RenderSettings(arguments.width, arguments.height, arguments.samples)
+    problems = []
+    for scene_name in arguments.scenes:
+        problems += check_scene(scene_name, settings)
+    for problem in problems:
+        print(problem)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+import argparse
+import dataclasses
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import time
+import tracemalloc
+import numpy as np
+
+from benchmarks.scenes import CACHE_DIRECTORY, REPOSITORY_DIRECTORY, SCENES
+from denoise import denoise_render
+from flat_bvh import FlatBVH
+from flat_scene import FlatScene
+from jit_kernels import BACKENDS, numba
+from ray import RayBatch
+from raytracer import render_scanline
+from render_settings import RenderSettings
+from sampler import STREAM_CAMERA, PathSampler, sampler_key
+from wavefront import render_image, trace_paths
+
+RESULTS_DIRECTORY = os.path.join(REPOSITORY_DIRECTORY, 'benchmarks', 'results')
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPOSITORY_DIRECTORY,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def camera_rays(camera, settings: RenderSettings, key: np.ndarray, sample_index: int) -> tuple[RayBatch, PathSampler]:
+    #one jittered sample through every pixel, and the sampler its paths go on drawing from
+    pixel_count = settings.width * settings.height
+    pixel_y, pixel_x = np.divmod(np.arange(pixel_count), settings.width)
+    sampler = PathSampler(key, np.arange(pixel_count), np.full(pixel_count, sample_index))
+    rays = camera.pixel_rays(pixel_x, pixel_y, settings.width, settings.height, sampler.stream(0, STREAM_CAMERA))
+    return rays, sampler
+
+
+def measure_build(scene_builder, aspect_ratio: float) -> tuple[dict, object, FlatBVH, FlatScene]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    camera, objects = scene_builder(aspect_ratio)
+    objects_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    world = FlatBVH(objects)
+    scene = FlatScene(world)
+    flatten_seconds = time.perf_counter() - start
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    #instances share their mesh's triangles, but each one is still that many triangles for the rays to cross
+    mesh_triangle_counts = np.diff(np.append(scene.instanced_mesh_first_triangle, len(scene.instanced_v0)))
+    instanced_triangle_count = int(mesh_triangle_counts[scene.instance_mesh_index].sum())
+    metrics = {
+        'objects_seconds': objects_seconds,
+        'flatten_seconds': flatten_seconds,
+        'build_seconds': objects_seconds + flatten_seconds,
+        'build_peak_bytes': peak_bytes,
+        'primitive_count': len(scene.sphere_radius) + len(scene.triangle_v0) + instanced_triangle_count,
+        'instance_count': scene.instance_count,
+        'bvh_node_count': len(scene.bvh.node_count),
+    }
+    return metrics, camera, world, scene
+
+
+def measure_rays(camera, scene: FlatScene, settings: RenderSettings, repeats: int) -> dict:
+    key = sampler_key(0)
+    primary_seconds = 0.0
+    ray_count = 0
+    for repeat in range(repeats):
+        start = time.perf_counter()
+        rays, _ = camera_rays(camera, settings, key, repeat)
+        scene.intersect(rays, time_min=1e-3, time_max=float('inf'), coherent=settings.packet_traversal,
+                        backend=settings.backend)
+        primary_seconds += time.perf_counter() - start
+        ray_count += len(rays)
+
+    #every bounce goes through intersect, so counting its rays counts path segments
+    segment_count = 0
+    intersect = scene.intersect
+
+    def counting_intersect(rays, time_min, time_max, profile=None, coherent=False, backend='numpy'):
+        nonlocal segment_count
+        segment_count += len(rays)
+        return intersect(rays, time_min, time_max, profile, coherent, backend)
+
+    scene.intersect = counting_intersect
+    tracemalloc.start()
+    path_seconds = 0.0
+    try:
+        for repeat in range(repeats):
+            rays, sampler = camera_rays(camera, settings, key, repeats + repeat)
+            start = time.perf_counter()
+            trace_paths(rays, scene, settings.max_depth, sampler, settings.russian_roulette_depth,
+                        packet_traversal=settings.packet_traversal, backend=settings.backend)
+            path_seconds += time.perf_counter() - start
+    finally:
+        del scene.intersect
+        _, path_peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        'primary_rays_per_second': ray_count / primary_seconds,
+        'path_rays_per_second': segment_count / path_seconds,
+        'paths_per_second': ray_count / path_seconds,
+        'mean_path_segments': segment_count / ray_count,
+        'path_peak_bytes': path_peak_bytes,
+    }
+
+
+def measure_scalar_speedup(camera, world: FlatBVH, scene: FlatScene, settings: RenderSettings, rows: int) -> dict:
+    #paths per second of the wavefront over the whole image against the scalar ray_color loop over a few of its
+    #scanlines, both on one thread. the wavefront is meant to be at least 20 times faster, which the default scene
+    #and every scene here clear with the numba backend. with --backend numpy some fall short: the numpy bvh walk
+    #moves every ray one node per round of numpy calls, so rays that visit many nodes pay that overhead per node.
+    #at 96x54 spheres and glass came out at 13-15x and instanced_mesh at about 3x, where every (ray, instance)
+    #pair walks the mesh bvh again
+    key = sampler_key(0)
+    start = time.perf_counter()
+    for y in np.linspace(0, settings.height - 1, rows).astype(int):
+        render_scanline(int(y), settings.width, settings.height, settings.samples_per_pixel, camera, world,
+                        settings.max_depth, settings.russian_roulette_depth, key)
+    scalar_paths_per_second = rows * settings.width * settings.samples_per_pixel / (time.perf_counter() - start)
+    start = time.perf_counter()
+    render_image(camera, scene, settings, seed=0, max_workers=1)
+    wavefront_paths_per_second = (settings.width * settings.height * settings.samples_per_pixel
+                                  / (time.perf_counter() - start))
+    return {
+        'scalar_paths_per_second': scalar_paths_per_second,
+        'wavefront_paths_per_second': wavefront_paths_per_second,
+        'scalar_speedup': wavefront_paths_per_second / scalar_paths_per_second,
+    }
+
+
+def reference_image(scene_name: str, camera, scene: FlatScene, settings: RenderSettings, refresh: bool) -> np.ndarray:
+    #kept between runs so every commit is compared against the same image
+    path = os.path.join(CACHE_DIRECTORY,
+                        f'reference_{scene_name}_{settings.width}x{settings.height}_{settings.samples_per_pixel}.npy')
+    if not refresh and os.path.exists(path):
+        return np.load(path)
+    image, _ = render_image(camera, scene, settings, seed=12345)
+    os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+    np.save(path, image)
+    return image
+
+
+def measure_convergence(camera, scene: FlatScene, settings: RenderSettings, reference: np.ndarray,
+                        max_samples_per_pixel: int) -> list[dict]:
+    #error against the reference as the sample count doubles
+    points = []
+    samples_per_pixel = 1
+    while samples_per_pixel <= max_samples_per_pixel:
+        run_settings = RenderSettings(settings.width, settings.height, samples_per_pixel,
+                                      max_depth=settings.max_depth,
+                                      russian_roulette_depth=settings.russian_roulette_depth,
+                                      backend=settings.backend)
+        start = time.perf_counter()
+        image, _ = render_image(camera, scene, run_settings, seed=samples_per_pixel)
+        seconds = time.perf_counter() - start
+        rmse = float(np.sqrt(np.mean((image - reference) ** 2)))
+        start = time.perf_counter()
+        denoised = denoise_render(image, camera, scene, run_settings, seed=samples_per_pixel)
+        denoise_seconds = time.perf_counter() - start
+        denoised_rmse = float(np.sqrt(np.mean((denoised - reference) ** 2)))
+        points.append({'samples_per_pixel': samples_per_pixel, 'seconds': seconds, 'rmse': rmse,
+                       'denoise_seconds': denoise_seconds, 'denoised_rmse': denoised_rmse})
+        samples_per_pixel *= 2
+    return points
+
+
+def run_scene(scene_name: str, arguments) -> dict:
+    settings = RenderSettings(arguments.width, arguments.height, arguments.reference_samples,
+                              backend=arguments.backend)
+    build, camera, world, scene = measure_build(SCENES[scene_name], arguments.width / arguments.height)
+    rays = measure_rays(camera, scene, settings, arguments.repeats)
+    speedup = measure_scalar_speedup(camera, world, scene,
+                                     dataclasses.replace(settings, samples_per_pixel=arguments.scalar_samples),
+                                     arguments.scalar_rows)
+    reference = reference_image(scene_name, camera, scene, settings, arguments.refresh_references)
+    convergence = measure_convergence(camera, scene, settings, reference, arguments.max_samples)
+    return {**build, **rays, **speedup, 'convergence': convergence}
+
+
+def compare(results: dict, baseline_path: str):
+    with open(baseline_path) as file:
+        baseline = json.load(file)
+    print(f'compared with {baseline_path} ({baseline.get("commit")})')
+    for scene_name, metrics in results['scenes'].items():
+        previous = baseline['scenes'].get(scene_name)
+        if previous is None:
+            continue
+        changes = []
+        for metric in ('build_seconds', 'primary_rays_per_second', 'path_rays_per_second', 'path_peak_bytes'):
+            changes.append(f'{metric} x{metrics[metric] / previous[metric]:.2f}')
+        print(f'  {scene_name}: ' + ', '.join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render the reference scenes and record speed, memory and error')
+    parser.add_argument('--scenes', nargs='+', choices=sorted(SCENES), default=sorted(SCENES))
+    parser.add_argument('--width', type=int, default=96)
+    parser.add_argument('--height', type=int, default=54)
+    parser.add_argument('--repeats', type=int, default=2)
+    parser.add_argument('--max-samples', type=int, default=16)
+    parser.add_argument('--scalar-rows', type=int, default=2, help='scanlines rendered by the scalar loop')
+    parser.add_argument('--scalar-samples', type=int, default=4)
+    parser.add_argument('--reference-samples', type=int, default=256)
+    parser.add_argument('--refresh-references', action='store_true')
+    parser.add_argument('--output', help='json file, defaults to benchmarks/results/<commit>-<time>.json')
+    parser.add_argument('--compare', help='earlier json results to print ratios against')
+    parser.add_argument('--backend', choices=BACKENDS, default='auto')
+    arguments = parser.parse_args()
+
+    results = {
+        'commit': git_commit(),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'numba': None if numba is None else numba.__version__,
+        'cpu_count': os.cpu_count(),
+        'arguments': vars(arguments),
+        'scenes': {},
+    }
+    for scene_name in arguments.scenes:
+        metrics = run_scene(scene_name, arguments)
+        results['scenes'][scene_name] = metrics
+        print(f'{scene_name}: build {metrics["build_seconds"]:.3f}s, '
+              f'primary {metrics["primary_rays_per_second"]:.0f} rays/s, '
+              f'paths {metrics["path_rays_per_second"]:.0f} rays/s, '
+              f'x{metrics["scalar_speedup"]:.1f} over scalar, '
+              f'peak {metrics["path_peak_bytes"] / 2 ** 20:.1f} MiB, '
+              f'rmse {metrics["convergence"][-1]["rmse"]:.4f}, '
+              f'denoised {metrics["convergence"][-1]["denoised_rmse"]:.4f}')
+    #ru_maxrss is in kilobytes on linux
+    results['max_resident_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    output_path = arguments.output
+    if output_path is None:
+        stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        output_path = os.path.join(RESULTS_DIRECTORY, f'{results["commit"] or "unknown"}-{stamp}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f'wrote {output_path}')
+
+    if arguments.compare:
+        compare(results, arguments.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+import os
+import numpy as np
+from PIL import Image
+
+from animation import transform_matrix
+from camera import Camera
+from instance import Instance
+from materials import Dielectric, Emissive, Lambertian, Metal
+from mesh import Mesh
+from moving_sphere import MovingSphere
+from sphere import Sphere
+from texture import ImageTexture, PerlinNoiseTexture
+from triangle import Triangle
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIRECTORY = os.path.join(REPOSITORY_DIRECTORY, 'benchmarks', '.cache')
+STAR_MESH_PATH = os.path.join(REPOSITORY_DIRECTORY, 'stuff_to_load', 'star.mesh')
+
+
+def look_at_camera(aspect_ratio: float,
+                   position=(0.0, 0.0, 0.0),
+                   look_at_point=(0.0, 0.0, -1.0),
+                   vertical_fov_degrees: float = 90.0,
+                   shutter_close_time: float = 0.0) -> Camera:
+    return Camera(np.array(position, dtype=np.float32),
+                  np.array(look_at_point, dtype=np.float32),
+                  np.array([0.0, 1.0, 0.0], dtype=np.float32),
+                  vertical_fov_degrees,
+                  aspect_ratio,
+                  shutter_open_time=0.0,
+                  shutter_close_time=shutter_close_time)
+
+
+def ground(material) -> Sphere:
+    return Sphere(center=np.array([0.0, -100.5, -1.0], dtype=np.float32), radius=100.0, material=material)
+
+
+def spheres_scene(aspect_ratio: float) -> tuple[Camera, list]:
+    rng = np.random.default_rng(1)
+    objects = [ground(Lambertian(np.array([0.5, 0.5, 0.5], dtype=np.float32)))]
+    for x in np.linspace(-2.0, 2.0, 9):
+        for z in np.linspace(-1.0, -4.0, 7):
+            kind = rng.random()
+            if kind < 0.7:
+                material = Lambertian(rng.random(3).astype(np.float32))
+            else:
+                material = Metal((0.5 + 0.5 * rng.random(3)).astype(np.float32), fuzz=float(0.3 * rng.random()))
+            center = np.array([x + 0.2 * rng.random(), -0.35, z], dtype=np.float32)
+            objects.append(Sphere(center=center, radius=0.15, material=material))
+    return look_at_camera(aspect_ratio, position=(0.0, 0.6, 1.0), look_at_point=(0.0, -0.2, -2.0)), objects
+
+
+def star_mesh_scene(aspect_ratio: float) -> tuple[Camera, list]:
+    objects = [
+        ground(Lambertian(np.array([0.8, 0.8, 0.0], dtype=np.float32))),
+        Mesh.load_from_file(STAR_MESH_PATH, Lambertian(np.array([0.1, 0.6, 0.9], dtype=np.float32))),
+    ]
+    return look_at_camera(aspect_ratio), objects
+
+
+def heightfield_mesh(resolution: int, material) -> Mesh:
+    #a rippled grid with resolution x resolution quads, two triangles each
+    coordinates = np.linspace(-3.0, 3.0, resolution + 1)
+    x, z = np.meshgrid(coordinates, coordinates)
+    y = -0.4 + 0.15 * np.sin(3.0 * x) * np.cos(2.0 * z)
+    vertices = np.stack((x, y, z - 3.0), axis=-1).reshape(-1, 3)
+
+    row, column = np.mgrid[0:resolution, 0:resolution]
+    corner = (row * (resolution + 1) + column).ravel()
+    below = corner + resolution + 1
+    indices = np.concatenate((np.stack((corner, below, corner + 1), axis=1),
+                              np.stack((corner + 1, below, below + 1), axis=1)))
+    return Mesh(vertices, indices, material)
+
+
+def large_mesh_scene(aspect_ratio: float, resolution: int = 300) -> tuple[Camera, list]:
+    objects = [heightfield_mesh(resolution, Lambertian(np.array([0.4, 0.7, 0.3], dtype=np.float32)))]
+    return look_at_camera(aspect_ratio, position=(0.0, 0.8, 0.5), look_at_point=(0.0, -0.4, -3.0)), objects
+
+
+def instanced_mesh_scene(aspect_ratio: float, count: int = 1000) -> tuple[Camera, list]:
+    #one shared heightfield placed count times, memory should not grow with count
+    rng = np.random.default_rng(5)
+    tile = heightfield_mesh(40, Lambertian(np.array([0.4, 0.7, 0.3], dtype=np.float32)))
+    metal = Metal(np.array([0.8, 0.8, 0.9], dtype=np.float32), fuzz=0.2)
+    objects = [ground(Lambertian(np.array([0.5, 0.5, 0.5], dtype=np.float32)))]
+    for index in range(count):
+        position = (rng.uniform(-8.0, 8.0), rng.uniform(0.0, 3.0), rng.uniform(-14.0, -2.0))
+        transform = transform_matrix(translate=position,
+                                     rotate_degrees=rng.uniform(0.0, 360.0, 3),
+                                     scale=0.1,
+                                     pivot=(0.0, -0.4, -3.0))
+        objects.append(Instance(tile, transform, metal if index % 3 == 0 else None))
+    return look_at_camera(aspect_ratio, position=(0.0, 1.0, 1.0), look_at_point=(0.0, 0.5, -6.0)), objects
+
+
+def checker_texture_path() -> str:
+    #a generated image so the benchmark does not depend on texture files outside the repository
+    path = os.path.join(CACHE_DIRECTORY, 'checker.png')
+    if not os.path.exists(path):
+        os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+        row, column = np.mgrid[0:256, 0:256]
+        checker = ((row // 32 + column // 32) % 2).astype(np.uint8)
+        image = np.stack((200 * checker + 40, 120 * checker + 60, 90 - 50 * checker), axis=-1).astype(np.uint8)
+        Image.fromarray(image).save(path)
+    return path
+
+
+def textured_scene(aspect_ratio: float) -> tuple[Camera, list]:
+    checker = Lambertian(texture=ImageTexture(checker_texture_path()))
+    noise = PerlinNoiseTexture(scale=4.0, base_color=np.array([0.2, 0.6, 0.9], dtype=np.float32), seed=3)
+    perlin = Lambertian(texture=noise)
+    objects = [
+        ground(checker),
+        Sphere(center=np.array([-0.6, 0.0, -1.2], dtype=np.float32), radius=0.5, material=perlin),
+        Sphere(center=np.array([0.6, 0.0, -1.2], dtype=np.float32), radius=0.5, material=checker),
+        Triangle(
+            v0=np.array([-2.0, -0.5, -2.5], dtype=np.float32),
+            v1=np.array([2.0, -0.5, -2.5], dtype=np.float32),
+            v2=np.array([0.0, 1.5, -2.5], dtype=np.float32),
+            material=checker,
+            texture_xy0=np.array([0.0, 0.0], dtype=np.float32),
+            texture_xy1=np.array([1.0, 0.0], dtype=np.float32),
+            texture_xy2=np.array([0.5, 1.0], dtype=np.float32),
+        ),
+    ]
+    return look_at_camera(aspect_ratio), objects
+
+
+def motion_blur_scene(aspect_ratio: float) -> tuple[Camera, list]:
+    objects = [ground(Lambertian(np.array([0.5, 0.5, 0.5], dtype=np.float32)))]
+    for index, x in enumerate(np.linspace(-1.5, 1.5, 5)):
+        center0 = np.array([x, 0.0, -1.5], dtype=np.float32)
+        center1 = center0 + np.array([0.0, 0.1 * (index + 1), 0.0], dtype=np.float32)
+        objects.append(MovingSphere(center0=center0, center1=center1, time0=0.0, time1=1.0, radius=0.3,
+                                    material=Lambertian(np.array([0.8, 0.3, 0.1 * index], dtype=np.float32))))
+    return look_at_camera(aspect_ratio, shutter_close_time=1.0), objects
+
+
+def glass_scene(aspect_ratio: float) -> tuple[Camera, list]:
+    glass = Dielectric(1.5)
+    objects = [
+        ground(Lambertian(np.array([0.8, 0.8, 0.0], dtype=np.float32))),
+        Sphere(center=np.array([0.0, 3.0, -1.5], dtype=np.float32), radius=0.7,
+               material=Emissive(np.array([4.0, 4.0, 4.0], dtype=np.float32))),
+    ]
+    for x in np.linspace(-1.6, 1.6, 5):
+        for z in (-1.0, -2.0):
+            objects.append(Sphere(center=np.array([x, -0.1, z], dtype=np.float32), radius=0.35, material=glass))
+    return look_at_camera(aspect_ratio), objects
+
+
+SCENES = {
+    'spheres': spheres_scene,
+    'star_mesh': star_mesh_scene,
+    'large_mesh': large_mesh_scene,
+    'instanced_mesh': instanced_mesh_scene,
+    'textured': textured_scene,
+    'motion_blur': motion_blur_scene,
+    'glass': glass_scene,
+}
@@ -1,5 +1,6 @@
 import numpy as np
-from ray import Ray, normalize
+from ray import Ray, RayBatch, normalize
+from sampler import PathSampler
 
 class Camera:
     def __init__(self,
@@ -28,17 +29,21 @@ class Camera:
             focus_distance = float(np.linalg.norm(position - look_at_point))
 
         self.origin = position
+        self.focus_distance = focus_distance
         self.horizontal = viewport_width * self.camera_right * focus_distance
         self.vertical = viewport_height * self.camera_up * focus_distance
         self.lower_left_vertice = (self.origin - self.horizontal / 2 - self.vertical / 2 - self.camera_backward * focus_distance)
         self.lens_radius = aperture / 2.0
 
-    def get_ray(self, horizontal_percentage: float, vertical_percentage: float) -> Ray:
-
-        time = self.shutter_open_time + np.random.rand() * (self.shutter_close_time - self.shutter_open_time)
+    def get_ray(self,
+                horizontal_percentage: float,
+                vertical_percentage: float,
+                rng: np.random.Generator | None = None) -> Ray:
+        rng = np.random if rng is None else rng
+        time = self.shutter_open_time + rng.random() * (self.shutter_close_time - self.shutter_open_time)
 
         if self.lens_radius > 0.0:
-            random_radius = self.lens_radius * self.random_unit_disk_point()
+            random_radius = self.lens_radius * self.random_unit_disk_point(rng)
             offset = self.camera_right * random_radius[0] + self.camera_up * random_radius[1]
             ray_origin = self.origin + offset
         else:
@@ -51,10 +56,72 @@ class Camera:
             - ray_origin
         )
         return Ray(ray_origin, direction, time=time)
-    
+
+    def pixel_spread_angle(self, image_height: int) -> float:
+        #angle one pixel subtends, ray cones widen by this much per unit of distance travelled
+        return float(np.linalg.norm(self.vertical)) / (image_height * self.focus_distance)
+
+    def get_rays(self,
+                 horizontal_percentages: np.ndarray,
+                 vertical_percentages: np.ndarray,
+                 rng: np.random.Generator | PathSampler) -> RayBatch:
+        count = len(horizontal_percentages)
+        lens_samples = rng.random((count, 2)) if self.lens_radius > 0.0 else None
+        return self._rays(horizontal_percentages, vertical_percentages, rng.random(count), lens_samples)
+
+    def pixel_rays(self,
+                   pixel_x: np.ndarray,
+                   pixel_y: np.ndarray,
+                   image_width: int,
+                   image_height: int,
+                   rng: np.random.Generator | PathSampler) -> RayBatch:
+        #one jittered ray through each listed pixel, a whole tile times its samples in one call. the jitter,
+        #shutter time and lens point of a ray are its first five camera dimensions, drawn together
+        samples = rng.random((len(pixel_x), 5))
+        horizontal_percentages = (pixel_x + samples[:, 0]) / (image_width - 1)
+        vertical_percentages = (pixel_y + samples[:, 1]) / (image_height - 1)
+        return self._rays(horizontal_percentages, vertical_percentages, samples[:, 2], samples[:, 3:])
+
+    def _rays(self,
+              horizontal_percentages: np.ndarray,
+              vertical_percentages: np.ndarray,
+              time_samples: np.ndarray,
+              lens_samples: np.ndarray | None) -> RayBatch:
+        count = len(horizontal_percentages)
+        times = self.shutter_open_time + time_samples * (self.shutter_close_time - self.shutter_open_time)
+
+        #both percentages against the viewport's edges in one product instead of an (N, 3) temporary per term
+        directions = (np.stack((horizontal_percentages, vertical_percentages), axis=1)
+                      @ np.stack((self.horizontal, self.vertical)))
+        directions += self.lower_left_vertice - self.origin
+        if self.lens_radius > 0.0:
+            lens_points = self.lens_radius * self.concentric_disk_points(lens_samples)
+            lens_offsets = lens_points @ np.stack((self.camera_right, self.camera_up))
+            ray_origins = self.origin + lens_offsets
+            directions -= lens_offsets
+        else:
+            ray_origins = np.empty((count, 3))
+            ray_origins[:] = self.origin
+        return RayBatch(ray_origins, directions, times)
+
+    @staticmethod
+    def random_unit_disk_point(rng: np.random.Generator | None = None) -> np.ndarray:
+        point = Camera.random_unit_disk_points(1, np.random if rng is None else rng)[0]
+        return np.array([point[0], point[1], 0.0], dtype=np.float32)
+
+    @staticmethod
+    def random_unit_disk_points(count: int, rng: np.random.Generator | PathSampler) -> np.ndarray:
+        return Camera.concentric_disk_points(rng.random((count, 2)))
+
     @staticmethod
-    def random_unit_disk_point() -> np.ndarray:
-        while True:
-            point = np.array([np.random.uniform(-1.0, 1.0), np.random.uniform(-1.0, 1.0), 0.0], dtype=np.float32)
-            if np.dot(point, point) < 1.0:
-                return point
+    def concentric_disk_points(samples: np.ndarray) -> np.ndarray:
+        #shirley and chiu's concentric mapping of the unit square onto the unit disk, closed form like the polar
+        #one but it keeps neighbouring samples together, so stratified lens samples stay stratified
+        offset = 2.0 * samples - 1.0
+        x, y = offset[:, 0], offset[:, 1]
+        x_is_larger = np.abs(x) > np.abs(y)
+        radius = np.where(x_is_larger, x, y)
+        #the center of the square has no angle and maps to the center of the disk
+        ratio = np.divide(np.where(x_is_larger, y, x), radius, out=np.zeros(len(samples)), where=radius != 0.0)
+        theta = (np.pi / 4) * np.where(x_is_larger, ratio, 2.0 - ratio)
+        return np.stack((radius * np.cos(theta), radius * np.sin(theta)), axis=1)
@@ -0,0 +1,120 @@
+from dataclasses import dataclass
+import numpy as np
+
+from camera import Camera
+from flat_scene import FlatScene
+from render_settings import RenderSettings
+from sampler import STREAM_CAMERA, PathSampler, sampler_key
+
+#b3 spline taps of the a-trous wavelet, spread 2**iteration pixels apart
+ATROUS_TAPS = np.array([1.0 / 16.0, 1.0 / 4.0, 3.0 / 8.0, 1.0 / 4.0, 1.0 / 16.0])
+
+
+@dataclass
+class FeatureBuffers:
+    #first hit of the camera rays averaged over the pixel, misses leave albedo 1, normal 0 and depth 0
+    albedo: np.ndarray
+    normal: np.ndarray
+    depth: np.ndarray
+
+
+def render_features(camera: Camera,
+                    scene: FlatScene,
+                    settings: RenderSettings,
+                    samples_per_pixel: int = 4,
+                    seed: int | None = None) -> FeatureBuffers:
+    #a primary ray only pass, a handful of jittered samples per pixel is enough for clean guides
+    key = sampler_key(seed)
+    pixel_count = settings.width * settings.height
+    pixel_y, pixel_x = np.divmod(np.arange(pixel_count), settings.width)
+    sample_pixel = np.repeat(np.arange(pixel_count), samples_per_pixel)
+    sample_index = np.tile(np.arange(samples_per_pixel), pixel_count)
+    feature_sum = np.zeros((pixel_count, 7))
+    pixel_spread_angle = camera.pixel_spread_angle(settings.height)
+
+    for start in range(0, sample_pixel.size, settings.max_rays_per_batch):
+        batch_pixel = sample_pixel[start:start + settings.max_rays_per_batch]
+        #the same camera streams as the render, so sample s of a pixel sees the same point in both
+        sampler = PathSampler(key, batch_pixel, sample_index[start:start + settings.max_rays_per_batch])
+        rays = camera.pixel_rays(pixel_x[batch_pixel], pixel_y[batch_pixel], settings.width, settings.height,
+                                 sampler.stream(0, STREAM_CAMERA))
+        hit_mask, hit_records = scene.intersect(rays, time_min=1e-3, time_max=float('inf'),
+                                                coherent=settings.packet_traversal, backend=settings.backend)
+
+        features = np.zeros((len(rays), 7))
+        features[:, :3] = 1.0
+        distance = hit_records.time * np.linalg.norm(rays.directions[hit_mask], axis=1)
+        hit_records.texture_footprint = hit_records.texture_footprint * (pixel_spread_angle * distance)
+        hits = np.flatnonzero(hit_mask)
+        for material_index in np.unique(hit_records.material_index):
+            group = np.flatnonzero(hit_records.material_index == material_index)
+            features[hits[group], :3] = scene.materials[material_index].albedo_batch(hit_records.subset(group))
+        features[hits, 3:6] = hit_records.normal
+        features[hits, 6] = distance
+        for channel in range(7):
+            feature_sum[:, channel] += np.bincount(batch_pixel, features[:, channel], minlength=pixel_count)
+
+    #camera rows count from the bottom, image rows from the top
+    features = (feature_sum / samples_per_pixel).reshape(settings.height, settings.width, 7)[::-1]
+    return FeatureBuffers(albedo=features[..., :3], normal=features[..., 3:6], depth=features[..., 6])
+
+
+def _shifted(padded: np.ndarray, row_offset: int, column_offset: int, pad: int) -> np.ndarray:
+    height = padded.shape[0] - 2 * pad
+    width = padded.shape[1] - 2 * pad
+    return padded[pad + row_offset:pad + row_offset + height, pad + column_offset:pad + column_offset + width]
+
+
+def denoise_atrous(image: np.ndarray,
+                   features: FeatureBuffers,
+                   iterations: int = 3,
+                   color_sigma: float = 1.0,
+                   normal_sigma: float = 0.3,
+                   albedo_sigma: float = 0.2,
+                   depth_sigma: float = 0.05) -> np.ndarray:
+    #edge avoiding a-trous wavelet filter, the image is divided by albedo first so texture detail is not blurred
+    height, width = image.shape[:2]
+    albedo = np.maximum(features.albedo, 1e-3)
+    irradiance = image / albedo
+    guides = [(features.normal, normal_sigma), (features.albedo, albedo_sigma)]
+    depth = features.depth[..., None]
+
+    for iteration in range(iterations):
+        step = 1 << iteration
+        pad = 2 * step
+        padding = ((pad, pad), (pad, pad), (0, 0))
+        padded_irradiance = np.pad(irradiance, padding, mode='edge')
+        padded_guides = [(np.pad(guide, padding, mode='edge'), guide, sigma) for guide, sigma in guides]
+        padded_depth = np.pad(depth, padding, mode='edge')
+        #the color edge stopping tightens as the filter widens
+        color_scale = 2.0 ** iteration / (color_sigma * color_sigma)
+        depth_scale = 1.0 / (depth_sigma * step * np.maximum(depth[..., 0], 1e-3))
+
+        weighted_sum = np.zeros_like(irradiance)
+        weight_sum = np.zeros((height, width))
+        for row_tap, row_weight in enumerate(ATROUS_TAPS):
+            for column_tap, column_weight in enumerate(ATROUS_TAPS):
+                row_offset = (row_tap - 2) * step
+                column_offset = (column_tap - 2) * step
+                neighbor = _shifted(padded_irradiance, row_offset, column_offset, pad)
+                exponent = color_scale * np.sum((neighbor - irradiance) ** 2, axis=-1)
+                for padded_guide, guide, sigma in padded_guides:
+                    difference = _shifted(padded_guide, row_offset, column_offset, pad) - guide
+                    exponent += np.sum(difference * difference, axis=-1) / (sigma * sigma)
+                depth_difference = _shifted(padded_depth, row_offset, column_offset, pad) - depth
+                exponent += np.abs(depth_difference[..., 0]) * depth_scale
+                weight = row_weight * column_weight * np.exp(-exponent)
+                weighted_sum += weight[..., None] * neighbor
+                weight_sum += weight
+        irradiance = weighted_sum / weight_sum[..., None]
+    return (irradiance * albedo).astype(image.dtype)
+
+
+def denoise_render(image: np.ndarray,
+                   camera: Camera,
+                   scene: FlatScene,
+                   settings: RenderSettings,
+                   seed: int | None = None) -> np.ndarray:
+    #the pipeline stage behind RenderSettings.denoise
+    features = render_features(camera, scene, settings, seed=seed)
+    return denoise_atrous(image, features)
@@ -0,0 +1,284 @@
+import argparse
+import dataclasses
+import itertools
+import multiprocessing
+import os
+import queue
+import statistics
+import threading
+import time
+from multiprocessing.connection import Client, Connection, Listener, wait
+import numpy as np
+
+from camera import Camera
+from denoise import denoise_render
+from flat_scene import FlatScene
+from instrumentation import Instrumentation
+from render_settings import RenderSettings
+from sampler import resolve_seed, sampler_key
+from tile_scheduler import schedule_order
+from wavefront import render_tile_sums, tile_costs, tiles
+
+#tiles sent to a worker ahead of its results, so it never sits idle waiting for the next one
+TILES_IN_FLIGHT = 2
+#a tile running this many times longer than the median finished tile is also given to an idle worker
+STRAGGLER_FACTOR = 3.0
+#a worker silent for this many seconds while it holds tiles is dropped and its tiles go to the others
+WORKER_TIMEOUT = 120.0
+#connections are authenticated with this key, set RAYTRACER_AUTHKEY when listening beyond localhost
+DEFAULT_AUTHKEY = os.environ.get('RAYTRACER_AUTHKEY', 'raytracer').encode()
+#failures a worker may see before it stops trying to reconnect
+CONNECT_ATTEMPTS = 20
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    host, _, port = address.rpartition(':')
+    return host or 'localhost', int(port)
+
+
+def run_worker(address: tuple[str, int], authkey: bytes = DEFAULT_AUTHKEY):
+    #serves one coordinator until it says stop or goes away. the scene arrives once, after that only tile
+    #bounds and sampler keys do, and every tile goes back as sample sums so the coordinator can add them up
+    for attempt in range(CONNECT_ATTEMPTS):
+        try:
+            connection = Client(address, authkey=authkey)
+            break
+        except ConnectionRefusedError:
+            time.sleep(0.1 * (attempt + 1))
+    else:
+        raise ConnectionRefusedError(f'No coordinator at {address[0]}:{address[1]}')
+
+    camera = scene = settings = None
+    with connection:
+        connection.send(('ready', os.getpid()))
+        while True:
+            try:
+                message = connection.recv()
+            except EOFError:
+                return
+            kind = message[0]
+            if kind == 'scene':
+                _, camera, scene, settings = message
+            elif kind == 'tile':
+                _, render_index, tile_index, tile, key, profile = message
+                start = time.perf_counter()
+                color_sum, sample_counts = render_tile_sums(*tile, camera, scene, settings, key, profile)
+                connection.send(('tile', render_index, tile_index, color_sum, sample_counts, profile,
+                                 time.perf_counter() - start))
+            elif kind == 'stop':
+                return
+
+
+@dataclasses.dataclass
+class _Worker:
+    connection: Connection
+    #tile index to the time it was sent
+    in_flight: dict[int, float] = dataclasses.field(default_factory=dict)
+    last_heard: float = dataclasses.field(default_factory=time.monotonic)
+
+
+class TileCoordinator:
+    #listens for workers, local or on other machines, and deals them the tiles of one image at a time.
+    #tiles are handed out as workers finish, so faster workers end up with more of them, the tiles of a worker
+    #that dies or goes silent are dealt again, and once nothing is left to deal, tiles that run far longer than
+    #usual are given to an idle worker too, whichever copy finishes first is kept
+    def __init__(self, address: tuple[str, int] = ('localhost', 0), authkey: bytes = DEFAULT_AUTHKEY,
+                 worker_timeout: float = WORKER_TIMEOUT):
+        self.listener = Listener(address, authkey=authkey)
+        self.address = self.listener.address
+        self.authkey = authkey
+        self.worker_timeout = worker_timeout
+        self._arrivals = queue.Queue()
+        self._closed = False
+        #results of an earlier render still on their way are told apart by this
+        self._render_indices = itertools.count()
+        self._local_workers: list[multiprocessing.Process] = []
+        #accept blocks, so new workers are taken in on a thread and picked up between messages
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while not self._closed:
+            try:
+                connection = self.listener.accept()
+            except (OSError, multiprocessing.AuthenticationError):
+                #closed listener, or a client without the key
+                continue
+            self._arrivals.put(connection)
+
+    def start_local_workers(self, count: int):
+        for _ in range(count):
+            process = multiprocessing.Process(target=run_worker, args=(self.address, self.authkey), daemon=True)
+            process.start()
+            self._local_workers.append(process)
+
+    def render(self,
+               camera: Camera,
+               scene: FlatScene,
+               settings: RenderSettings,
+               seed: int | None = None,
+               instrumentation: Instrumentation | None = None) -> tuple[np.ndarray, np.ndarray]:
+        #paths draw from the same counter based streams as in the single machine renderers, so the image does not
+        #depend on which worker rendered what
+        render_index = next(self._render_indices)
+        #resolved once, the denoiser keys its guide pass with it too
+        seed = resolve_seed(seed)
+        key = sampler_key(seed)
+        #hardest tiles are dealt first, idle workers get straggler copies instead of split tiles
+        tile_list = tiles(settings)
+        costs = tile_costs(camera, scene, settings, tile_list, 1)
+        tile_list = [tile_list[index] for index in schedule_order(tile_list, settings.tile_size, costs)]
+        color_sum = np.zeros((settings.height, settings.width, 3))
+        sample_counts = np.zeros((settings.height, settings.width), dtype=np.int32)
+        pending = list(range(len(tile_list)))[::-1]
+        finished = set()
+        tile_seconds = []
+        workers: list[_Worker] = []
+        scene_message = ('scene', camera, scene, settings)
+        last_worker_seen = time.monotonic()
+
+        def drop(worker: _Worker):
+            workers.remove(worker)
+            worker.connection.close()
+            for tile_index in worker.in_flight:
+                if tile_index not in finished and not any(tile_index in other.in_flight for other in workers):
+                    pending.append(tile_index)
+
+        def send(worker: _Worker, message) -> bool:
+            try:
+                worker.connection.send(message)
+                return True
+            except OSError:
+                drop(worker)
+                return False
+
+        def send_tile(worker: _Worker, tile_index: int) -> bool:
+            tile = tile_list[tile_index]
+            profile = None if instrumentation is None else instrumentation.tile_profile(tile)
+            if not send(worker, ('tile', render_index, tile_index, tile, key, profile)):
+                return False
+            #an idle worker had nothing to say, its silence counts from its first tile
+            if not worker.in_flight:
+                worker.last_heard = time.monotonic()
+            worker.in_flight[tile_index] = time.monotonic()
+            return True
+
+        while len(finished) < len(tile_list):
+            while not self._arrivals.empty():
+                worker = _Worker(self._arrivals.get())
+                workers.append(worker)
+                send(worker, scene_message)
+
+            now = time.monotonic()
+            for worker in list(workers):
+                if worker.in_flight and now - worker.last_heard > self.worker_timeout:
+                    drop(worker)
+            if workers:
+                last_worker_seen = now
+            elif now - last_worker_seen > self.worker_timeout:
+                raise RuntimeError(f'No workers connected to {self.address[0]}:{self.address[1]} '
+                                   f'for {self.worker_timeout:.0f}s with {len(tile_list) - len(finished)} tiles left')
+
+            #deal tiles, least loaded workers first
+            for worker in sorted(workers, key=lambda worker: len(worker.in_flight)):
+                while pending and len(worker.in_flight) < TILES_IN_FLIGHT and worker in workers:
+                    send_tile(worker, pending.pop())
+            if not pending and tile_seconds:
+                #only tiles running on a single worker get a second copy
+                slow_after = STRAGGLER_FACTOR * statistics.median(tile_seconds)
+                copies = {}
+                for worker in workers:
+                    for tile_index, sent in worker.in_flight.items():
+                        copies.setdefault(tile_index, []).append(sent)
+                stragglers = [tile_index for tile_index, sent in copies.items()
+                              if tile_index not in finished and len(sent) == 1 and now - sent[0] > slow_after]
+                for worker in [worker for worker in workers if not worker.in_flight]:
+                    if not stragglers:
+                        break
+                    send_tile(worker, stragglers.pop())
+
+            if not workers:
+                time.sleep(0.05)
+                continue
+            for connection in wait([worker.connection for worker in workers], timeout=0.05):
+                worker = next((worker for worker in workers if worker.connection is connection), None)
+                if worker is None:
+                    continue
+                try:
+                    message = connection.recv()
+                except (EOFError, OSError):
+                    drop(worker)
+                    continue
+                worker.last_heard = time.monotonic()
+                if message[0] != 'tile' or message[1] != render_index:
+                    continue
+                _, _, tile_index, tile_color_sum, tile_sample_counts, profile, seconds = message
+                worker.in_flight.pop(tile_index, None)
+                if tile_index in finished:
+                    continue
+                finished.add(tile_index)
+                tile_seconds.append(seconds)
+                row_start, row_end, column_start, column_end = tile_list[tile_index]
+                color_sum[row_start:row_end, column_start:column_end] = tile_color_sum
+                sample_counts[row_start:row_end, column_start:column_end] = tile_sample_counts
+                if instrumentation is not None:
+                    instrumentation.add_tile(profile)
+
+        #a copy of a straggler still running elsewhere is not waited for, its result is ignored when it comes.
+        #the workers wait for the next render
+        for worker in workers:
+            self._arrivals.put(worker.connection)
+        image = (color_sum / np.maximum(sample_counts, 1)[..., None]).astype(np.float32)
+        if settings.denoise:
+            image = denoise_render(image, camera, scene, settings, seed)
+        return image, sample_counts
+
+    def close(self):
+        self._closed = True
+        while not self._arrivals.empty():
+            connection = self._arrivals.get()
+            try:
+                connection.send(('stop',))
+            except OSError:
+                pass
+            connection.close()
+        self.listener.close()
+        for process in self._local_workers:
+            process.join(timeout=5.0)
+            if process.is_alive():
+                process.terminate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+
+def render_image_distributed(camera: Camera,
+                             scene: FlatScene,
+                             settings: RenderSettings,
+                             seed: int | None = None,
+                             max_workers: int | None = None,
+                             instrumentation: Instrumentation | None = None,
+                             address: tuple[str, int] | None = None,
+                             authkey: bytes = DEFAULT_AUTHKEY) -> tuple[np.ndarray, np.ndarray]:
+    #max_workers local workers are started, by default one per cpu when no address is given and none otherwise,
+    #workers on other machines join with: python distributed.py HOST:PORT
+    if max_workers is None:
+        max_workers = (os.cpu_count() or 4) if address is None else 0
+    with TileCoordinator(address or ('localhost', 0), authkey) as coordinator:
+        if address is not None:
+            print(f'waiting for workers on {coordinator.address[0]}:{coordinator.address[1]}')
+        coordinator.start_local_workers(max_workers)
+        return coordinator.render(camera, scene, settings, seed, instrumentation)
+
+
+def main(arguments: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Render tiles for a coordinator started with render_scene.py --listen')
+    parser.add_argument('address', help='HOST:PORT the coordinator listens on')
+    arguments = parser.parse_args(arguments)
+    run_worker(parse_address(arguments.address))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,688 @@
+from typing import Callable, Self
+import numpy as np
+
+from aabb import Axis_Aligned_Bounding_Box
+from ray import Ray
+
+BIN_COUNT = 12
+MAX_LEAF_SIZE = 4
+#a refitted tree whose surface area cost grew past this multiple of its cost when built should be rebuilt
+MAX_REFIT_COST_RATIO = 1.5
+#rays traced together by traverse_packets, a packet is culled or opened as a whole
+PACKET_SIZE = 64
+#a packet wider than this fraction of a node's longest side hands the node to its rays to walk one by one
+PACKET_HANDOFF_WIDTH = 0.5
+#everything needed to rebuild a FlatBVH without running the builder again
+ARRAY_NAMES = ('node_minimum', 'node_maximum', 'node_offset', 'node_count', 'primitive_indices')
+
+
+def surface_area(minimums: np.ndarray, maximums: np.ndarray) -> np.ndarray:
+    extent = maximums - minimums
+    return 2.0 * (extent[..., 0] * extent[..., 1] + extent[..., 1] * extent[..., 2] + extent[..., 2] * extent[..., 0])
+
+
+def direction_packets(directions: np.ndarray, packet_size: int) -> np.ndarray:
+    #groups rays pointing the same way, (P, packet_size) ray indices padded with -1. directions are binned on a grid
+    #over the plane facing their mean direction, for camera rays close to the image plane, and every cell is cut
+    #into packets. rays more than ~85 degrees off the mean share one cell
+    ray_count = len(directions)
+    with np.errstate(invalid='ignore'):
+        unit_directions = np.nan_to_num(directions / np.linalg.norm(directions, axis=1, keepdims=True))
+    forward = unit_directions.sum(axis=0)
+    forward = forward / np.linalg.norm(forward) if np.linalg.norm(forward) > 0.0 else np.array([0.0, 0.0, 1.0])
+    helper = np.array([0.0, 1.0, 0.0]) if abs(forward[1]) < 0.9 else np.array([1.0, 0.0, 0.0])
+    right = np.cross(helper, forward)
+    right = right / np.linalg.norm(right)
+    up = np.cross(forward, right)
+
+    depth = unit_directions @ forward
+    ahead = depth > 0.1
+    plane = np.zeros((ray_count, 2))
+    plane[ahead] = unit_directions[ahead] @ np.stack((right, up), axis=1) / depth[ahead, None]
+    cell = np.full(ray_count, -1, dtype=np.int64)
+    if ahead.any():
+        plane_minimum = plane[ahead].min(axis=0)
+        plane_extent = np.maximum(plane[ahead].max(axis=0) - plane_minimum, 1e-9)
+        #about half a packet per cell when the rays cover the grid evenly
+        cell_size = np.sqrt(plane_extent[0] * plane_extent[1] * packet_size / (2.0 * np.count_nonzero(ahead)))
+        grid = np.clip(np.ceil(plane_extent / max(cell_size, 1e-9)), 1, 4096).astype(np.int64)
+        cells = np.minimum(((plane[ahead] - plane_minimum) / plane_extent * grid).astype(np.int64), grid - 1)
+        cell[ahead] = cells[:, 1] * grid[0] + cells[:, 0]
+
+    order = np.argsort(cell, kind='stable')
+    _, cell_starts, cell_counts = np.unique(cell[order], return_index=True, return_counts=True)
+    cell_packets = -(-cell_counts // packet_size)
+    position = np.arange(ray_count) - np.repeat(cell_starts, cell_counts)
+    packet = np.repeat(np.cumsum(cell_packets) - cell_packets, cell_counts) + position // packet_size
+    packet_rays = np.full((int(cell_packets.sum()), packet_size), -1, dtype=np.int64)
+    packet_rays[packet, position % packet_size] = order
+    return packet_rays
+
+
+class FlatBVH:
+    #nodes are stored level by level, an interior node's children sit next to each other starting at
+    #node_offset, a leaf's node_offset is its first entry in primitive_indices
+    def __init__(self, objects: list):
+        if len(objects) == 0:
+            raise ValueError('Empty objects list for constructing FlatBVH')
+
+        boxes = [object.bounding_box() for object in objects]
+        minimums = np.array([box.minimum_vertice for box in boxes], dtype=np.float64)
+        maximums = np.array([box.maximum_vertice for box in boxes], dtype=np.float64)
+        self._build(minimums, maximums)
+        self.objects = objects
+
+    @classmethod
+    def from_bounds(cls,
+                    minimums: np.ndarray,
+                    maximums: np.ndarray,
+                    max_leaf_size: int = MAX_LEAF_SIZE,
+                    subtrees: list[tuple[Self, int]] | None = None) -> Self:
+        #subtrees are (bvh, first primitive) pairs of trees already built over a run of the primitives, numbered
+        #from 0 in their own tree. they are placed in the tree as they are instead of being built again
+        if len(minimums) == 0:
+            raise ValueError('Empty bounds for constructing FlatBVH')
+        bvh = cls.__new__(cls)
+        minimums = np.asarray(minimums, dtype=np.float64)
+        maximums = np.asarray(maximums, dtype=np.float64)
+        if subtrees:
+            bvh._build_with_subtrees(minimums, maximums, max_leaf_size, subtrees)
+        else:
+            bvh._build(minimums, maximums, max_leaf_size)
+        bvh.objects = None
+        return bvh
+
+    @classmethod
+    def from_arrays(cls, arrays: dict[str, np.ndarray], max_depth: int) -> Self:
+        bvh = cls.__new__(cls)
+        for name in ARRAY_NAMES:
+            setattr(bvh, name, np.asarray(arrays[name]))
+        bvh.max_depth = max_depth
+        bvh.objects = None
+        bvh._finish()
+        return bvh
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        return {name: getattr(self, name) for name in ARRAY_NAMES}
+
+    def _finish(self):
+        self._update_box()
+        self.node_visits = 0
+        self.build_cost = self.sah_cost()
+        self._refit_structure = None
+
+    def _update_box(self):
+        self.box = Axis_Aligned_Bounding_Box(self.node_minimum[0].astype(np.float32),
+                                             self.node_maximum[0].astype(np.float32))
+
+    def __getstate__(self) -> dict:
+        #the visit counter is a statistic and the refit structure is rebuilt on demand, neither is part of the tree
+        state = self.__dict__.copy()
+        state['node_visits'] = 0
+        state['_refit_structure'] = None
+        return state
+
+    def sah_cost(self) -> float:
+        #expected intersection work of a random ray through the root, one per interior node and one per primitive
+        areas = surface_area(self.node_minimum, self.node_maximum)
+        work = np.where(self.node_count > 0, self.node_count, 1)
+        return float(np.dot(areas, work) / max(areas[0], 1e-300))
+
+    def needs_rebuild(self) -> bool:
+        return self.sah_cost() > MAX_REFIT_COST_RATIO * self.build_cost
+
+    def _build_refit_structure(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        #parent and depth of every node, the leaf holding each primitive and where each primitive sits in
+        #primitive_indices, all fixed for as long as the topology is
+        node_total = len(self.node_count)
+        parent = np.full(node_total, -1, dtype=np.int64)
+        depth = np.zeros(node_total, dtype=np.int64)
+        nodes = np.array([0], dtype=np.int64)
+        level = 0
+        while nodes.size:
+            depth[nodes] = level
+            interior = nodes[self.node_count[nodes] == 0]
+            children = np.stack((self.node_offset[interior], self.node_offset[interior] + 1), axis=1).ravel()
+            parent[children] = np.repeat(interior, 2)
+            nodes = children
+            level += 1
+
+        #leaves cover primitive_indices in consecutive runs
+        leaves = np.flatnonzero(self.node_count > 0)
+        leaves = leaves[np.argsort(self.node_offset[leaves])]
+        position_leaf = np.repeat(leaves, self.node_count[leaves])
+        primitive_position = np.empty_like(self.primitive_indices)
+        primitive_position[self.primitive_indices] = np.arange(len(self.primitive_indices))
+        return parent, depth, position_leaf, primitive_position
+
+    def refit(self, minimums: np.ndarray, maximums: np.ndarray, primitives: np.ndarray | None = None) -> float:
+        #new primitive bounds under the same topology, node boxes are recomputed bottom-up
+        #when primitives is given only those moved and every subtree without one of them is left untouched
+        #returns the surface area cost of the refitted tree
+        if self._refit_structure is None:
+            self._refit_structure = self._build_refit_structure()
+        parent, depth, position_leaf, primitive_position = self._refit_structure
+        for name in ('node_minimum', 'node_maximum'):
+            if not getattr(self, name).flags.writeable:
+                setattr(self, name, getattr(self, name).copy())
+
+        if primitives is None:
+            leaves = np.unique(position_leaf)
+        else:
+            leaves = np.unique(position_leaf[primitive_position[np.asarray(primitives, dtype=np.int64)]])
+        if leaves.size:
+            counts = self.node_count[leaves]
+            first_positions = np.cumsum(counts) - counts
+            positions = np.repeat(self.node_offset[leaves] - first_positions, counts) + np.arange(counts.sum())
+            ordered = self.primitive_indices[positions]
+            self.node_minimum[leaves] = np.minimum.reduceat(minimums[ordered], first_positions, axis=0)
+            self.node_maximum[leaves] = np.maximum.reduceat(maximums[ordered], first_positions, axis=0)
+
+            ancestors = []
+            nodes = leaves
+            while nodes.size:
+                nodes = np.unique(parent[nodes])
+                nodes = nodes[nodes >= 0]
+                ancestors.append(nodes)
+            ancestors = np.unique(np.concatenate(ancestors))
+            #deepest first so both children are final before their parent reads them
+            for level in range(int(depth[ancestors].max(initial=0)), -1, -1):
+                nodes = ancestors[depth[ancestors] == level]
+                left = self.node_offset[nodes]
+                self.node_minimum[nodes] = np.minimum(self.node_minimum[left], self.node_minimum[left + 1])
+                self.node_maximum[nodes] = np.maximum(self.node_maximum[left], self.node_maximum[left + 1])
+        self._update_box()
+        return self.sah_cost()
+
+    def _build_with_subtrees(self,
+                             minimums: np.ndarray,
+                             maximums: np.ndarray,
+                             max_leaf_size: int,
+                             subtrees: list[tuple[Self, int]]):
+        #the primitives no subtree covers and one box per subtree are built into a top level where every subtree
+        #box gets a leaf of its own, then each of those leaves is swapped for its subtree's root and the rest of
+        #the subtree's nodes are appended
+        covered = np.zeros(len(minimums), dtype=bool)
+        for subtree, first in subtrees:
+            covered[first:first + len(subtree.primitive_indices)] = True
+        loose = np.flatnonzero(~covered)
+        subtree_roots = np.arange(len(subtrees)) + len(loose)
+        self._build(np.concatenate((minimums[loose], [subtree.node_minimum[0] for subtree, _ in subtrees])),
+                    np.concatenate((maximums[loose], [subtree.node_maximum[0] for subtree, _ in subtrees])),
+                    max_leaf_size,
+                    solitary=np.isin(np.arange(len(loose) + len(subtrees)), subtree_roots))
+
+        #subtree boxes leave primitive_indices, the leaves after them move down as many places
+        is_loose = self.primitive_indices < len(loose)
+        removed_before = np.cumsum(~is_loose) - ~is_loose
+        leaves = np.flatnonzero(self.node_count > 0)
+        leaf_primitive = self.primitive_indices[self.node_offset[leaves]]
+        self.node_offset[leaves] -= removed_before[self.node_offset[leaves]]
+        subtree_leaves = np.empty(len(subtrees), dtype=np.int64)
+        subtree_leaves[leaf_primitive[leaf_primitive >= len(loose)] - len(loose)] = leaves[leaf_primitive >= len(loose)]
+
+        node_arrays = {name: [getattr(self, name)] for name in ARRAY_NAMES}
+        node_arrays['primitive_indices'] = [loose[self.primitive_indices[is_loose]]]
+        node_total = len(self.node_count)
+        primitive_total = int(np.count_nonzero(is_loose))
+        for (subtree, first), leaf in zip(subtrees, subtree_leaves):
+            #subtree node i > 0 lands at node_total + i - 1, which keeps every pair of children side by side
+            node_offset = np.where(subtree.node_count > 0, subtree.node_offset + primitive_total,
+                                   subtree.node_offset + node_total - 1)
+            self.node_minimum[leaf] = subtree.node_minimum[0]
+            self.node_maximum[leaf] = subtree.node_maximum[0]
+            self.node_offset[leaf] = node_offset[0]
+            self.node_count[leaf] = subtree.node_count[0]
+            node_arrays['node_minimum'].append(subtree.node_minimum[1:])
+            node_arrays['node_maximum'].append(subtree.node_maximum[1:])
+            node_arrays['node_offset'].append(node_offset[1:])
+            node_arrays['node_count'].append(subtree.node_count[1:])
+            node_arrays['primitive_indices'].append(subtree.primitive_indices + first)
+            node_total += len(subtree.node_count) - 1
+            primitive_total += len(subtree.primitive_indices)
+        for name, arrays in node_arrays.items():
+            setattr(self, name, np.concatenate(arrays))
+        _, depth, _, _ = self._build_refit_structure()
+        self.max_depth = int(depth.max())
+        self._finish()
+
+    def _build(self,
+               minimums: np.ndarray,
+               maximums: np.ndarray,
+               max_leaf_size: int = MAX_LEAF_SIZE,
+               solitary: np.ndarray | None = None):
+        #built one tree level at a time, every node of a level is binned and split together
+        #solitary primitives, when given, are split until each is alone in its leaf
+        primitive_count = len(minimums)
+        #bounds are kept in the same order as primitive_indices so each level reads them almost sequentially
+        minimums = minimums.copy()
+        maximums = maximums.copy()
+        centroids = 0.5 * (minimums + maximums)
+        primitive_indices = np.arange(primitive_count, dtype=np.int64)
+        node_minimum = np.zeros((2 * primitive_count, 3))
+        node_maximum = np.zeros((2 * primitive_count, 3))
+        node_offset = np.zeros(2 * primitive_count, dtype=np.int64)
+        node_count = np.zeros(2 * primitive_count, dtype=np.int64)
+
+        starts = np.array([0], dtype=np.int64)
+        counts = np.array([primitive_count], dtype=np.int64)
+        nodes = np.array([0], dtype=np.int64)
+        node_total = 1
+        depth = 0
+        while True:
+            first_positions = np.cumsum(counts) - counts
+            segment = np.repeat(np.arange(len(nodes)), counts)
+            positions = np.repeat(starts - first_positions, counts) + np.arange(segment.size)
+            node_minimum[nodes] = np.minimum.reduceat(minimums[positions], first_positions, axis=0)
+            node_maximum[nodes] = np.maximum.reduceat(maximums[positions], first_positions, axis=0)
+
+            leaf = counts <= max_leaf_size
+            if solitary is not None:
+                shared = np.bincount(segment, weights=solitary[primitive_indices[positions]], minlength=len(nodes))
+                leaf &= (shared == 0) | (counts == 1)
+            node_offset[nodes[leaf]] = starts[leaf]
+            node_count[nodes[leaf]] = counts[leaf]
+            if leaf.all():
+                break
+
+            #keep only the primitives of nodes being split
+            splitting = ~leaf
+            kept = splitting[segment]
+            segment = (np.cumsum(splitting) - 1)[segment[kept]]
+            positions = positions[kept]
+            starts = starts[splitting]
+            counts = counts[splitting]
+            nodes = nodes[splitting]
+
+            goes_right = self._sah_split(minimums[positions], maximums[positions], centroids[positions],
+                                         segment, counts)
+            order = positions[np.lexsort((goes_right, segment))]
+            for array in (primitive_indices, minimums, maximums, centroids):
+                array[positions] = array[order]
+            left_counts = counts - np.bincount(segment, weights=goes_right, minlength=len(nodes)).astype(np.int64)
+
+            children = node_total + 2 * np.arange(len(nodes))
+            node_offset[nodes] = children
+            node_total += 2 * len(nodes)
+            starts = np.stack((starts, starts + left_counts), axis=1).ravel()
+            counts = np.stack((left_counts, counts - left_counts), axis=1).ravel()
+            nodes = np.stack((children, children + 1), axis=1).ravel()
+            depth += 1
+
+        self.node_minimum = node_minimum[:node_total]
+        self.node_maximum = node_maximum[:node_total]
+        self.node_offset = node_offset[:node_total]
+        self.node_count = node_count[:node_total]
+        self.primitive_indices = primitive_indices
+        self.max_depth = depth
+        self._finish()
+
+    @staticmethod
+    def _sah_split(minimums: np.ndarray,
+                   maximums: np.ndarray,
+                   centroids: np.ndarray,
+                   segment: np.ndarray,
+                   counts: np.ndarray) -> np.ndarray:
+        #primitives of several nodes at once, segment says which node each one belongs to
+        node_count = len(counts)
+        first_positions = np.cumsum(counts) - counts
+        centroid_minimum = np.minimum.reduceat(centroids, first_positions, axis=0)
+        centroid_extent = np.maximum.reduceat(centroids, first_positions, axis=0) - centroid_minimum
+
+        #bin every primitive along all three axes at once
+        scale = BIN_COUNT / np.where(centroid_extent > 0.0, centroid_extent, 1.0)
+        bins = np.minimum(((centroids - centroid_minimum[segment]) * scale[segment]).astype(np.int64), BIN_COUNT - 1)
+        flat_bins = (bins + (segment[:, None] * 3 + np.arange(3)) * BIN_COUNT).ravel()
+
+        bin_counts = np.bincount(flat_bins, minlength=node_count * 3 * BIN_COUNT).reshape(node_count, 3, BIN_COUNT)
+        #ufunc.at is only fast on 1d arrays, so bounds are gathered one coordinate at a time
+        bin_minimum = np.full((3, node_count * 3 * BIN_COUNT), np.inf)
+        bin_maximum = np.full((3, node_count * 3 * BIN_COUNT), -np.inf)
+        for coordinate in range(3):
+            np.minimum.at(bin_minimum[coordinate], flat_bins, np.repeat(minimums[:, coordinate], 3))
+            np.maximum.at(bin_maximum[coordinate], flat_bins, np.repeat(maximums[:, coordinate], 3))
+        bin_minimum = np.moveaxis(bin_minimum, 0, -1).reshape(node_count, 3, BIN_COUNT, 3)
+        bin_maximum = np.moveaxis(bin_maximum, 0, -1).reshape(node_count, 3, BIN_COUNT, 3)
+
+        #splitting after bin i puts bins 0..i on the left
+        left_count = np.cumsum(bin_counts, axis=2)[:, :, :-1]
+        right_count = counts[:, None, None] - left_count
+        left_minimum = np.minimum.accumulate(bin_minimum, axis=2)[:, :, :-1]
+        left_maximum = np.maximum.accumulate(bin_maximum, axis=2)[:, :, :-1]
+        right_minimum = np.minimum.accumulate(bin_minimum[:, :, ::-1], axis=2)[:, :, ::-1][:, :, 1:]
+        right_maximum = np.maximum.accumulate(bin_maximum[:, :, ::-1], axis=2)[:, :, ::-1][:, :, 1:]
+
+        with np.errstate(invalid='ignore'):
+            cost = (surface_area(left_minimum, left_maximum) * left_count
+                    + surface_area(right_minimum, right_maximum) * right_count)
+        cost[(left_count == 0) | (right_count == 0) | (centroid_extent <= 0.0)[:, :, None]] = np.inf
+        cost = cost.reshape(node_count, -1)
+        best = np.argmin(cost, axis=1)
+        axis, split_bin = np.divmod(best, BIN_COUNT - 1)
+        goes_right = bins[np.arange(len(segment)), axis[segment]] > split_bin[segment]
+
+        #every centroid of a node in the same spot, fall back to splitting its range in half
+        no_split = ~np.isfinite(cost[np.arange(node_count), best])
+        if no_split.any():
+            position_in_node = np.arange(len(segment)) - first_positions[segment]
+            halves = position_in_node >= (counts // 2)[segment]
+            goes_right = np.where(no_split[segment], halves, goes_right)
+        return goes_right
+
+    def bounding_box(self) -> Axis_Aligned_Bounding_Box:
+        return self.box
+
+    def _slab(self, nodes: np.ndarray, origin: np.ndarray, inverse_direction: np.ndarray,
+              time_min, time_max) -> tuple[np.ndarray, np.ndarray]:
+        #nan from 0 * inf is ignored by fmin/fmax so axis aligned rays still work
+        time_reached = (self.node_minimum[nodes] - origin) * inverse_direction
+        time_exited = (self.node_maximum[nodes] - origin) * inverse_direction
+        entry = np.fmax(np.fmax.reduce(np.fmin(time_reached, time_exited), axis=-1), time_min)
+        exit = np.fmin(np.fmin.reduce(np.fmax(time_reached, time_exited), axis=-1), time_max)
+        return entry, exit
+
+    def traverse(self,
+                 ray: Ray,
+                 time_min: float,
+                 time_max: float,
+                 intersect_leaf: Callable):
+        origin = np.asarray(ray.origin, dtype=np.float64)
+        with np.errstate(divide='ignore'):
+            inverse_direction = 1.0 / np.asarray(ray.direction, dtype=np.float64)
+
+        entry, exit = self._slab(0, origin, inverse_direction, time_min, time_max)
+        if not entry <= exit:
+            return None
+
+        closest = None
+        stack = [(0, float(entry))]
+        while stack:
+            node, entry = stack.pop()
+            if entry > time_max:
+                continue
+            self.node_visits += 1
+
+            count = self.node_count[node]
+            if count > 0:
+                hit = intersect_leaf(self.node_offset[node], count, ray, time_min, time_max)
+                if hit:
+                    closest = hit
+                    time_max = hit.time
+                continue
+
+            children = np.array([self.node_offset[node], self.node_offset[node] + 1])
+            entry, exit = self._slab(children, origin, inverse_direction, time_min, time_max)
+            #push the far child first so the near one is searched first
+            near = 0 if entry[0] <= entry[1] else 1
+            far = 1 - near
+            if entry[far] <= exit[far]:
+                stack.append((children[far], float(entry[far])))
+            if entry[near] <= exit[near]:
+                stack.append((children[near], float(entry[near])))
+        return closest
+
+    def _hit_objects(self, first: int, count: int, ray: Ray, time_min: float, time_max: float):
+        closest = None
+        for index in self.primitive_indices[first:first + count]:
+            hit = self.objects[index].hit(ray, time_min, time_max)
+            if hit:
+                closest = hit
+                time_max = hit.time
+        return closest
+
+    def hit(self, ray: Ray, time_min: float, time_max: float):
+        return self.traverse(ray, time_min, time_max, self._hit_objects)
+
+    def traverse_batch(self,
+                       origins: np.ndarray,
+                       directions: np.ndarray,
+                       time_min: float,
+                       closest_time: np.ndarray,
+                       intersect_pairs: Callable[[np.ndarray, np.ndarray], None],
+                       ray_node_visits: np.ndarray | None = None,
+                       seed_rays: np.ndarray | None = None,
+                       seed_nodes: np.ndarray | None = None):
+        #every ray walks its own stack, one node per ray per iteration, all rays advanced together
+        #intersect_pairs tests (ray, primitive) pairs and lowers closest_time in place
+        #ray_node_visits, when given, counts the nodes each ray visited
+        #seeds, when given, replace the root: each seed ray starts with the seed nodes its box test passes on its
+        #stack, nearest first
+        ray_count = len(origins)
+        with np.errstate(divide='ignore'):
+            inverse_directions = 1.0 / directions
+
+        if seed_rays is None:
+            stack_nodes = np.zeros((ray_count, self.max_depth + 2), dtype=np.int64)
+            stack_entry = np.zeros((ray_count, self.max_depth + 2))
+            stack_size = np.zeros(ray_count, dtype=np.int64)
+            entry, exit = self._slab(np.zeros(ray_count, dtype=np.int64), origins, inverse_directions,
+                                     time_min, closest_time)
+            starting = entry <= exit
+            stack_entry[starting, 0] = entry[starting]
+            stack_size[starting] = 1
+        else:
+            entry, exit = self._slab(seed_nodes, origins[seed_rays], inverse_directions[seed_rays], time_min,
+                                     closest_time[seed_rays])
+            #the nearest seed of a ray goes on top of its stack
+            seeds = np.flatnonzero(entry <= exit)
+            seeds = seeds[np.lexsort((-entry[seeds], seed_rays[seeds]))]
+            stack_size = np.bincount(seed_rays[seeds], minlength=ray_count)
+            position = np.arange(seeds.size) - np.repeat(np.cumsum(stack_size) - stack_size, stack_size)
+            stack_nodes = np.zeros((ray_count, self.max_depth + 1 + stack_size.max(initial=1)), dtype=np.int64)
+            stack_entry = np.zeros(stack_nodes.shape)
+            stack_nodes[seed_rays[seeds], position] = seed_nodes[seeds]
+            stack_entry[seed_rays[seeds], position] = entry[seeds]
+
+        active = np.flatnonzero(stack_size)
+        while active.size:
+            stack_size[active] -= 1
+            nodes = stack_nodes[active, stack_size[active]]
+            live = stack_entry[active, stack_size[active]] <= closest_time[active]
+            active = active[live]
+            nodes = nodes[live]
+            self.node_visits += active.size
+            if ray_node_visits is not None:
+                ray_node_visits[active] += 1
+
+            counts = self.node_count[nodes]
+            leaf = counts > 0
+            if leaf.any():
+                leaf_counts = counts[leaf]
+                pair_rays = np.repeat(active[leaf], leaf_counts)
+                pair_starts = np.repeat(self.node_offset[nodes[leaf]] - np.cumsum(leaf_counts) + leaf_counts,
+                                        leaf_counts)
+                intersect_pairs(pair_rays, self.primitive_indices[pair_starts + np.arange(pair_rays.size)])
+
+            interior_rays = active[~leaf]
+            interior_nodes = nodes[~leaf]
+            if interior_rays.size:
+                origin = origins[interior_rays]
+                inverse_direction = inverse_directions[interior_rays]
+                time_max = closest_time[interior_rays]
+                left = self.node_offset[interior_nodes]
+                right = left + 1
+                left_entry, left_exit = self._slab(left, origin, inverse_direction, time_min, time_max)
+                right_entry, right_exit = self._slab(right, origin, inverse_direction, time_min, time_max)
+
+                left_is_near = left_entry <= right_entry
+                near = np.where(left_is_near, left, right)
+                far = np.where(left_is_near, right, left)
+                near_entry = np.where(left_is_near, left_entry, right_entry)
+                far_entry = np.where(left_is_near, right_entry, left_entry)
+                near_hit = np.where(left_is_near, left_entry <= left_exit, right_entry <= right_exit)
+                far_hit = np.where(left_is_near, right_entry <= right_exit, left_entry <= left_exit)
+
+                for hit, child, child_entry in ((far_hit, far, far_entry), (near_hit, near, near_entry)):
+                    rays = interior_rays[hit]
+                    stack_nodes[rays, stack_size[rays]] = child[hit]
+                    stack_entry[rays, stack_size[rays]] = child_entry[hit]
+                    stack_size[rays] += 1
+
+            active = np.flatnonzero(stack_size)
+
+    def _packet_slab(self,
+                     nodes: np.ndarray,
+                     origin_minimum: np.ndarray,
+                     origin_maximum: np.ndarray,
+                     direction_minimum: np.ndarray,
+                     direction_maximum: np.ndarray,
+                     time_min,
+                     time_max) -> tuple[np.ndarray, np.ndarray]:
+        #interval arithmetic over every ray of a packet, entry is no later and exit no earlier than any of its rays
+        node_minimum = self.node_minimum[nodes]
+        node_maximum = self.node_maximum[nodes]
+        bounded = (direction_minimum > 0.0) | (direction_maximum < 0.0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            #1 / direction is monotonic over an interval that does not cross 0
+            inverse_minimum = np.where(bounded, 1.0 / direction_maximum, 0.0)
+            inverse_maximum = np.where(bounded, 1.0 / direction_minimum, 0.0)
+            entries = []
+            exits = []
+            for planes in (node_minimum, node_maximum):
+                nearest = planes - origin_maximum
+                farthest = planes - origin_minimum
+                products = (nearest * inverse_minimum, nearest * inverse_maximum,
+                            farthest * inverse_minimum, farthest * inverse_maximum)
+                entries.append(np.minimum(np.minimum(products[0], products[1]), np.minimum(products[2], products[3])))
+                exits.append(np.maximum(np.maximum(products[0], products[1]), np.maximum(products[2], products[3])))
+
+            #on an axis where the direction changes sign only a slab wholly to one side of every origin bounds the
+            #entry, through the fastest ray heading its way
+            ahead = node_minimum - origin_maximum
+            behind = origin_minimum - node_maximum
+            crossing_entry = np.where(ahead > 0.0, ahead / direction_maximum,
+                                      np.where(behind > 0.0, behind / -direction_minimum, -np.inf))
+        entry = np.where(bounded, np.minimum(entries[0], entries[1]), crossing_entry)
+        exit = np.where(bounded, np.maximum(exits[0], exits[1]), np.inf)
+        return np.maximum(entry.max(axis=-1), time_min), np.minimum(exit.min(axis=-1), time_max)
+
+    def traverse_packets(self,
+                         origins: np.ndarray,
+                         directions: np.ndarray,
+                         time_min: float,
+                         closest_time: np.ndarray,
+                         intersect_pairs: Callable[[np.ndarray, np.ndarray], None],
+                         ray_node_visits: np.ndarray | None = None,
+                         packet_size: int = PACKET_SIZE):
+        #traverse_batch for coherent rays such as camera rays. rays with neighbouring directions are grouped into
+        #packets and each packet walks one stack, every node is tested once per packet against the packet's
+        #bounds and a leaf is only opened for the rays of the packet that hit its box. once a packet is wider than
+        #a node its rays are mostly missing each other's nodes, so they take the rest of that subtree one by one
+        ray_count = len(origins)
+        if ray_count == 0:
+            return
+        #grouping the rays costs more than a tree this small can save
+        if len(self.node_count) < packet_size:
+            self.traverse_batch(origins, directions, time_min, closest_time, intersect_pairs, ray_node_visits)
+            return
+        with np.errstate(divide='ignore'):
+            inverse_directions = 1.0 / directions
+        #padding slots repeat the packet's first ray so packet bounds can ignore them, they never reach a primitive
+        packet_rays = direction_packets(directions, packet_size)
+        packet_count = len(packet_rays)
+        packet_valid = packet_rays >= 0
+        packet_rays = np.where(packet_valid, packet_rays, packet_rays[:, :1])
+
+        packet_origins = origins[packet_rays]
+        packet_directions = directions[packet_rays]
+        origin_minimum = packet_origins.min(axis=1)
+        origin_maximum = packet_origins.max(axis=1)
+        direction_minimum = packet_directions.min(axis=1)
+        direction_maximum = packet_directions.max(axis=1)
+        origin_spread = np.linalg.norm(origin_maximum - origin_minimum, axis=1)
+        direction_spread = np.linalg.norm(direction_maximum - direction_minimum, axis=1)
+        #latest hit time any ray of the packet still accepts
+        packet_time = closest_time[packet_rays].max(axis=1)
+        #subtrees handed over to single ray traversal
+        seed_packets = [np.zeros(0, dtype=np.int64)]
+        seed_nodes = [np.zeros(0, dtype=np.int64)]
+
+        def packet_slab(nodes: np.ndarray, packets: np.ndarray):
+            return self._packet_slab(nodes, origin_minimum[packets], origin_maximum[packets],
+                                     direction_minimum[packets], direction_maximum[packets],
+                                     time_min, packet_time[packets])
+
+        stack_nodes = np.zeros((packet_count, self.max_depth + 2), dtype=np.int64)
+        stack_entry = np.zeros((packet_count, self.max_depth + 2))
+        stack_size = np.zeros(packet_count, dtype=np.int64)
+
+        entry, exit = packet_slab(np.zeros(packet_count, dtype=np.int64), np.arange(packet_count))
+        starting = entry <= exit
+        stack_entry[starting, 0] = entry[starting]
+        stack_size[starting] = 1
+
+        active = np.flatnonzero(stack_size)
+        while active.size:
+            stack_size[active] -= 1
+            nodes = stack_nodes[active, stack_size[active]]
+            live = stack_entry[active, stack_size[active]] <= packet_time[active]
+            active = active[live]
+            nodes = nodes[live]
+            self.node_visits += active.size
+            if ray_node_visits is not None:
+                visiting = packet_rays[active][packet_valid[active]]
+                ray_node_visits += np.bincount(visiting, minlength=ray_count)
+
+            counts = self.node_count[nodes]
+            leaf = counts > 0
+            if leaf.any():
+                leaf_packets = active[leaf]
+                leaf_nodes = nodes[leaf]
+                #every (ray, leaf) pair of the packets, kept only where the ray itself reaches the leaf's box
+                ray_leaf = np.repeat(leaf_nodes, packet_size)
+                rays = packet_rays[leaf_packets].ravel()
+                valid = packet_valid[leaf_packets].ravel()
+                rays = rays[valid]
+                ray_leaf = ray_leaf[valid]
+                entry, exit = self._slab(ray_leaf, origins[rays], inverse_directions[rays], time_min,
+                                         closest_time[rays])
+                reached = entry <= exit
+                rays = rays[reached]
+                ray_leaf = ray_leaf[reached]
+                if rays.size:
+                    leaf_counts = self.node_count[ray_leaf]
+                    pair_rays = np.repeat(rays, leaf_counts)
+                    pair_starts = np.repeat(self.node_offset[ray_leaf] - np.cumsum(leaf_counts) + leaf_counts,
+                                            leaf_counts)
+                    intersect_pairs(pair_rays, self.primitive_indices[pair_starts + np.arange(pair_rays.size)])
+                    packet_time[leaf_packets] = closest_time[packet_rays[leaf_packets]].max(axis=1)
+
+            interior_packets = active[~leaf]
+            interior_nodes = nodes[~leaf]
+            if interior_packets.size:
+                left = self.node_offset[interior_nodes]
+                right = left + 1
+                left_entry, left_exit = packet_slab(left, interior_packets)
+                right_entry, right_exit = packet_slab(right, interior_packets)
+
+                left_is_near = left_entry <= right_entry
+                near = np.where(left_is_near, left, right)
+                far = np.where(left_is_near, right, left)
+                near_entry = np.where(left_is_near, left_entry, right_entry)
+                far_entry = np.where(left_is_near, right_entry, left_entry)
+                near_hit = np.where(left_is_near, left_entry <= left_exit, right_entry <= right_exit)
+                far_hit = np.where(left_is_near, right_entry <= right_exit, left_entry <= left_exit)
+
+                for hit, child, child_entry in ((far_hit, far, far_entry), (near_hit, near, near_entry)):
+                    packet_width = (origin_spread[interior_packets]
+                                    + np.maximum(child_entry, 0.0) * direction_spread[interior_packets])
+                    node_width = (self.node_maximum[child] - self.node_minimum[child]).max(axis=1)
+                    handed_over = hit & (packet_width > PACKET_HANDOFF_WIDTH * node_width)
+                    seed_packets.append(interior_packets[handed_over])
+                    seed_nodes.append(child[handed_over])
+
+                    hit = hit & ~handed_over
+                    packets = interior_packets[hit]
+                    stack_nodes[packets, stack_size[packets]] = child[hit]
+                    stack_entry[packets, stack_size[packets]] = child_entry[hit]
+                    stack_size[packets] += 1
+
+            active = np.flatnonzero(stack_size)
+
+        seed_packets = np.concatenate(seed_packets)
+        if seed_packets.size:
+            seed_valid = packet_valid[seed_packets].ravel()
+            seed_rays = packet_rays[seed_packets].ravel()[seed_valid]
+            seed_nodes = np.repeat(np.concatenate(seed_nodes), packet_size)[seed_valid]
+            self.traverse_batch(origins, directions, time_min, closest_time, intersect_pairs, ray_node_visits,
+                                seed_rays, seed_nodes)
@@ -0,0 +1,840 @@
+import math
+import numpy as np
+
+from bvh_node import BVHNode
+from flat_bvh import FlatBVH
+from hit_record import HitRecordBatch
+from instance import Instance, box_corners
+from instrumentation import TileProfile
+from jit_kernels import compiled_backend, pack_meshes
+import jit_kernels
+from materials import Emissive, Material
+from mesh import Mesh
+from moving_sphere import MovingSphere
+from quad import Quad
+from ray import RayBatch, normalize_rows
+from sampler import PathSampler
+from sphere import Sphere
+from triangle import Triangle, hit_triangles
+
+
+def triangle_texture_density(vertex_texture_coordinates: np.ndarray, normals: np.ndarray) -> np.ndarray:
+    #texture coordinate change per unit of distance on the surface, for picking mip levels
+    texture_edge1 = vertex_texture_coordinates[:, 1] - vertex_texture_coordinates[:, 0]
+    texture_edge2 = vertex_texture_coordinates[:, 2] - vertex_texture_coordinates[:, 0]
+    texture_area = np.abs(texture_edge1[:, 0] * texture_edge2[:, 1] - texture_edge1[:, 1] * texture_edge2[:, 0])
+    world_area = np.linalg.norm(normals, axis=1)
+    return np.sqrt(texture_area / np.maximum(world_area, 1e-12))
+
+
+class FlatScene:
+    def __init__(self, world):
+        self.materials: list[Material] = []
+        self._material_indices: dict[int, int] = {}
+        spheres = []
+        triangles = []
+        meshes = []
+        instances = []
+        #the primitive lists' lengths after each top level object, to find its primitives again
+        object_ends = []
+        for object in self._top_level_objects(world):
+            self._collect(object, spheres, triangles, meshes, instances)
+            object_ends.append((len(spheres), len(triangles), len(meshes), len(instances)))
+        if not spheres and not triangles and not meshes and not instances:
+            raise ValueError('Empty world for constructing FlatScene')
+
+        self.sphere_count = len(spheres)
+        self.sphere_center0 = np.zeros((self.sphere_count, 3))
+        self.sphere_center1 = np.zeros((self.sphere_count, 3))
+        self.sphere_time0 = np.zeros(self.sphere_count)
+        self.sphere_time1 = np.zeros(self.sphere_count)
+        self.sphere_radius = np.zeros(self.sphere_count)
+        self.sphere_material_index = np.zeros(self.sphere_count, dtype=np.int32)
+        #only static spheres report texture coordinates, same as their hit methods
+        self.sphere_has_texture_coordinates = np.zeros(self.sphere_count, dtype=bool)
+        for i, sphere in enumerate(spheres):
+            if isinstance(sphere, MovingSphere):
+                self.sphere_center0[i] = sphere.center0
+                self.sphere_center1[i] = sphere.center1
+                self.sphere_time0[i] = sphere.time0
+                self.sphere_time1[i] = sphere.time1
+            else:
+                self.sphere_center0[i] = sphere.center
+                self.sphere_center1[i] = sphere.center
+                self.sphere_has_texture_coordinates[i] = True
+            self.sphere_radius[i] = sphere.radius
+            self.sphere_material_index[i] = self._material_index(sphere.material)
+
+        self.triangle_count = len(triangles) + sum(mesh.triangle_count for mesh in meshes)
+        self.triangle_v0 = np.zeros((self.triangle_count, 3))
+        self.triangle_e1 = np.zeros((self.triangle_count, 3))
+        self.triangle_e2 = np.zeros((self.triangle_count, 3))
+        self.triangle_vertex_normals = np.zeros((self.triangle_count, 3, 3))
+        self.triangle_has_vertex_normals = np.zeros(self.triangle_count, dtype=bool)
+        self.triangle_texture_coordinates = np.zeros((self.triangle_count, 3, 2))
+        self.triangle_has_texture_coordinates = np.zeros(self.triangle_count, dtype=bool)
+        self.triangle_material_index = np.zeros(self.triangle_count, dtype=np.int32)
+        for i, triangle in enumerate(triangles):
+            self.triangle_v0[i] = triangle.v0
+            self.triangle_e1[i] = triangle.e1
+            self.triangle_e2[i] = triangle.e2
+            if triangle.normal0 is not None and triangle.normal1 is not None and triangle.normal2 is not None:
+                self.triangle_vertex_normals[i] = (triangle.normal0, triangle.normal1, triangle.normal2)
+                self.triangle_has_vertex_normals[i] = True
+            if (triangle.texture_xy0 is not None and triangle.texture_xy1 is not None
+                    and triangle.texture_xy2 is not None):
+                self.triangle_texture_coordinates[i] = (triangle.texture_xy0, triangle.texture_xy1, triangle.texture_xy2)
+                self.triangle_has_texture_coordinates[i] = True
+            self.triangle_material_index[i] = self._material_index(triangle.material)
+
+        start = len(triangles)
+        for mesh in meshes:
+            faces = slice(start, start + mesh.triangle_count)
+            self.triangle_v0[faces] = mesh.v0
+            self.triangle_e1[faces] = mesh.e1
+            self.triangle_e2[faces] = mesh.e2
+            if mesh.normals is not None:
+                self.triangle_vertex_normals[faces] = mesh.normals[mesh.indices]
+                self.triangle_has_vertex_normals[faces] = True
+            if mesh.texture_coordinates is not None:
+                self.triangle_texture_coordinates[faces] = mesh.texture_coordinates[mesh.indices]
+                self.triangle_has_texture_coordinates[faces] = True
+            self.triangle_material_index[faces] = self._material_index(mesh.material)
+            start += mesh.triangle_count
+        self.triangle_normal = np.zeros((self.triangle_count, 3))
+        self.triangle_texture_density = np.zeros(self.triangle_count)
+        self._update_triangle_normals(slice(None))
+        self._build_light_list()
+        self._build_instances(instances)
+
+        self.object_primitives = self._object_primitives(object_ends, len(triangles), meshes)
+        #untransformed geometry, copied on the first call to transform_objects
+        self._rest_pose: dict[str, np.ndarray] | None = None
+        self._transformed_spheres = np.zeros(0, dtype=np.int64)
+        self._transformed_triangles = np.zeros(0, dtype=np.int64)
+        self._transformed_instances = np.zeros(0, dtype=np.int64)
+        #every primitive's bounds as of the last refit
+        self._bounds: tuple[np.ndarray, np.ndarray] | None = None
+        #instanced mesh bvhs packed for the compiled kernels on first use
+        self._kernel_meshes: tuple | None = None
+
+        #one bvh over every primitive, spheres come first in its index space then triangles then instances.
+        #meshes bring the bvh they were built or loaded from their cache with, it is reused as a subtree
+        mesh_starts = self.sphere_count + len(triangles) + np.cumsum([0] + [mesh.triangle_count for mesh in meshes])
+        self.bvh = FlatBVH.from_bounds(*self.primitive_bounds(),
+                                       subtrees=[(mesh.bvh, int(start)) for mesh, start in zip(meshes, mesh_starts)])
+
+    def _update_triangle_normals(self, triangles):
+        self.triangle_normal[triangles] = np.cross(self.triangle_e1[triangles], self.triangle_e2[triangles])
+        self.triangle_texture_density[triangles] = triangle_texture_density(
+            self.triangle_texture_coordinates[triangles], self.triangle_normal[triangles])
+
+    def _build_instances(self, instances: list[Instance]):
+        #every distinct instanced mesh is stored once in its own space next to its bvh, an instance is only
+        #a transform, a material and which mesh it places
+        self.instance_count = len(instances)
+        self.instance_start = self.sphere_count + self.triangle_count
+        meshes = []
+        mesh_indices = {}
+        self.instance_mesh_index = np.zeros(self.instance_count, dtype=np.int64)
+        self.instance_material_index = np.zeros(self.instance_count, dtype=np.int32)
+        for i, instance in enumerate(instances):
+            if id(instance.mesh) not in mesh_indices:
+                mesh_indices[id(instance.mesh)] = len(meshes)
+                meshes.append(instance.mesh)
+            self.instance_mesh_index[i] = mesh_indices[id(instance.mesh)]
+            self.instance_material_index[i] = self._material_index(instance.material)
+        self.instance_object_to_world = np.array([instance.object_to_world for instance in instances],
+                                                 dtype=np.float64).reshape(-1, 3, 4)
+        self.instance_world_to_object = np.array([instance.world_to_object for instance in instances],
+                                                 dtype=np.float64).reshape(-1, 3, 4)
+        self._update_instance_scale()
+
+        self.instanced_mesh_bvhs = [mesh.bvh for mesh in meshes]
+        mesh_triangle_counts = np.array([mesh.triangle_count for mesh in meshes], dtype=np.int64)
+        self.instanced_mesh_first_triangle = np.cumsum(mesh_triangle_counts) - mesh_triangle_counts
+        instanced_triangle_count = int(mesh_triangle_counts.sum())
+        self.instanced_v0 = np.zeros((instanced_triangle_count, 3))
+        self.instanced_e1 = np.zeros((instanced_triangle_count, 3))
+        self.instanced_e2 = np.zeros((instanced_triangle_count, 3))
+        self.instanced_vertex_normals = np.zeros((instanced_triangle_count, 3, 3))
+        self.instanced_has_vertex_normals = np.zeros(instanced_triangle_count, dtype=bool)
+        self.instanced_texture_coordinates = np.zeros((instanced_triangle_count, 3, 2))
+        self.instanced_has_texture_coordinates = np.zeros(instanced_triangle_count, dtype=bool)
+        for mesh, first in zip(meshes, self.instanced_mesh_first_triangle):
+            faces = slice(first, first + mesh.triangle_count)
+            self.instanced_v0[faces] = mesh.v0
+            self.instanced_e1[faces] = mesh.e1
+            self.instanced_e2[faces] = mesh.e2
+            if mesh.normals is not None:
+                self.instanced_vertex_normals[faces] = mesh.normals[mesh.indices]
+                self.instanced_has_vertex_normals[faces] = True
+            if mesh.texture_coordinates is not None:
+                self.instanced_texture_coordinates[faces] = mesh.texture_coordinates[mesh.indices]
+                self.instanced_has_texture_coordinates[faces] = True
+        self.instanced_normal = np.cross(self.instanced_e1, self.instanced_e2)
+        self.instanced_texture_density = triangle_texture_density(self.instanced_texture_coordinates,
+                                                                  self.instanced_normal)
+
+        #hit records number each instance's triangles after the scene's own, instance i starts at instance_hit_start[i]
+        instance_triangle_counts = mesh_triangle_counts[self.instance_mesh_index]
+        self.instance_hit_start = self.instance_start + np.cumsum(instance_triangle_counts) - instance_triangle_counts
+
+    def _update_instance_scale(self):
+        #texture densities are measured in the mesh's space, a uniform scale is assumed when moving them to the world
+        self.instance_scale = np.abs(np.linalg.det(self.instance_object_to_world[:, :, :3])) ** (1.0 / 3.0)
+
+    def primitive_bounds(self, primitives: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+        #minimum and maximum corner of every primitive, or of the given ones, in the bvh's index space
+        if primitives is None:
+            primitives = np.arange(self.instance_start + self.instance_count)
+        spheres = primitives[primitives < self.sphere_count]
+        triangles = primitives[(primitives >= self.sphere_count) & (primitives < self.instance_start)] - self.sphere_count
+        instances = primitives[primitives >= self.instance_start] - self.instance_start
+        radius = self.sphere_radius[spheres, None]
+        sphere_center0 = self.sphere_center0[spheres]
+        sphere_center1 = self.sphere_center1[spheres]
+        triangle_v0 = self.triangle_v0[triangles]
+        triangle_vertices = np.stack((triangle_v0,
+                                      triangle_v0 + self.triangle_e1[triangles],
+                                      triangle_v0 + self.triangle_e2[triangles]), axis=1)
+        #an instance is bounded by the corners of its mesh's box taken to the world
+        meshes = self.instance_mesh_index[instances]
+        mesh_minimum = np.array([bvh.node_minimum[0] for bvh in self.instanced_mesh_bvhs]).reshape(-1, 3)
+        mesh_maximum = np.array([bvh.node_maximum[0] for bvh in self.instanced_mesh_bvhs]).reshape(-1, 3)
+        object_to_world = self.instance_object_to_world[instances]
+        instance_corners = (np.einsum('ijk,imk->imj', object_to_world[:, :, :3],
+                                      box_corners(mesh_minimum[meshes], mesh_maximum[meshes]))
+                            + object_to_world[:, None, :, 3])
+        #same padding as Triangle.bounding_box for axis aligned triangles
+        minimums = np.concatenate((np.minimum(sphere_center0, sphere_center1) - radius,
+                                   triangle_vertices.min(axis=1) - 1e-3,
+                                   instance_corners.min(axis=1)))
+        maximums = np.concatenate((np.maximum(sphere_center0, sphere_center1) + radius,
+                                   triangle_vertices.max(axis=1) + 1e-3,
+                                   instance_corners.max(axis=1)))
+        #spheres come first in the result then triangles, put everything back in the order asked for
+        kind = (primitives >= self.sphere_count).astype(np.int64) + (primitives >= self.instance_start)
+        order = np.argsort(kind, kind='stable')
+        result_minimums = np.empty_like(minimums)
+        result_maximums = np.empty_like(maximums)
+        result_minimums[order] = minimums
+        result_maximums[order] = maximums
+        return result_minimums, result_maximums
+
+    @staticmethod
+    def _top_level_objects(world) -> list:
+        if isinstance(world, (list, tuple)):
+            return list(world)
+        if isinstance(world, FlatBVH) and world.objects is not None:
+            return list(world.objects)
+        return [world]
+
+    @staticmethod
+    def _object_primitives(object_ends: list[tuple[int, int, int, int]],
+                           loose_triangle_count: int,
+                           meshes: list[Mesh]) -> list[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        #sphere, triangle and instance indices of each top level object, mesh faces come after the loose triangles
+        mesh_starts = np.cumsum([loose_triangle_count] + [mesh.triangle_count for mesh in meshes])
+        object_primitives = []
+        sphere_start = triangle_start = mesh_start = instance_start = 0
+        for sphere_end, triangle_end, mesh_end, instance_end in object_ends:
+            triangles = [np.arange(triangle_start, triangle_end)]
+            triangles += [np.arange(mesh_starts[mesh], mesh_starts[mesh + 1]) for mesh in range(mesh_start, mesh_end)]
+            object_primitives.append((np.arange(sphere_start, sphere_end),
+                                      np.concatenate(triangles),
+                                      np.arange(instance_start, instance_end)))
+            sphere_start, triangle_start, mesh_start, instance_start = sphere_end, triangle_end, mesh_end, instance_end
+        return object_primitives
+
+    def transform_objects(self, transforms: dict[int, np.ndarray]) -> bool:
+        #moves top level objects, by their position in the world, with 4x4 affine matrices applied to their
+        #original geometry. objects left out go back to where they were built. spheres take the cube root of
+        #the determinant as their scale, instances only have their own transform composed with it. the bvh is
+        #refitted over the primitives that moved and rebuilt when refitting has made it too slow, returns
+        #whether it was rebuilt
+        if self._rest_pose is None:
+            self._rest_pose = {name: getattr(self, name).copy() for name in
+                               ('sphere_center0', 'sphere_center1', 'sphere_radius', 'triangle_v0',
+                                'triangle_e1', 'triangle_e2', 'triangle_vertex_normals', 'instance_object_to_world')}
+        rest = self._rest_pose
+        #everything moved last time is reset so objects dropped from transforms return to rest
+        previous = {'sphere': self._transformed_spheres,
+                    'triangle': self._transformed_triangles,
+                    'instance': self._transformed_instances}
+        for name in rest:
+            indices = previous[name.split('_')[0]]
+            getattr(self, name)[indices] = rest[name][indices]
+
+        spheres = []
+        triangles = []
+        instances = []
+        for object_index, matrix in transforms.items():
+            object_spheres, object_triangles, object_instances = self.object_primitives[object_index]
+            matrix = np.asarray(matrix, dtype=np.float64)
+            linear = matrix[:3, :3]
+            translation = matrix[:3, 3]
+            normal_matrix = np.linalg.inv(linear).T
+            scale = abs(np.linalg.det(linear)) ** (1.0 / 3.0)
+
+            self.sphere_center0[object_spheres] = rest['sphere_center0'][object_spheres] @ linear.T + translation
+            self.sphere_center1[object_spheres] = rest['sphere_center1'][object_spheres] @ linear.T + translation
+            self.sphere_radius[object_spheres] = rest['sphere_radius'][object_spheres] * scale
+            self.triangle_v0[object_triangles] = rest['triangle_v0'][object_triangles] @ linear.T + translation
+            self.triangle_e1[object_triangles] = rest['triangle_e1'][object_triangles] @ linear.T
+            self.triangle_e2[object_triangles] = rest['triangle_e2'][object_triangles] @ linear.T
+            vertex_normals = rest['triangle_vertex_normals'][object_triangles] @ normal_matrix.T
+            length = np.linalg.norm(vertex_normals, axis=-1, keepdims=True)
+            self.triangle_vertex_normals[object_triangles] = vertex_normals / np.maximum(length, 1e-300)
+            object_to_world = rest['instance_object_to_world'][object_instances]
+            self.instance_object_to_world[object_instances] = np.concatenate(
+                (linear @ object_to_world[:, :, :3], (linear @ object_to_world[:, :, 3:]) + translation[:, None]),
+                axis=2)
+            spheres.append(object_spheres)
+            triangles.append(object_triangles)
+            instances.append(object_instances)
+
+        def unique(index_lists: list[np.ndarray]) -> np.ndarray:
+            return np.unique(np.concatenate(index_lists or [np.zeros(0, dtype=np.int64)])).astype(np.int64)
+
+        self._transformed_spheres = unique(spheres)
+        self._transformed_triangles = unique(triangles)
+        self._transformed_instances = unique(instances)
+        moved_spheres = unique(spheres + [previous['sphere']])
+        moved_triangles = unique(triangles + [previous['triangle']])
+        moved_instances = unique(instances + [previous['instance']])
+        if moved_spheres.size == 0 and moved_triangles.size == 0 and moved_instances.size == 0:
+            return False
+        self._update_triangle_normals(moved_triangles)
+        linear = self.instance_object_to_world[moved_instances, :, :3]
+        inverse_linear = np.linalg.inv(linear)
+        self.instance_world_to_object[moved_instances] = np.concatenate(
+            (inverse_linear, -inverse_linear @ self.instance_object_to_world[moved_instances, :, 3:]), axis=2)
+        self._update_instance_scale()
+        self._build_light_list()
+
+        if self._bounds is None:
+            self._bounds = self.primitive_bounds()
+        minimums, maximums = self._bounds
+        moved = np.concatenate((moved_spheres, moved_triangles + self.sphere_count,
+                                moved_instances + self.instance_start))
+        minimums[moved], maximums[moved] = self.primitive_bounds(moved)
+        self.bvh.refit(minimums, maximums, moved)
+        if self.bvh.needs_rebuild():
+            self.bvh = FlatBVH.from_bounds(minimums, maximums)
+            return True
+        return False
+
+    def __getstate__(self) -> dict:
+        #the cached bounds are only for refitting and the packed meshes only for the compiled kernels, both are
+        #cheap to work out again. material indices are keyed by id() and only needed while building, leaving them
+        #in would make the pickle, and checkpoint keys made from it, differ between processes
+        state = self.__dict__.copy()
+        state['_bounds'] = None
+        state['_kernel_meshes'] = None
+        state.pop('_material_indices', None)
+        return state
+
+    def _build_light_list(self):
+        #every primitive with an Emissive material, picked for next event estimation in proportion to its power
+        primitive_count = self.sphere_count + self.triangle_count
+        emission = np.array([material.emit_color if isinstance(material, Emissive) else np.zeros(3)
+                             for material in self.materials], dtype=np.float64).reshape(-1, 3)
+        primitive_material = np.concatenate((self.sphere_material_index, self.triangle_material_index))
+        primitive_area = np.concatenate((4.0 * math.pi * self.sphere_radius ** 2,
+                                         0.5 * np.linalg.norm(self.triangle_normal, axis=1)))
+        power = primitive_area * emission[primitive_material].mean(axis=1)
+
+        self.light_primitives = np.flatnonzero(power > 0.0)
+        self.light_count = len(self.light_primitives)
+        self.light_selection_probability = np.zeros(primitive_count)
+        self.light_emission = np.zeros((primitive_count, 3))
+        self.light_cdf = np.zeros(0)
+        if self.light_count:
+            light_power = power[self.light_primitives]
+            self.light_selection_probability[self.light_primitives] = light_power / light_power.sum()
+            self.light_emission[self.light_primitives] = emission[primitive_material[self.light_primitives]]
+            self.light_cdf = np.cumsum(light_power) / light_power.sum()
+
+    def _material_index(self, material: Material) -> int:
+        key = id(material)
+        if key not in self._material_indices:
+            self._material_indices[key] = len(self.materials)
+            self.materials.append(material)
+        return self._material_indices[key]
+
+    def _collect(self, world, spheres: list, triangles: list, meshes: list, instances: list):
+        if isinstance(world, (list, tuple)):
+            for object in world:
+                self._collect(object, spheres, triangles, meshes, instances)
+        elif isinstance(world, FlatBVH):
+            if world.objects is None:
+                raise TypeError('FlatBVH built from bounds has no objects for FlatScene')
+            self._collect(world.objects, spheres, triangles, meshes, instances)
+        elif isinstance(world, BVHNode):
+            #leaf nodes store the same object as both children
+            self._collect(world.left, spheres, triangles, meshes, instances)
+            if world.right is not world.left:
+                self._collect(world.right, spheres, triangles, meshes, instances)
+        elif isinstance(world, Instance):
+            instances.append(world)
+        elif isinstance(world, Mesh):
+            meshes.append(world)
+        elif isinstance(world, Quad):
+            self._collect([world.triangle1, world.triangle2], spheres, triangles, meshes, instances)
+        elif isinstance(world, Triangle):
+            triangles.append(world)
+        elif isinstance(world, (Sphere, MovingSphere)):
+            spheres.append(world)
+        else:
+            raise TypeError(f'Unsupported object {type(world).__name__} for FlatScene')
+
+    def intersect(self,
+                  rays: RayBatch,
+                  time_min: float,
+                  time_max: float,
+                  profile: TileProfile | None = None,
+                  coherent: bool = False,
+                  backend: str = 'numpy') -> tuple[np.ndarray, HitRecordBatch]:
+        closest_time, closest_primitive, closest_u, closest_v = self.closest_hits(rays, time_min, time_max, profile,
+                                                                                  coherent, backend)
+        hit_mask = closest_primitive >= 0
+        hit_records = self._shade(rays.subset(hit_mask),
+                                  closest_time[hit_mask],
+                                  closest_primitive[hit_mask],
+                                  closest_u[hit_mask],
+                                  closest_v[hit_mask])
+        return hit_mask, hit_records
+
+    def closest_hits(self,
+                     rays: RayBatch,
+                     time_min: float,
+                     time_max: float,
+                     profile: TileProfile | None = None,
+                     coherent: bool = False,
+                     backend: str = 'numpy') -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        #hit time, primitive (-1 for misses) and barycentric u v of every ray, without shading
+        #coherent rays, such as camera rays, are walked through the bvh in packets. the compiled backend walks
+        #every ray on its own, which is already faster than packets in numpy
+        ray_count = len(rays)
+        closest_time = np.full(ray_count, time_max, dtype=np.float64)
+        closest_primitive = np.full(ray_count, -1, dtype=np.int64)
+        closest_u = np.zeros(ray_count)
+        closest_v = np.zeros(ray_count)
+        ray_cost = None if profile is None else np.zeros(ray_count)
+
+        def intersect_pairs(ray_indices: np.ndarray, primitive_indices: np.ndarray):
+            is_sphere = primitive_indices < self.sphere_count
+            is_instance = primitive_indices >= self.instance_start
+            is_triangle = ~is_sphere & ~is_instance
+            if profile is not None:
+                ray_cost[:] += np.bincount(ray_indices, minlength=ray_count)
+                profile.counters['sphere_tests'] += int(np.count_nonzero(is_sphere))
+                profile.counters['triangle_tests'] += int(np.count_nonzero(is_triangle))
+                profile.counters['instance_tests'] += int(np.count_nonzero(is_instance))
+            if is_sphere.any():
+                sphere_rays = ray_indices[is_sphere]
+                spheres = primitive_indices[is_sphere]
+                hit_time = self._hit_spheres(rays, sphere_rays, spheres, time_min, closest_time[sphere_rays])
+                winners = self._closest_pairs(sphere_rays, hit_time, closest_time)
+                winner_rays = sphere_rays[winners]
+                closest_primitive[winner_rays] = spheres[winners]
+                #spheres have no barycentrics, nothing is left over from a triangle further away
+                closest_u[winner_rays] = 0.0
+                closest_v[winner_rays] = 0.0
+
+            if is_triangle.any():
+                triangle_rays = ray_indices[is_triangle]
+                triangles = primitive_indices[is_triangle]
+                hit_time, u, v = self._hit_triangles(rays, triangle_rays, triangles - self.sphere_count, time_min,
+                                                     closest_time[triangle_rays])
+                winners = self._closest_pairs(triangle_rays, hit_time, closest_time)
+                winner_rays = triangle_rays[winners]
+                closest_primitive[winner_rays] = triangles[winners]
+                closest_u[winner_rays] = u[winners]
+                closest_v[winner_rays] = v[winners]
+
+            if is_instance.any():
+                instance_rays.append(ray_indices[is_instance])
+                instances.append(primitive_indices[is_instance] - self.instance_start)
+
+        #instance pairs are only gathered during the walk and traced together at the end, one mesh traversal per
+        #leaf visit would be mostly numpy call overhead. the top level culls a little less in exchange
+        instance_rays = []
+        instances = []
+        if compiled_backend(backend):
+            ray_node_visits, ray_tests, kind_tests = jit_kernels.closest_hits(
+                rays.origins, rays.directions, rays.times, time_min, closest_time, closest_primitive, closest_u,
+                closest_v, self.kernel_arrays())
+            self.bvh.node_visits += int(ray_node_visits.sum())
+            if profile is not None:
+                ray_cost[:] = ray_tests
+                for name, count in zip(('sphere_tests', 'triangle_tests', 'instance_tests'), kind_tests):
+                    profile.counters[name] += int(count)
+        else:
+            ray_node_visits = None if profile is None else np.zeros(ray_count, dtype=np.int64)
+            traverse = self.bvh.traverse_packets if coherent else self.bvh.traverse_batch
+            traverse(rays.origins, rays.directions, time_min, closest_time, intersect_pairs, ray_node_visits)
+            if instances:
+                self._intersect_instances(rays, np.concatenate(instance_rays), np.concatenate(instances), time_min,
+                                          closest_time, closest_primitive, closest_u, closest_v)
+
+        hit_mask = closest_primitive >= 0
+        if profile is not None:
+            profile.counters['rays'] += ray_count
+            profile.counters['node_visits'] += int(ray_node_visits.sum())
+            hit_primitives = closest_primitive[hit_mask]
+            sphere_hits = int(np.count_nonzero(hit_primitives < self.sphere_count))
+            instance_hits = int(np.count_nonzero(hit_primitives >= self.instance_start))
+            profile.primitive_hits['sphere'] += sphere_hits
+            profile.primitive_hits['triangle'] += len(hit_primitives) - sphere_hits - instance_hits
+            profile.primitive_hits['instance'] += instance_hits
+            profile.ray_cost = ray_cost + ray_node_visits
+        return closest_time, closest_primitive, closest_u, closest_v
+
+    def kernel_arrays(self) -> tuple:
+        #the scene as the arguments of jit_kernels' closest hit kernel. the top level arrays are passed as they
+        #are, since refits and transform_objects change them in place or replace them, the packed instanced
+        #meshes never change and are only packed once
+        if self._kernel_meshes is None:
+            self._kernel_meshes = pack_meshes(self.instanced_mesh_bvhs, self.instanced_mesh_first_triangle)
+        mesh_arrays, mesh_roots, mesh_max_depth = self._kernel_meshes
+        bvh = self.bvh
+        return ((bvh.node_minimum, bvh.node_maximum, bvh.node_offset, bvh.node_count, bvh.primitive_indices),
+                bvh.max_depth,
+                self.sphere_count,
+                (self.sphere_center0, self.sphere_center1, self.sphere_time0, self.sphere_time1, self.sphere_radius),
+                self.instance_start,
+                (self.triangle_v0, self.triangle_e1, self.triangle_e2, self.triangle_normal),
+                (self.instance_world_to_object, mesh_roots[self.instance_mesh_index],
+                 self.instance_hit_start - self.instanced_mesh_first_triangle[self.instance_mesh_index]),
+                mesh_arrays + (self.instanced_v0, self.instanced_e1, self.instanced_e2, self.instanced_normal),
+                mesh_max_depth)
+
+    def _intersect_instances(self,
+                             rays: RayBatch,
+                             ray_indices: np.ndarray,
+                             instances: np.ndarray,
+                             time_min: float,
+                             closest_time: np.ndarray,
+                             closest_primitive: np.ndarray,
+                             closest_u: np.ndarray,
+                             closest_v: np.ndarray):
+        #each (ray, instance) pair walks the instance's mesh bvh in the mesh's space. the moved direction is
+        #not normalized so hit times are the same in both spaces
+        world_to_object = self.instance_world_to_object[instances]
+        origins = (np.einsum('ijk,ik->ij', world_to_object[:, :, :3], rays.origins[ray_indices])
+                   + world_to_object[:, :, 3])
+        directions = np.einsum('ijk,ik->ij', world_to_object[:, :, :3], rays.directions[ray_indices])
+        pair_time = closest_time[ray_indices]
+        pair_triangle = np.full(len(ray_indices), -1, dtype=np.int64)
+        pair_u = np.zeros(len(ray_indices))
+        pair_v = np.zeros(len(ray_indices))
+
+        pair_mesh = self.instance_mesh_index[instances]
+        for mesh in np.unique(pair_mesh):
+            pairs = np.flatnonzero(pair_mesh == mesh)
+            first_triangle = self.instanced_mesh_first_triangle[mesh]
+            mesh_origins = origins[pairs]
+            mesh_directions = directions[pairs]
+            mesh_time = pair_time[pairs]
+            mesh_triangle = np.full(len(pairs), -1, dtype=np.int64)
+            mesh_u = np.zeros(len(pairs))
+            mesh_v = np.zeros(len(pairs))
+
+            def intersect_mesh_pairs(local_pairs: np.ndarray, triangles: np.ndarray):
+                triangles = triangles + first_triangle
+                hit_time, u, v = hit_triangles(mesh_origins[local_pairs],
+                                               mesh_directions[local_pairs],
+                                               self.instanced_v0[triangles],
+                                               self.instanced_e1[triangles],
+                                               self.instanced_e2[triangles],
+                                               self.instanced_normal[triangles],
+                                               time_min,
+                                               mesh_time[local_pairs])
+                winners = self._closest_pairs(local_pairs, hit_time, mesh_time)
+                winner_pairs = local_pairs[winners]
+                mesh_triangle[winner_pairs] = triangles[winners] - first_triangle
+                mesh_u[winner_pairs] = u[winners]
+                mesh_v[winner_pairs] = v[winners]
+
+            self.instanced_mesh_bvhs[mesh].traverse_batch(mesh_origins, mesh_directions, time_min, mesh_time,
+                                                          intersect_mesh_pairs)
+            pair_time[pairs] = mesh_time
+            pair_triangle[pairs] = mesh_triangle
+            pair_u[pairs] = mesh_u
+            pair_v[pairs] = mesh_v
+
+        hit_pairs = np.flatnonzero(pair_triangle >= 0)
+        winners = hit_pairs[self._closest_pairs(ray_indices[hit_pairs], pair_time[hit_pairs], closest_time)]
+        winner_rays = ray_indices[winners]
+        closest_primitive[winner_rays] = self.instance_hit_start[instances[winners]] + pair_triangle[winners]
+        closest_u[winner_rays] = pair_u[winners]
+        closest_v[winner_rays] = pair_v[winners]
+
+    def sample_lights(self,
+                      points: np.ndarray,
+                      times: np.ndarray,
+                      sampler: PathSampler) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        #one light per point, returns unit directions towards it, the solid angle pdf including the choice
+        #of light, and the light primitive. a pdf of 0 marks samples that could not be made
+        count = len(points)
+        light_sample, first_sample, second_sample = sampler.random((count, 3)).T
+        lights = self.light_primitives[np.minimum(np.searchsorted(self.light_cdf, light_sample, side='right'),
+                                                  self.light_count - 1)]
+        directions = np.zeros((count, 3))
+        pdf = np.zeros(count)
+
+        is_sphere = lights < self.sphere_count
+        if is_sphere.any():
+            #uniform over the cone the sphere subtends
+            spheres = lights[is_sphere]
+            to_center = self._sphere_centers(spheres, times[is_sphere]) - points[is_sphere]
+            distance_squared = np.einsum('ij,ij->i', to_center, to_center)
+            radius_squared = self.sphere_radius[spheres] ** 2
+            outside = distance_squared > radius_squared
+            cos_theta_max = np.sqrt(np.maximum(1.0 - radius_squared / np.maximum(distance_squared, 1e-300), 0.0))
+            cos_theta = 1.0 - first_sample[is_sphere] * (1.0 - cos_theta_max)
+            sin_theta = np.sqrt(np.maximum(1.0 - cos_theta * cos_theta, 0.0))
+            phi = 2.0 * math.pi * second_sample[is_sphere]
+            axis = normalize_rows(to_center)
+            tangent, bitangent = self._orthonormal_basis(axis)
+            directions[is_sphere] = (tangent * (sin_theta * np.cos(phi))[:, None]
+                                     + bitangent * (sin_theta * np.sin(phi))[:, None]
+                                     + axis * cos_theta[:, None])
+            cone_solid_angle = 2.0 * math.pi * (1.0 - cos_theta_max)
+            pdf[is_sphere] = np.where(outside & (cone_solid_angle > 0.0),
+                                      1.0 / np.maximum(cone_solid_angle, 1e-300), 0.0)
+
+        is_triangle = ~is_sphere
+        if is_triangle.any():
+            #uniform over the triangle's area, turned into a solid angle pdf
+            triangles = lights[is_triangle] - self.sphere_count
+            root = np.sqrt(first_sample[is_triangle])
+            light_points = (self.triangle_v0[triangles]
+                            + (root * (1.0 - second_sample[is_triangle]))[:, None] * self.triangle_e1[triangles]
+                            + (root * second_sample[is_triangle])[:, None] * self.triangle_e2[triangles])
+            to_light = light_points - points[is_triangle]
+            distance_squared = np.einsum('ij,ij->i', to_light, to_light)
+            triangle_directions = to_light / np.sqrt(np.maximum(distance_squared, 1e-300))[:, None]
+            directions[is_triangle] = triangle_directions
+            pdf[is_triangle] = self._triangle_solid_angle_pdf(triangles, triangle_directions, distance_squared)
+
+        pdf *= self.light_selection_probability[lights]
+        return directions, pdf, lights
+
+    def is_light(self, primitives: np.ndarray) -> np.ndarray:
+        #whether sample_lights can pick each primitive, instances never are
+        is_light = primitives < self.instance_start
+        is_light[is_light] = self.light_selection_probability[primitives[is_light]] > 0.0
+        return is_light
+
+    def light_pdf(self,
+                  origins: np.ndarray,
+                  directions: np.ndarray,
+                  times: np.ndarray,
+                  primitives: np.ndarray,
+                  hit_time: np.ndarray) -> np.ndarray:
+        #the pdf sample_lights would have had for reaching primitives from origins along directions,
+        #instances are never sampled as lights
+        pdf = np.zeros(len(primitives))
+        is_light = primitives < self.instance_start
+        primitives = np.where(is_light, primitives, 0)
+        is_sphere = is_light & (primitives < self.sphere_count)
+        if is_sphere.any():
+            spheres = primitives[is_sphere]
+            to_center = self._sphere_centers(spheres, times[is_sphere]) - origins[is_sphere]
+            distance_squared = np.einsum('ij,ij->i', to_center, to_center)
+            radius_squared = self.sphere_radius[spheres] ** 2
+            cos_theta_max = np.sqrt(np.maximum(1.0 - radius_squared / np.maximum(distance_squared, 1e-300), 0.0))
+            cone_solid_angle = 2.0 * math.pi * (1.0 - cos_theta_max)
+            pdf[is_sphere] = np.where((distance_squared > radius_squared) & (cone_solid_angle > 0.0),
+                                      1.0 / np.maximum(cone_solid_angle, 1e-300), 0.0)
+
+        is_triangle = is_light & ~is_sphere
+        if is_triangle.any():
+            triangle_directions = directions[is_triangle]
+            length = np.linalg.norm(triangle_directions, axis=1)
+            distance_squared = (hit_time[is_triangle] * length) ** 2
+            pdf[is_triangle] = self._triangle_solid_angle_pdf(primitives[is_triangle] - self.sphere_count,
+                                                              triangle_directions / length[:, None],
+                                                              distance_squared)
+        return np.where(is_light, pdf * self.light_selection_probability[primitives], 0.0)
+
+    def _triangle_solid_angle_pdf(self,
+                                  triangles: np.ndarray,
+                                  unit_directions: np.ndarray,
+                                  distance_squared: np.ndarray) -> np.ndarray:
+        normals = self.triangle_normal[triangles]
+        double_area = np.linalg.norm(normals, axis=1)
+        cosine = np.abs(np.einsum('ij,ij->i', normals, unit_directions)) / np.maximum(double_area, 1e-300)
+        projected_area = 0.5 * double_area * cosine
+        return np.where(projected_area > 1e-12, distance_squared / np.maximum(projected_area, 1e-300), 0.0)
+
+    @staticmethod
+    def _orthonormal_basis(axis: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        helper = np.where(np.abs(axis[:, :1]) > 0.9, [[0.0, 1.0, 0.0]], [[1.0, 0.0, 0.0]])
+        tangent = normalize_rows(np.cross(helper, axis))
+        return tangent, np.cross(axis, tangent)
+
+    @staticmethod
+    def _closest_pairs(ray_indices: np.ndarray, hit_time: np.ndarray, closest_time: np.ndarray) -> np.ndarray:
+        #hit_time holds inf for pairs that missed, closest_time is lowered in place
+        hit_pairs = np.flatnonzero(np.isfinite(hit_time))
+        if hit_pairs.size == 0:
+            return hit_pairs
+        np.minimum.at(closest_time, ray_indices[hit_pairs], hit_time[hit_pairs])
+        hit_pairs = hit_pairs[hit_time[hit_pairs] == closest_time[ray_indices[hit_pairs]]]
+        _, first = np.unique(ray_indices[hit_pairs], return_index=True)
+        return hit_pairs[first]
+
+    def _sphere_centers(self, sphere_indices: np.ndarray, times: np.ndarray) -> np.ndarray:
+        time0 = self.sphere_time0[sphere_indices]
+        time1 = self.sphere_time1[sphere_indices]
+        moving = time0 != time1
+        relative_time = np.zeros(len(sphere_indices))
+        relative_time[moving] = (times[moving] - time0[moving]) / (time1[moving] - time0[moving])
+        center0 = self.sphere_center0[sphere_indices]
+        return center0 + relative_time[:, None] * (self.sphere_center1[sphere_indices] - center0)
+
+    def _hit_spheres(self,
+                     rays: RayBatch,
+                     ray_indices: np.ndarray,
+                     sphere_indices: np.ndarray,
+                     time_min: float,
+                     time_max: np.ndarray) -> np.ndarray:
+        directions = rays.directions[ray_indices]
+        centers = self._sphere_centers(sphere_indices, rays.times[ray_indices])
+        o_minus_c = rays.origins[ray_indices] - centers
+        radius = self.sphere_radius[sphere_indices]
+
+        a = np.einsum('ij,ij->i', directions, directions)
+        b = 2.0 * np.einsum('ij,ij->i', directions, o_minus_c)
+        c = np.einsum('ij,ij->i', o_minus_c, o_minus_c) - radius * radius
+
+        b_squared_minus_4ac = b * b - 4 * a * c
+        root = np.sqrt(np.maximum(b_squared_minus_4ac, 0.0))
+        near_time = (-b - root) / (2 * a)
+        far_time = (-b + root) / (2 * a)
+
+        hit_time = np.full(len(ray_indices), np.inf)
+        far_in_range = (time_min <= far_time) & (far_time <= time_max)
+        hit_time[far_in_range] = far_time[far_in_range]
+        near_in_range = (time_min <= near_time) & (near_time <= time_max)
+        hit_time[near_in_range] = near_time[near_in_range]
+        hit_time[b_squared_minus_4ac < 0] = np.inf
+        return hit_time
+
+    def _hit_triangles(self,
+                       rays: RayBatch,
+                       ray_indices: np.ndarray,
+                       triangle_indices: np.ndarray,
+                       time_min: float,
+                       time_max: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        return hit_triangles(rays.origins[ray_indices],
+                             rays.directions[ray_indices],
+                             self.triangle_v0[triangle_indices],
+                             self.triangle_e1[triangle_indices],
+                             self.triangle_e2[triangle_indices],
+                             self.triangle_normal[triangle_indices],
+                             time_min,
+                             time_max)
+
+    def _shade(self,
+               rays: RayBatch,
+               time: np.ndarray,
+               primitive: np.ndarray,
+               u: np.ndarray,
+               v: np.ndarray) -> HitRecordBatch:
+        count = len(time)
+        point = rays.position(time)
+        outward_normal = np.zeros((count, 3))
+        shading_normal = np.zeros((count, 3))
+        material_index = np.zeros(count, dtype=np.int32)
+        texture_coordinates = np.zeros((count, 2))
+        has_texture_coordinates = np.zeros(count, dtype=bool)
+        texture_density = np.zeros(count)
+
+        is_sphere = primitive < self.sphere_count
+        is_instance = primitive >= self.instance_start
+        is_triangle = ~is_sphere & ~is_instance
+        if is_sphere.any():
+            spheres = primitive[is_sphere]
+            centers = self._sphere_centers(spheres, rays.times[is_sphere])
+            outward_normal[is_sphere] = normalize_rows(point[is_sphere] - centers)
+            shading_normal[is_sphere] = outward_normal[is_sphere]
+            material_index[is_sphere] = self.sphere_material_index[spheres]
+
+            local_point = (point[is_sphere] - centers) / self.sphere_radius[spheres][:, None]
+            theta = np.arccos(np.clip(-local_point[:, 1], -1.0, 1.0))
+            phi = np.arctan2(-local_point[:, 2], local_point[:, 0]) + math.pi
+            texture_coordinates[is_sphere] = np.stack((phi / (2.0 * math.pi), theta / math.pi), axis=1)
+            has_texture_coordinates[is_sphere] = self.sphere_has_texture_coordinates[spheres]
+            #y goes from 0 to 1 over half the circumference
+            texture_density[is_sphere] = 1.0 / (math.pi * self.sphere_radius[spheres])
+
+        if is_triangle.any():
+            triangles = primitive[is_triangle] - self.sphere_count
+            triangle_u = u[is_triangle][:, None]
+            triangle_v = v[is_triangle][:, None]
+            outward_normal[is_triangle] = normalize_rows(self.triangle_normal[triangles])
+            material_index[is_triangle] = self.triangle_material_index[triangles]
+
+            #phong shading / gouraud-style normal interpolation
+            vertex_normals = self.triangle_vertex_normals[triangles]
+            smooth_normal = normalize_rows((1.0 - triangle_u - triangle_v) * vertex_normals[:, 0]
+                                           + triangle_u * vertex_normals[:, 1]
+                                           + triangle_v * vertex_normals[:, 2])
+            shading_normal[is_triangle] = np.where(self.triangle_has_vertex_normals[triangles][:, None],
+                                                   smooth_normal,
+                                                   outward_normal[is_triangle])
+
+            vertex_texture_coordinates = self.triangle_texture_coordinates[triangles]
+            texture_coordinates[is_triangle] = ((1.0 - triangle_u - triangle_v) * vertex_texture_coordinates[:, 0]
+                                                + triangle_u * vertex_texture_coordinates[:, 1]
+                                                + triangle_v * vertex_texture_coordinates[:, 2])
+            has_texture_coordinates[is_triangle] = self.triangle_has_texture_coordinates[triangles]
+            texture_density[is_triangle] = self.triangle_texture_density[triangles]
+
+        if is_instance.any():
+            instance_hits = primitive[is_instance]
+            instances = np.searchsorted(self.instance_hit_start, instance_hits, side='right') - 1
+            triangles = (self.instanced_mesh_first_triangle[self.instance_mesh_index[instances]]
+                         + instance_hits - self.instance_hit_start[instances])
+            triangle_u = u[is_instance][:, None]
+            triangle_v = v[is_instance][:, None]
+            #normals leave the mesh's space through the inverse transpose of its transform
+            normal_to_world = np.transpose(self.instance_world_to_object[instances, :, :3], (0, 2, 1))
+            outward_normal[is_instance] = normalize_rows(
+                np.einsum('ijk,ik->ij', normal_to_world, self.instanced_normal[triangles]))
+            material_index[is_instance] = self.instance_material_index[instances]
+
+            vertex_normals = self.instanced_vertex_normals[triangles]
+            smooth_normal = ((1.0 - triangle_u - triangle_v) * vertex_normals[:, 0]
+                             + triangle_u * vertex_normals[:, 1]
+                             + triangle_v * vertex_normals[:, 2])
+            smooth_normal = normalize_rows(np.einsum('ijk,ik->ij', normal_to_world, smooth_normal))
+            shading_normal[is_instance] = np.where(self.instanced_has_vertex_normals[triangles][:, None],
+                                                   smooth_normal,
+                                                   outward_normal[is_instance])
+
+            vertex_texture_coordinates = self.instanced_texture_coordinates[triangles]
+            texture_coordinates[is_instance] = ((1.0 - triangle_u - triangle_v) * vertex_texture_coordinates[:, 0]
+                                                + triangle_u * vertex_texture_coordinates[:, 1]
+                                                + triangle_v * vertex_texture_coordinates[:, 2])
+            has_texture_coordinates[is_instance] = self.instanced_has_texture_coordinates[triangles]
+            texture_density[is_instance] = self.instanced_texture_density[triangles] / self.instance_scale[instances]
+
+        front_face = np.einsum('ij,ij->i', rays.directions, outward_normal) < 0.0
+        normal = np.where(front_face[:, None], shading_normal, -shading_normal)
+        return HitRecordBatch(
+            time=time,
+            point=point,
+            normal=normal,
+            material_index=material_index,
+            front_face=front_face,
+            texture_coordinates=texture_coordinates,
+            has_texture_coordinates=has_texture_coordinates,
+            texture_footprint=texture_density,
+            primitive_index=primitive,
+        )
@@ -5,13 +5,115 @@ from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
     from materials import Material
+    from ray import Ray
+
+
+#marks a lazily computed HitRecord field that has not been asked for yet, None is a valid texture coordinate
+_UNSET = object()
 
 
-@dataclass
 class HitRecord:
-    time: float
+    #intersection only records the time, the primitive and where on it the ray landed (u, v and local, whatever
+    #that primitive needs), the point, normal, front_face and texture_coordinates are worked out by the primitive's
+    #hit_normal and hit_texture_coordinates the first time they are read. hits that lose to a closer one and
+    #materials that never read a field cost nothing for it
+    __slots__ = ('time', 'ray', 'primitive', 'material', 'u', 'v', 'local',
+                 '_point', '_normal', '_front_face', '_texture_coordinates')
+
+    def __init__(self, time: float, ray: Ray | None, primitive, material: Material,
+                 u: float = 0.0, v: float = 0.0, local=None):
+        self.time = time
+        self.ray = ray
+        self.primitive = primitive
+        self.material = material
+        self.u = u
+        self.v = v
+        self.local = local
+        self._point = _UNSET
+        self._normal = _UNSET
+        self._front_face = _UNSET
+        self._texture_coordinates = _UNSET
+
+    @classmethod
+    def shaded(cls,
+               time: float,
+               point: np.ndarray,
+               normal: np.ndarray,
+               material: Material,
+               front_face: bool,
+               texture_coordinates: np.ndarray | None = None) -> HitRecord:
+        #a record with every field already known, for hits that did not come from a scalar primitive
+        record = cls(time, None, None, material)
+        record._point = point
+        record._normal = normal
+        record._front_face = front_face
+        record._texture_coordinates = texture_coordinates
+        return record
+
+    @property
+    def point(self) -> np.ndarray:
+        if self._point is _UNSET:
+            self._point = self.ray.position(self.time)
+        return self._point
+
+    @property
+    def normal(self) -> np.ndarray:
+        if self._normal is _UNSET:
+            self._normal, self._front_face = self.primitive.hit_normal(self)
+        return self._normal
+
+    @property
+    def front_face(self) -> bool:
+        if self._front_face is _UNSET:
+            self._normal, self._front_face = self.primitive.hit_normal(self)
+        return self._front_face
+
+    @property
+    def texture_coordinates(self) -> np.ndarray | None:
+        if self._texture_coordinates is _UNSET:
+            self._texture_coordinates = self.primitive.hit_texture_coordinates(self)
+        return self._texture_coordinates
+
+
+@dataclass
+class HitRecordBatch:
+    time: np.ndarray
     point: np.ndarray
     normal: np.ndarray
-    material: Material
-    front_face: bool
-    texture_coordinates: np.ndarray | None = None
\ No newline at end of file
+    material_index: np.ndarray
+    front_face: np.ndarray
+    texture_coordinates: np.ndarray
+    has_texture_coordinates: np.ndarray
+    #texture coordinate extent of the ray cone at each hit, None when unknown
+    texture_footprint: np.ndarray | None = None
+    #index of the hit primitive in the scene, spheres first then triangles then each instance's triangles
+    primitive_index: np.ndarray | None = None
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+    def subset(self, selection: np.ndarray) -> HitRecordBatch:
+        return HitRecordBatch(
+            time=self.time[selection],
+            point=self.point[selection],
+            normal=self.normal[selection],
+            material_index=self.material_index[selection],
+            front_face=self.front_face[selection],
+            texture_coordinates=self.texture_coordinates[selection],
+            has_texture_coordinates=self.has_texture_coordinates[selection],
+            texture_footprint=None if self.texture_footprint is None else self.texture_footprint[selection],
+            primitive_index=None if self.primitive_index is None else self.primitive_index[selection],
+        )
+
+    def record(self, index: int, material: Material) -> HitRecord:
+        texture_coordinates = None
+        if self.has_texture_coordinates[index]:
+            texture_coordinates = self.texture_coordinates[index]
+        return HitRecord.shaded(
+            time=float(self.time[index]),
+            point=self.point[index],
+            normal=self.normal[index],
+            material=material,
+            front_face=bool(self.front_face[index]),
+            texture_coordinates=texture_coordinates,
+        )
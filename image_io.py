@@ -0,0 +1,100 @@
+import argparse
+import os
+import numpy as np
+from PIL import Image
+
+HDR_EXTENSIONS = ('.pfm',)
+TONEMAP_OPERATORS = ('clamp', 'reinhard', 'aces')
+
+
+def write_pfm(image: np.ndarray, path: str):
+    #portable float map: linear float32 rgb, rows stored bottom to top, a negative scale means little endian
+    image = np.asarray(image, dtype='<f4')
+    height, width = image.shape[:2]
+    with open(path, 'wb') as file:
+        file.write(f'PF\n{width} {height}\n-1.0\n'.encode('ascii'))
+        file.write(np.ascontiguousarray(image[::-1]).tobytes())
+
+
+def read_pfm(path: str) -> np.ndarray:
+    with open(path, 'rb') as file:
+        #the header is three whitespace separated lines, read token by token so any line ending works
+        tokens = []
+        while len(tokens) < 4:
+            token = b''
+            while True:
+                character = file.read(1)
+                if not character:
+                    raise ValueError(f'{path} ends inside its PFM header')
+                if character.isspace():
+                    if token:
+                        break
+                    continue
+                token += character
+            tokens.append(token)
+        #the data starts right after the single whitespace ending the header, or after a \r\n
+        if character == b'\r' and file.read(1) not in (b'\n', b''):
+            file.seek(-1, os.SEEK_CUR)
+        kind, width, height, scale = tokens[0], int(tokens[1]), int(tokens[2]), float(tokens[3])
+        if kind not in (b'PF', b'Pf'):
+            raise ValueError(f'{path} is not a PFM file')
+        channels = 3 if kind == b'PF' else 1
+        dtype = '<f4' if scale < 0 else '>f4'
+        data = np.frombuffer(file.read(width * height * channels * 4), dtype=dtype)
+    if data.size != width * height * channels:
+        raise ValueError(f'{path} is shorter than its {width}x{height} header says')
+    image = data.reshape(height, width, channels)[::-1].astype(np.float32)
+    return np.repeat(image, 3, axis=2) if channels == 1 else image
+
+
+def tonemap(image: np.ndarray, exposure: float = 0.0, operator: str = 'clamp', gamma: float = 1.0) -> np.ndarray:
+    #linear radiance to 8 bit display values. exposure is in stops, gamma 1 keeps the values linear as the
+    #renderer always wrote them
+    color = np.asarray(image, dtype=np.float32) * np.float32(2.0 ** exposure)
+    if operator == 'reinhard':
+        color = color / (1.0 + color)
+    elif operator == 'aces':
+        #narkowicz's fit of the aces filmic curve
+        color = (color * (2.51 * color + 0.03)) / (color * (2.43 * color + 0.59) + 0.14)
+    elif operator != 'clamp':
+        raise ValueError(f'Unknown tonemap operator {operator}, expected one of {", ".join(TONEMAP_OPERATORS)}')
+    color = np.clip(color, 0.0, 1.0)
+    if gamma != 1.0:
+        color = color ** np.float32(1.0 / gamma)
+    return (color * 255).astype(np.uint8)
+
+
+def save_image(image: np.ndarray, path: str, exposure: float = 0.0, operator: str = 'clamp', gamma: float = 1.0):
+    #hdr extensions keep the linear radiance as is, anything else is tonemapped for display.
+    #the file is written next to the target and moved over it, so a viewer watching a preview never
+    #sees half of one
+    root, extension = os.path.splitext(path)
+    temporary_path = root + '.partial' + extension
+    if extension.lower() in HDR_EXTENSIONS:
+        write_pfm(image, temporary_path)
+    else:
+        Image.fromarray(tonemap(image, exposure, operator, gamma)).save(temporary_path)
+    os.replace(temporary_path, path)
+
+
+def load_radiance(path: str) -> np.ndarray:
+    #a pfm written by the renderer, or a checkpoint directory left by render_resumable
+    if os.path.isdir(path):
+        from accumulation import AccumulationBuffer
+        return AccumulationBuffer.open(path).image()
+    return read_pfm(path)
+
+
+def main(arguments: list[str] | None = None):
+    parser = argparse.ArgumentParser(description='Tonemap a saved linear render to a png without rendering again')
+    parser.add_argument('input', help='a .pfm file or a checkpoint directory')
+    parser.add_argument('-o', '--output', default='output.png')
+    parser.add_argument('--exposure', type=float, default=0.0, help='in stops')
+    parser.add_argument('--tonemap', choices=TONEMAP_OPERATORS, default='clamp')
+    parser.add_argument('--gamma', type=float, default=1.0)
+    arguments = parser.parse_args(arguments)
+    save_image(load_radiance(arguments.input), arguments.output, arguments.exposure, arguments.tonemap, arguments.gamma)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+import numpy as np
+
+from aabb import Axis_Aligned_Bounding_Box
+from hit_record import HitRecord
+from materials import Material
+from mesh import Mesh
+from ray import Ray, normalize
+
+
+def box_corners(minimum: np.ndarray, maximum: np.ndarray) -> np.ndarray:
+    #the 8 corners of each box, minimum and maximum are (..., 3)
+    choose_maximum = np.array([[(corner >> axis) & 1 for axis in range(3)] for corner in range(8)], dtype=bool)
+    return np.where(choose_maximum, maximum[..., None, :], minimum[..., None, :])
+
+
+class Instance:
+    #one placement of a shared Mesh, rays are moved into the mesh's own space so its triangles and bvh are
+    #never copied. material replaces the mesh's when given
+    def __init__(self, mesh: Mesh, transform: np.ndarray, material: Material | None = None):
+        self.mesh = mesh
+        self.material = material if material is not None else mesh.material
+        self.object_to_world = np.asarray(transform, dtype=np.float64)[:3, :4].copy()
+        linear = self.object_to_world[:3, :3]
+        inverse_linear = np.linalg.inv(linear)
+        self.world_to_object = np.concatenate((inverse_linear, -inverse_linear @ self.object_to_world[:3, 3:]), axis=1)
+        #normals go back to world space with the inverse transpose
+        self.normal_to_world = inverse_linear.T
+
+    def hit(self, ray: Ray, time_min: float, time_max: float) -> HitRecord | None:
+        #the direction is not normalized after the transform so hit times stay the same in both spaces
+        object_ray = Ray(self.world_to_object[:, :3] @ ray.origin + self.world_to_object[:, 3],
+                         self.world_to_object[:, :3] @ ray.direction,
+                         ray.time)
+        hit = self.mesh.hit(object_ray, time_min, time_max)
+        if hit is None:
+            return None
+        #local keeps the mesh's own record, shaded in the mesh's space only if asked
+        return HitRecord(hit.time, ray, self, self.material, hit.u, hit.v, hit)
+
+    def hit_normal(self, hit_record: HitRecord) -> tuple[np.ndarray, bool]:
+        #the inverse transpose keeps the normal on the same side of the ray as in the mesh's space
+        object_hit = hit_record.local
+        return normalize(self.normal_to_world @ object_hit.normal), object_hit.front_face
+
+    def hit_texture_coordinates(self, hit_record: HitRecord) -> np.ndarray | None:
+        return hit_record.local.texture_coordinates
+
+    def bounding_box(self) -> Axis_Aligned_Bounding_Box:
+        box = self.mesh.bounding_box()
+        corners = box_corners(np.asarray(box.minimum_vertice, dtype=np.float64),
+                              np.asarray(box.maximum_vertice, dtype=np.float64))
+        corners = corners @ self.object_to_world[:, :3].T + self.object_to_world[:, 3]
+        return Axis_Aligned_Bounding_Box(corners.min(axis=0).astype(np.float32), corners.max(axis=0).astype(np.float32))
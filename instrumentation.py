@@ -0,0 +1,126 @@
+import collections
+import contextlib
+import time
+import numpy as np
+from PIL import Image
+
+from render_settings import RenderSettings
+
+
+class ProfilerHook:
+    #subclass and override what you need, stage calls happen in whichever thread or process renders the tile
+    def start_stage(self, stage: str, tile: tuple[int, int, int, int]):
+        pass
+
+    def end_stage(self, stage: str, tile: tuple[int, int, int, int], seconds: float):
+        pass
+
+    def end_tile(self, profile: 'TileProfile'):
+        pass
+
+
+class TileProfile:
+    #counters for one tile, filled by the thread or process rendering it and merged afterwards
+    def __init__(self, tile: tuple[int, int, int, int], hooks: list[ProfilerHook]):
+        self.tile = tile
+        self.hooks = hooks
+        self.counters = collections.Counter()
+        self.primitive_hits = collections.Counter()
+        self.material_hits = collections.Counter()
+        self.path_lengths = collections.Counter()
+        self.stage_seconds = collections.Counter()
+        row_start, row_end, column_start, column_end = tile
+        #node visits plus primitive tests of every path through each pixel
+        self.pixel_cost = np.zeros((row_end - row_start) * (column_end - column_start))
+        #cost of every ray of the latest FlatScene.intersect call, then of every path of the latest trace_paths call
+        self.ray_cost = np.zeros(0)
+        self.path_cost = np.zeros(0)
+
+    def add_pixel_cost(self, pixel_x: np.ndarray, pixel_y: np.ndarray, cost: np.ndarray, image_height: int):
+        #pixel_y counts from the bottom like the camera does
+        row_start, _, column_start, column_end = self.tile
+        tile_pixels = (image_height - 1 - pixel_y - row_start) * (column_end - column_start) + pixel_x - column_start
+        self.pixel_cost += np.bincount(tile_pixels, cost, minlength=self.pixel_cost.size)
+
+    @contextlib.contextmanager
+    def stage(self, stage: str):
+        for hook in self.hooks:
+            hook.start_stage(stage, self.tile)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.stage_seconds[stage] += seconds
+            for hook in self.hooks:
+                hook.end_stage(stage, self.tile, seconds)
+
+
+def profile_stage(profile: TileProfile | None, stage: str):
+    return contextlib.nullcontext() if profile is None else profile.stage(stage)
+
+
+def heatmap_colors(values: np.ndarray) -> np.ndarray:
+    #black, red, yellow, white as the value goes from the smallest to the largest
+    peak = values.max()
+    scaled = values / peak if peak > 0 else np.zeros_like(values)
+    colors = np.clip(np.stack((3.0 * scaled, 3.0 * scaled - 1.0, 3.0 * scaled - 2.0), axis=-1), 0.0, 1.0)
+    return (colors * 255).astype(np.uint8)
+
+
+class Instrumentation:
+    #passed to the renderers to switch profiling on, everything left as None costs nothing
+    def __init__(self, settings: RenderSettings, hooks: list[ProfilerHook] | None = None):
+        self.hooks = list(hooks or [])
+        self.counters = collections.Counter()
+        self.primitive_hits = collections.Counter()
+        self.material_hits = collections.Counter()
+        self.path_lengths = collections.Counter()
+        self.stage_seconds = collections.Counter()
+        self.tile_stage_seconds: dict[tuple[int, int, int, int], dict[str, float]] = {}
+        self.heatmaps = {
+            'cost': np.zeros((settings.height, settings.width)),
+            'seconds': np.zeros((settings.height, settings.width)),
+        }
+
+    def tile_profile(self, tile: tuple[int, int, int, int]) -> TileProfile:
+        return TileProfile(tile, self.hooks)
+
+    def add_tile(self, profile: TileProfile):
+        self.counters.update(profile.counters)
+        self.primitive_hits.update(profile.primitive_hits)
+        self.material_hits.update(profile.material_hits)
+        self.path_lengths.update(profile.path_lengths)
+        self.stage_seconds.update(profile.stage_seconds)
+        self.tile_stage_seconds[profile.tile] = dict(profile.stage_seconds)
+
+        row_start, row_end, column_start, column_end = profile.tile
+        tile_shape = (row_end - row_start, column_end - column_start)
+        self.heatmaps['cost'][row_start:row_end, column_start:column_end] = profile.pixel_cost.reshape(tile_shape)
+        #wall time is only known per tile, it is spread evenly over the tile's pixels
+        tile_seconds = profile.stage_seconds['tile'] / (tile_shape[0] * tile_shape[1])
+        self.heatmaps['seconds'][row_start:row_end, column_start:column_end] = tile_seconds
+        for hook in self.hooks:
+            hook.end_tile(profile)
+
+    def tile_seconds(self) -> dict[tuple[int, int, int, int], float]:
+        #wall time of each tile's latest render, what tile_size and min_tile_size are tuned against
+        return {tile: stage_seconds.get('tile', 0.0) for tile, stage_seconds in self.tile_stage_seconds.items()}
+
+    def summary(self) -> dict:
+        tile_seconds = np.array(list(self.tile_seconds().values()))
+        return {
+            'counters': dict(self.counters),
+            'primitive_hits': dict(self.primitive_hits),
+            'material_hits': dict(self.material_hits),
+            'path_lengths': dict(sorted(self.path_lengths.items())),
+            'stage_seconds': dict(self.stage_seconds),
+            'tiles': {
+                'count': len(tile_seconds),
+                'median_seconds': float(np.median(tile_seconds)) if len(tile_seconds) else 0.0,
+                'max_seconds': float(tile_seconds.max()) if len(tile_seconds) else 0.0,
+            },
+        }
+
+    def write_heatmap(self, path: str, heatmap: str = 'cost'):
+        Image.fromarray(heatmap_colors(self.heatmaps[heatmap])).save(path)
@@ -0,0 +1,310 @@
+import math
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+#auto compiles the kernels when numba is installed and keeps to numpy otherwise
+BACKENDS = ('auto', 'numpy', 'numba')
+
+
+def compiled_backend(backend: str) -> bool:
+    #whether closest hits should go through the compiled kernels
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown backend {backend}, expected one of {", ".join(BACKENDS)}')
+    if backend == 'numba' and numba is None:
+        raise ImportError('The numba backend needs numba installed, auto falls back to numpy without it')
+    return backend != 'numpy' and numba is not None
+
+
+def compile_kernel(function):
+    #the machine code is cached under __pycache__ so only the first run after an edit waits for compiling.
+    #nogil lets the thread renderer run kernels side by side, the numpy error model gives inf for 1 / 0.
+    #without numba the kernels stay plain python, which is far too slow to render with but is never picked
+    if numba is None:
+        return function
+    return numba.njit(cache=True, nogil=True, error_model='numpy')(function)
+
+
+@compile_kernel
+def _fmin(a, b):
+    #np.fmin, a nan on one side gives the other
+    if a != a:
+        return b
+    if b != b:
+        return a
+    return a if a < b else b
+
+
+@compile_kernel
+def _fmax(a, b):
+    if a != a:
+        return b
+    if b != b:
+        return a
+    return a if a > b else b
+
+
+@compile_kernel
+def _slab(node_minimum, node_maximum, node, origin, inverse_direction, time_min, time_max):
+    #FlatBVH._slab for one ray and one node
+    entry = time_min
+    exit = time_max
+    for axis in range(3):
+        time_reached = (node_minimum[node, axis] - origin[axis]) * inverse_direction[axis]
+        time_exited = (node_maximum[node, axis] - origin[axis]) * inverse_direction[axis]
+        entry = _fmax(entry, _fmin(time_reached, time_exited))
+        exit = _fmin(exit, _fmax(time_reached, time_exited))
+    return entry, exit
+
+
+@compile_kernel
+def _hit_sphere(origin, direction, time, sphere, time_min, time_max, spheres):
+    #FlatScene._hit_spheres for one pair, inf for a miss
+    center0, center1, time0, time1, radius = spheres
+    relative_time = 0.0
+    if time0[sphere] != time1[sphere]:
+        relative_time = (time - time0[sphere]) / (time1[sphere] - time0[sphere])
+    a = 0.0
+    b = 0.0
+    c = 0.0
+    for axis in range(3):
+        center = center0[sphere, axis] + relative_time * (center1[sphere, axis] - center0[sphere, axis])
+        o_minus_c = origin[axis] - center
+        a += direction[axis] * direction[axis]
+        b += direction[axis] * o_minus_c
+        c += o_minus_c * o_minus_c
+    b = 2.0 * b
+    c -= radius[sphere] * radius[sphere]
+
+    b_squared_minus_4ac = b * b - 4 * a * c
+    if b_squared_minus_4ac < 0:
+        return np.inf
+    root = math.sqrt(b_squared_minus_4ac)
+    near_time = (-b - root) / (2 * a)
+    if time_min <= near_time <= time_max:
+        return near_time
+    far_time = (-b + root) / (2 * a)
+    if time_min <= far_time <= time_max:
+        return far_time
+    return np.inf
+
+
+@compile_kernel
+def _hit_triangle(origin, direction, triangle, time_min, time_max, v0, e1, e2, normal):
+    #triangle.hit_triangles for one pair, returns time, u and v with inf for a miss
+    negative_x = -direction[0]
+    negative_y = -direction[1]
+    negative_z = -direction[2]
+    cramer_denominator = (negative_x * normal[triangle, 0] + negative_y * normal[triangle, 1]
+                          + negative_z * normal[triangle, 2])
+    if abs(cramer_denominator) < 1e-6:
+        return np.inf, 0.0, 0.0
+
+    o_x = origin[0] - v0[triangle, 0]
+    o_y = origin[1] - v0[triangle, 1]
+    o_z = origin[2] - v0[triangle, 2]
+    e1_x, e1_y, e1_z = e1[triangle, 0], e1[triangle, 1], e1[triangle, 2]
+    e2_x, e2_y, e2_z = e2[triangle, 0], e2[triangle, 1], e2[triangle, 2]
+    u = (o_x * (e2_y * negative_z - e2_z * negative_y)
+         + o_y * (e2_z * negative_x - e2_x * negative_z)
+         + o_z * (e2_x * negative_y - e2_y * negative_x)) / cramer_denominator
+    v = (e1_x * (o_y * negative_z - o_z * negative_y)
+         + e1_y * (o_z * negative_x - o_x * negative_z)
+         + e1_z * (o_x * negative_y - o_y * negative_x)) / cramer_denominator
+    time = (e1_x * (e2_y * o_z - e2_z * o_y)
+            + e1_y * (e2_z * o_x - e2_x * o_z)
+            + e1_z * (e2_x * o_y - e2_y * o_x)) / cramer_denominator
+    if (0.0 <= u <= 1.0 and 0.0 <= v <= 1.0 and u + v <= 1.0
+            and time_min <= time <= time_max):
+        return time, u, v
+    return np.inf, 0.0, 0.0
+
+
+@compile_kernel
+def _push_children(node_minimum, node_maximum, node_offset, node, origin, inverse_direction, time_min, time_max,
+                   stack_nodes, stack_entry, stack_size):
+    #the far child goes on the stack first so the near one is walked next, returns the new stack size
+    left = node_offset[node]
+    right = left + 1
+    left_entry, left_exit = _slab(node_minimum, node_maximum, left, origin, inverse_direction, time_min, time_max)
+    right_entry, right_exit = _slab(node_minimum, node_maximum, right, origin, inverse_direction, time_min, time_max)
+    if left_entry <= right_entry:
+        near, near_entry, near_exit = left, left_entry, left_exit
+        far, far_entry, far_exit = right, right_entry, right_exit
+    else:
+        near, near_entry, near_exit = right, right_entry, right_exit
+        far, far_entry, far_exit = left, left_entry, left_exit
+    if far_entry <= far_exit:
+        stack_nodes[stack_size] = far
+        stack_entry[stack_size] = far_entry
+        stack_size += 1
+    if near_entry <= near_exit:
+        stack_nodes[stack_size] = near
+        stack_entry[stack_size] = near_entry
+        stack_size += 1
+    return stack_size
+
+
+@compile_kernel
+def _hit_mesh(origin, direction, inverse_direction, root, time_min, time_max, meshes, stack_nodes, stack_entry):
+    #walks one instanced mesh's bvh in the mesh's space, returns time, triangle, u and v with -1 for a miss.
+    #the mesh bvhs are stored one after another, their leaves already pointing at triangles in instanced_v0
+    node_minimum, node_maximum, node_offset, node_count, primitive_indices, v0, e1, e2, normal = meshes
+    closest_time = time_max
+    closest_triangle = -1
+    closest_u = 0.0
+    closest_v = 0.0
+    entry, exit = _slab(node_minimum, node_maximum, root, origin, inverse_direction, time_min, closest_time)
+    if not entry <= exit:
+        return closest_time, closest_triangle, closest_u, closest_v
+    stack_nodes[0] = root
+    stack_entry[0] = entry
+    stack_size = 1
+    while stack_size > 0:
+        stack_size -= 1
+        node = stack_nodes[stack_size]
+        if not stack_entry[stack_size] <= closest_time:
+            continue
+        count = node_count[node]
+        if count > 0:
+            for position in range(node_offset[node], node_offset[node] + count):
+                triangle = primitive_indices[position]
+                time, u, v = _hit_triangle(origin, direction, triangle, time_min, closest_time, v0, e1, e2, normal)
+                if time < np.inf:
+                    closest_time, closest_triangle, closest_u, closest_v = time, triangle, u, v
+        else:
+            stack_size = _push_children(node_minimum, node_maximum, node_offset, node, origin, inverse_direction,
+                                        time_min, closest_time, stack_nodes, stack_entry, stack_size)
+    return closest_time, closest_triangle, closest_u, closest_v
+
+
+@compile_kernel
+def _closest_hits(origins, directions, times, time_min, closest_time, closest_primitive, closest_u, closest_v,
+                  ray_node_visits, ray_tests, kind_tests, bvh, max_depth, sphere_count, spheres, instance_start,
+                  triangles, instances, meshes, mesh_max_depth):
+    #every ray walks the whole bvh on its own, instances are entered as soon as a leaf reaches them
+    node_minimum, node_maximum, node_offset, node_count, primitive_indices = bvh
+    v0, e1, e2, normal = triangles
+    world_to_object, instance_root, instance_hit_offset = instances
+    stack_nodes = np.zeros(max_depth + 2, dtype=np.int64)
+    stack_entry = np.zeros(max_depth + 2)
+    mesh_stack_nodes = np.zeros(mesh_max_depth + 2, dtype=np.int64)
+    mesh_stack_entry = np.zeros(mesh_max_depth + 2)
+    inverse_direction = np.zeros(3)
+    object_origin = np.zeros(3)
+    object_direction = np.zeros(3)
+    object_inverse_direction = np.zeros(3)
+    for ray in range(len(origins)):
+        origin = origins[ray]
+        direction = directions[ray]
+        for axis in range(3):
+            inverse_direction[axis] = 1.0 / direction[axis]
+        entry, exit = _slab(node_minimum, node_maximum, 0, origin, inverse_direction, time_min, closest_time[ray])
+        if not entry <= exit:
+            continue
+        stack_nodes[0] = 0
+        stack_entry[0] = entry
+        stack_size = 1
+        while stack_size > 0:
+            stack_size -= 1
+            node = stack_nodes[stack_size]
+            if not stack_entry[stack_size] <= closest_time[ray]:
+                continue
+            ray_node_visits[ray] += 1
+            count = node_count[node]
+            if count == 0:
+                stack_size = _push_children(node_minimum, node_maximum, node_offset, node, origin,
+                                            inverse_direction, time_min, closest_time[ray], stack_nodes,
+                                            stack_entry, stack_size)
+                continue
+
+            ray_tests[ray] += count
+            for position in range(node_offset[node], node_offset[node] + count):
+                primitive = primitive_indices[position]
+                if primitive < sphere_count:
+                    kind_tests[0] += 1
+                    time = _hit_sphere(origin, direction, times[ray], primitive, time_min, closest_time[ray],
+                                       spheres)
+                    if time < np.inf:
+                        closest_time[ray] = time
+                        closest_primitive[ray] = primitive
+                        closest_u[ray] = 0.0
+                        closest_v[ray] = 0.0
+                elif primitive < instance_start:
+                    kind_tests[1] += 1
+                    time, u, v = _hit_triangle(origin, direction, primitive - sphere_count, time_min,
+                                               closest_time[ray], v0, e1, e2, normal)
+                    if time < np.inf:
+                        closest_time[ray] = time
+                        closest_primitive[ray] = primitive
+                        closest_u[ray] = u
+                        closest_v[ray] = v
+                else:
+                    kind_tests[2] += 1
+                    #the moved direction is not normalized so hit times are the same in both spaces
+                    instance = primitive - instance_start
+                    for row in range(3):
+                        object_origin[row] = world_to_object[instance, row, 3]
+                        object_direction[row] = 0.0
+                        for column in range(3):
+                            object_origin[row] += world_to_object[instance, row, column] * origin[column]
+                            object_direction[row] += world_to_object[instance, row, column] * direction[column]
+                        object_inverse_direction[row] = 1.0 / object_direction[row]
+                    time, triangle, u, v = _hit_mesh(object_origin, object_direction, object_inverse_direction,
+                                                     instance_root[instance], time_min, closest_time[ray], meshes,
+                                                     mesh_stack_nodes, mesh_stack_entry)
+                    if triangle >= 0:
+                        closest_time[ray] = time
+                        closest_primitive[ray] = instance_hit_offset[instance] + triangle
+                        closest_u[ray] = u
+                        closest_v[ray] = v
+
+
+def pack_meshes(bvhs: list, first_triangles: np.ndarray) -> tuple[tuple[np.ndarray, ...], np.ndarray, int]:
+    #every instanced mesh's bvh one after another, interior nodes pointing at their children in the packed
+    #arrays and leaves at triangles in the scene's instanced arrays. returns the node arrays, each mesh's root
+    #and the deepest mesh
+    node_starts = np.cumsum([0] + [len(bvh.node_count) for bvh in bvhs])
+    primitive_starts = np.cumsum([0] + [len(bvh.primitive_indices) for bvh in bvhs])
+    node_minimum = [np.zeros((0, 3))]
+    node_maximum = [np.zeros((0, 3))]
+    node_offset = [np.zeros(0, dtype=np.int64)]
+    node_count = [np.zeros(0, dtype=np.int64)]
+    primitive_indices = [np.zeros(0, dtype=np.int64)]
+    for bvh, node_start, primitive_start, first_triangle in zip(bvhs, node_starts, primitive_starts,
+                                                                first_triangles):
+        node_minimum.append(bvh.node_minimum)
+        node_maximum.append(bvh.node_maximum)
+        node_offset.append(bvh.node_offset + np.where(bvh.node_count > 0, primitive_start, node_start))
+        node_count.append(bvh.node_count)
+        primitive_indices.append(bvh.primitive_indices + first_triangle)
+    arrays = tuple(np.ascontiguousarray(np.concatenate(array)) for array in
+                   (node_minimum, node_maximum, node_offset, node_count, primitive_indices))
+    return arrays, node_starts[:-1].astype(np.int64), max([bvh.max_depth for bvh in bvhs], default=0)
+
+
+def closest_hits(origins: np.ndarray,
+                 directions: np.ndarray,
+                 times: np.ndarray,
+                 time_min: float,
+                 closest_time: np.ndarray,
+                 closest_primitive: np.ndarray,
+                 closest_u: np.ndarray,
+                 closest_v: np.ndarray,
+                 scene_arrays: tuple) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    #FlatScene.closest_hits through the compiled kernel, writing into the same closest arrays. scene_arrays comes
+    #from FlatScene.kernel_arrays. returns the nodes each ray visited, the primitives each ray tested and how many
+    #sphere, triangle and instance tests there were
+    ray_count = len(origins)
+    ray_node_visits = np.zeros(ray_count, dtype=np.int64)
+    ray_tests = np.zeros(ray_count, dtype=np.int64)
+    kind_tests = np.zeros(3, dtype=np.int64)
+    _closest_hits(np.ascontiguousarray(origins, dtype=np.float64),
+                  np.ascontiguousarray(directions, dtype=np.float64),
+                  np.ascontiguousarray(times, dtype=np.float64),
+                  float(time_min), closest_time, closest_primitive, closest_u, closest_v,
+                  ray_node_visits, ray_tests, kind_tests, *scene_arrays)
+    return ray_node_visits, ray_tests, kind_tests
@@ -1,26 +1,59 @@
 import math
 import numpy as np
 
-from hit_record import HitRecord
-from ray import Ray, normalize, random_point_in_unit_sphere, random_unit_vector, reflect, refract, schlick
+from hit_record import HitRecord, HitRecordBatch
+from ray import (Ray, RayBatch, normalize, normalize_rows, random_point_in_unit_sphere, random_points_in_unit_sphere,
+                 random_unit_vector, random_unit_vectors, reflect, reflect_rows, refract, refract_rows, schlick)
+from sampler import PathSampler
 from texture import Texture
 
 
 class Material:
-    def scatter(self, incoming_ray: Ray, hit_record: HitRecord):
+    #diffuse materials scatter with a cosine weighted lobe and return their albedo as attenuation,
+    #the renderer samples lights directly at their hits
+    diffuse = False
+
+    def scatter(self, incoming_ray: Ray, hit_record: HitRecord, rng: np.random.Generator | None = None):
         raise NotImplementedError
     
     def emitted(self):
         return np.zeros(3, dtype=np.float32)
+
+    def scatter_batch(self, incoming_rays: RayBatch, hit_records: HitRecordBatch, rng: PathSampler):
+        #fallback for materials without a vectorized scatter, one scalar scatter per hit drawing from its path's stream
+        count = len(hit_records)
+        attenuation = np.zeros((count, 3), dtype=np.float32)
+        origins = np.zeros((count, 3))
+        directions = np.zeros((count, 3))
+        scattered = np.zeros(count, dtype=bool)
+        for i in range(count):
+            incoming_ray = Ray(incoming_rays.origins[i], incoming_rays.directions[i], float(incoming_rays.times[i]))
+            ray_attenuation, scatter_ray = self.scatter(incoming_ray, hit_records.record(i, self), rng.generator(i))
+            if ray_attenuation is None or scatter_ray is None:
+                continue
+            attenuation[i] = ray_attenuation
+            origins[i] = scatter_ray.origin
+            directions[i] = scatter_ray.direction
+            scattered[i] = True
+        return attenuation, RayBatch(origins, directions, incoming_rays.times), scattered
+
+    def emitted_batch(self, count: int) -> np.ndarray:
+        return np.broadcast_to(self.emitted(), (count, 3))
+
+    def albedo_batch(self, hit_records: HitRecordBatch) -> np.ndarray:
+        #surface color for the denoiser's albedo buffer
+        return np.ones((len(hit_records), 3), dtype=np.float32)
     
 class Lambertian(Material):
+    diffuse = True
+
     def __init__(self, base_color: np.ndarray = np.array([0.0, 0.0, 0.0], dtype=np.float32),
                  texture: Texture | None = None):
         self.base_color = base_color
         self.texture = texture 
 
-    def scatter(self, incoming_ray: Ray, hit_record: HitRecord):
-        scatter_direction = hit_record.normal + random_unit_vector()
+    def scatter(self, incoming_ray: Ray, hit_record: HitRecord, rng: np.random.Generator | None = None):
+        scatter_direction = hit_record.normal + random_unit_vector(rng)
         if np.allclose(scatter_direction, 0.0):
             scatter_direction = hit_record.normal
 
@@ -29,31 +62,72 @@ class Lambertian(Material):
         else:
             attenuation = self.base_color
         
-        scatter_ray = Ray(hit_record.point + hit_record.normal * 1e-3, scatter_direction)
+        scatter_ray = Ray(hit_record.point + hit_record.normal * 1e-3, scatter_direction, incoming_ray.time)
         return attenuation, scatter_ray
 
+    def scatter_batch(self, incoming_rays: RayBatch, hit_records: HitRecordBatch, rng: PathSampler):
+        count = len(hit_records)
+        scatter_directions = hit_records.normal + random_unit_vectors(count, rng)
+        degenerate = np.all(np.abs(scatter_directions) <= 1e-8, axis=1)
+        scatter_directions[degenerate] = hit_records.normal[degenerate]
+
+        attenuation = self.albedo_batch(hit_records)
+        scatter_rays = RayBatch(hit_records.point + hit_records.normal * 1e-3, scatter_directions, incoming_rays.times)
+        return attenuation, scatter_rays, np.ones(count, dtype=bool)
+
+    def albedo_batch(self, hit_records: HitRecordBatch) -> np.ndarray:
+        albedo = np.empty((len(hit_records), 3), dtype=np.float32)
+        albedo[:] = self.base_color
+        if self.texture is not None:
+            textured = hit_records.has_texture_coordinates
+            if textured.any():
+                footprints = None if hit_records.texture_footprint is None else hit_records.texture_footprint[textured]
+                albedo[textured] = self.texture.sample_batch(hit_records.texture_coordinates[textured, 0],
+                                                             hit_records.texture_coordinates[textured, 1],
+                                                             hit_records.point[textured],
+                                                             footprints)
+        return albedo
+
 class Metal(Material):
     def __init__(self, base_color: np.ndarray, fuzz: float = 0.0):
         self.base_color = base_color
         self.fuzz = min(fuzz, 1.0)
 
-    def scatter(self, incoming_ray: Ray, hit_record: HitRecord):
+    def scatter(self, incoming_ray: Ray, hit_record: HitRecord, rng: np.random.Generator | None = None):
         unit_incoming_direction = normalize(incoming_ray.direction)
         reflected_direction = reflect(unit_incoming_direction, hit_record.normal)
-        fuzzy_reflected_direction = reflected_direction + self.fuzz * random_point_in_unit_sphere()
-        scatter_ray = Ray(hit_record.point + hit_record.normal * 1e-3, fuzzy_reflected_direction)
+        fuzzy_reflected_direction = reflected_direction + self.fuzz * random_point_in_unit_sphere(rng)
+        scatter_ray = Ray(hit_record.point + hit_record.normal * 1e-3, fuzzy_reflected_direction, incoming_ray.time)
         
         if np.dot(scatter_ray.direction, hit_record.normal) <= 0:
             return None, None
         
         attenuation = self.base_color
         return attenuation, scatter_ray
+
+    def scatter_batch(self, incoming_rays: RayBatch, hit_records: HitRecordBatch, rng: PathSampler):
+        count = len(hit_records)
+        unit_incoming_directions = normalize_rows(incoming_rays.directions)
+        reflected_directions = reflect_rows(unit_incoming_directions, hit_records.normal)
+        fuzzy_reflected_directions = reflected_directions + self.fuzz * random_points_in_unit_sphere(count, rng)
+        scatter_rays = RayBatch(hit_records.point + hit_records.normal * 1e-3, fuzzy_reflected_directions,
+                                incoming_rays.times)
+
+        scattered = np.sum(fuzzy_reflected_directions * hit_records.normal, axis=1) > 0
+        attenuation = np.broadcast_to(self.base_color, (count, 3))
+        return attenuation, scatter_rays, scattered
+
+    def albedo_batch(self, hit_records: HitRecordBatch) -> np.ndarray:
+        return np.broadcast_to(self.base_color, (len(hit_records), 3))
     
 class Dielectric(Material):
     def __init__(self, refraction_index: float):
         self.refraction_index = refraction_index
 
-    def scatter(self, incoming_ray: Ray, hit_record: HitRecord) -> tuple[np.ndarray, Ray]:
+    def scatter(self,
+                incoming_ray: Ray,
+                hit_record: HitRecord,
+                rng: np.random.Generator | None = None) -> tuple[np.ndarray, Ray]:
         unit_incoming_direction = normalize(incoming_ray.direction)
         
         if hit_record.front_face:
@@ -67,22 +141,50 @@ class Dielectric(Material):
         do_not_refract = refraction_index_ratio * sin_theta > 1.0
         reflect_probability = schlick(cos_theta, self.refraction_index)
 
-        use_reflect = do_not_refract or np.random.rand() < reflect_probability
+        use_reflect = do_not_refract or (np.random if rng is None else rng).random() < reflect_probability
         if use_reflect:
             direction = reflect(unit_incoming_direction, hit_record.normal)
         else:
             direction = refract(unit_incoming_direction, hit_record.normal, refraction_index_ratio)
         
-        scatter_ray = Ray(hit_record.point + hit_record.normal * 1e-3, direction)
+        scatter_ray = Ray(hit_record.point + hit_record.normal * 1e-3, direction, incoming_ray.time)
         attenuation = np.array([1.0, 1.0, 1.0], dtype=np.float32)
         return attenuation, scatter_ray
+
+    def scatter_batch(self, incoming_rays: RayBatch, hit_records: HitRecordBatch, rng: PathSampler):
+        count = len(hit_records)
+        unit_incoming_directions = normalize_rows(incoming_rays.directions)
+        refraction_index_ratios = np.where(hit_records.front_face, 1.0 / self.refraction_index, self.refraction_index)
+
+        cos_theta = np.minimum(np.sum(-unit_incoming_directions * hit_records.normal, axis=1), 1.0)
+        sin_theta = np.sqrt(np.maximum(0.0, 1.0 - cos_theta ** 2))
+
+        do_not_refract = refraction_index_ratios * sin_theta > 1.0
+        reflect_probability = schlick(cos_theta, self.refraction_index)
+
+        use_reflect = do_not_refract | (rng.random(count) < reflect_probability)
+        directions = np.where(use_reflect[:, None],
+                              reflect_rows(unit_incoming_directions, hit_records.normal),
+                              refract_rows(unit_incoming_directions, hit_records.normal, refraction_index_ratios))
+
+        scatter_rays = RayBatch(hit_records.point + hit_records.normal * 1e-3, directions, incoming_rays.times)
+        attenuation = np.ones((count, 3), dtype=np.float32)
+        return attenuation, scatter_rays, np.ones(count, dtype=bool)
     
 class Emissive(Material):
     def __init__(self, emit_color: np.ndarray):
         self.emit_color = emit_color
 
-    def scatter(self, incoming_ray: Ray, hit_record: HitRecord) -> tuple[None, None]:
+    def scatter(self,
+                incoming_ray: Ray,
+                hit_record: HitRecord,
+                rng: np.random.Generator | None = None) -> tuple[None, None]:
         return None, None
+
+    def scatter_batch(self, incoming_rays: RayBatch, hit_records: HitRecordBatch, rng: PathSampler):
+        count = len(hit_records)
+        scatter_rays = RayBatch(np.zeros((count, 3)), np.zeros((count, 3)), incoming_rays.times)
+        return np.zeros((count, 3), dtype=np.float32), scatter_rays, np.zeros(count, dtype=bool)
     
     def emitted(self):
         return self.emit_color
\ No newline at end of file
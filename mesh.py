@@ -1,74 +1,118 @@
 from typing import Self
 import numpy as np
 from aabb import Axis_Aligned_Bounding_Box
-from bvh_node import BVHNode
+from flat_bvh import FlatBVH
+from hit_record import HitRecord
 from materials import Material
-from ray import Ray
-from triangle import Triangle
+from obj_loader import parse_obj, read_mesh_cache, write_mesh_cache
+from ray import Ray, normalize, normalize_rows
+from triangle import hit_triangles
 
 
 class Mesh:
-    def __init__(self, triangles: list[Triangle]):
-        self.bvh = BVHNode(triangles)
+    #one shared vertex buffer indexed by faces instead of a Triangle object per face
+    def __init__(self,
+                 vertices: np.ndarray,
+                 indices: np.ndarray,
+                 material: Material,
+                 normals: np.ndarray | None = None,
+                 texture_coordinates: np.ndarray | None = None,
+                 bvh: FlatBVH | None = None):
+        self.vertices = np.ascontiguousarray(vertices, dtype=np.float32)
+        self.indices = np.ascontiguousarray(indices, dtype=np.int32).reshape(-1, 3)
+        self.material = material
+        self.normals = None if normals is None else normalize_rows(np.asarray(normals, dtype=np.float32))
+        self.texture_coordinates = (None if texture_coordinates is None
+                                    else np.ascontiguousarray(texture_coordinates, dtype=np.float32))
+
+        face_vertices = self.vertices[self.indices]
+        self.v0 = face_vertices[:, 0]
+        self.e1 = face_vertices[:, 1] - self.v0
+        self.e2 = face_vertices[:, 2] - self.v0
+        self.face_normals = np.cross(self.e1, self.e2)
+
+        if bvh is None:
+            #padding if one of the x y or z of the triangle vertices are all the same
+            padding = 1e-3
+            bvh = FlatBVH.from_bounds(face_vertices.min(axis=1) - padding, face_vertices.max(axis=1) + padding)
+        self.bvh = bvh
+
+    @property
+    def triangle_count(self) -> int:
+        return len(self.indices)
 
     @classmethod
-    def from_vertices_indices(cls, vertices: np.ndarray, indices: list[tuple[int, int, int]], material: Material) -> Self:
-        triangles = []
-        for i0, i1, i2, in indices:
-            v0 = vertices[i0]
-            v1 = vertices[i1]
-            v2 = vertices[i2]
-            #make sure front face vertices are counter clockwise
-            triangles.append(Triangle(v0, v1, v2, material)) 
-        return cls(triangles)
-    
+    def from_vertices_indices(cls,
+                              vertices: np.ndarray,
+                              indices: list[tuple[int, int, int]],
+                              material: Material,
+                              normals: np.ndarray | None = None,
+                              texture_coordinates: np.ndarray | None = None) -> Self:
+        #make sure front face vertices are counter clockwise
+        return cls(vertices, np.asarray(indices, dtype=np.int32), material, normals, texture_coordinates)
+
     @classmethod
-    def load_from_file(cls, file_path: str, material: Material) -> Self:
-        vertices = []
-        indices = []
+    def load_from_file(cls, file_path: str, material: Material, use_cache: bool = True) -> Self:
+        #a binary cache with the parsed buffers and built bvh sits next to the source file
+        cached = read_mesh_cache(file_path) if use_cache else None
+        if cached is not None:
+            geometry, bvh = cached
+            return cls(material=material, bvh=bvh, **geometry)
 
-        with open(file_path, 'r') as file:
-            for line in file:
-                line = line.strip()
-                if not line or line.startswith('#'):
-                    continue
+        mesh = cls(material=material, **parse_obj(file_path))
+        if use_cache:
+            write_mesh_cache(file_path, mesh.geometry(), mesh.bvh)
+        return mesh
 
-                #format for vertice: v x y z
-                if line.startswith('v '):
-                    tokens = line.split()
-                    x = float(tokens[1])
-                    y = float(tokens[2])
-                    z = float(tokens[3])
-                    vertices.append([x, y, z])
-                #format for face: f i j k or f i/j/k i/j/k i/j/k
-                elif line.startswith('f '):
-                    tokens = line.split()[1:]
-                    triangle_indices = []
-                    for token in tokens:
-                        indice = int(token.split('/')[0]) - 1
-                        triangle_indices.append(indice)
-                    
-                    if len(triangle_indices) < 3:
-                        continue
-                    elif len(triangle_indices) == 3:
-                        indices.append((triangle_indices[0], triangle_indices[1], triangle_indices[2]))
-                    else:
-                        #handling quad and higher faces
-                        #(v0, v1, v2), (v0, v2, v3), ...
-                        v0 = triangle_indices[0]
-                        for i in range(1, len(triangle_indices) - 1):
-                            v1 = triangle_indices[i]
-                            v2 = triangle_indices[i+1]
-                            indices.append((v0, v1, v2))
-        
-        if not vertices or not indices:
-            raise ValueError(f'File {file_path} has error')
-        
-        vertices_np = np.array(vertices, dtype=np.float32)
-        return cls.from_vertices_indices(vertices_np, indices, material)
+    def geometry(self) -> dict[str, np.ndarray | None]:
+        return {
+            'vertices': self.vertices,
+            'indices': self.indices,
+            'normals': self.normals,
+            'texture_coordinates': self.texture_coordinates,
+        }
+
+    def _hit_leaf(self, first: int, count: int, ray: Ray, time_min: float, time_max: float) -> HitRecord | None:
+        #every triangle of the leaf against the ray at once, only the nearest one becomes a HitRecord
+        triangles = self.bvh.primitive_indices[first:first + count]
+        hit_time, u, v = hit_triangles(ray.origin, ray.direction,
+                                       self.v0[triangles], self.e1[triangles], self.e2[triangles],
+                                       self.face_normals[triangles], time_min, time_max)
+        nearest = int(np.argmin(hit_time))
+        if not np.isfinite(hit_time[nearest]):
+            return None
+        return HitRecord(float(hit_time[nearest]), ray, self, self.material,
+                         float(u[nearest]), float(v[nearest]), int(triangles[nearest]))
+
+    def hit_normal(self, hit_record: HitRecord) -> tuple[np.ndarray, bool]:
+        #local is the index of the triangle that was hit
+        triangle, u, v = hit_record.local, hit_record.u, hit_record.v
+        outward_normal = normalize(self.face_normals[triangle])
+        front_face = np.dot(hit_record.ray.direction, outward_normal) < 0.0
+        if self.normals is not None:
+            #phong shading / gouraud-style normal interpolation
+            corner_normals = self.normals[self.indices[triangle]]
+            smooth_normal = normalize(
+                (1 - u - v) * corner_normals[0]
+                + u * corner_normals[1]
+                + v * corner_normals[2]
+            )
+            normal = smooth_normal if front_face else -smooth_normal
+        else:
+            normal = outward_normal if front_face else -outward_normal
+        return normal, front_face
+
+    def hit_texture_coordinates(self, hit_record: HitRecord) -> np.ndarray | None:
+        if self.texture_coordinates is None:
+            return None
+        u, v = hit_record.u, hit_record.v
+        corner_texture_xy = self.texture_coordinates[self.indices[hit_record.local]]
+        return ((1.0 - u - v) * corner_texture_xy[0]
+                + u * corner_texture_xy[1]
+                + v * corner_texture_xy[2])
 
     def hit(self, ray: Ray, time_min: float, time_max: float):
-        return self.bvh.hit(ray, time_min, time_max)
-    
+        return self.bvh.traverse(ray, time_min, time_max, self._hit_leaf)
+
     def bounding_box(self) -> Axis_Aligned_Bounding_Box:
-        return self.bvh.box
\ No newline at end of file
+        return self.bvh.box
@@ -22,40 +22,57 @@ n_back   = norm(v_back)
 
 mat_red_sphere = Lambertian(np.array([0.8, 0.2, 0.2], dtype=np.float32))
 
-flat_sphere_tris = [
-    Triangle(v_top,    v_right, v_front, mat_red_sphere),
-    Triangle(v_top,    v_front, v_left,  mat_red_sphere),
-    Triangle(v_top,    v_left,  v_back,  mat_red_sphere),
-    Triangle(v_top,    v_back,  v_right, mat_red_sphere),
+#the triangle lists are built on first access instead of at import
+def _flat_sphere_tris() -> list[Triangle]:
+    return [
+        Triangle(v_top,    v_right, v_front, mat_red_sphere),
+        Triangle(v_top,    v_front, v_left,  mat_red_sphere),
+        Triangle(v_top,    v_left,  v_back,  mat_red_sphere),
+        Triangle(v_top,    v_back,  v_right, mat_red_sphere),
 
-    Triangle(v_bottom, v_front, v_right, mat_red_sphere),
-    Triangle(v_bottom, v_left,  v_front, mat_red_sphere),
-    Triangle(v_bottom, v_back,  v_left,  mat_red_sphere),
-    Triangle(v_bottom, v_right, v_back,  mat_red_sphere),
-]
+        Triangle(v_bottom, v_front, v_right, mat_red_sphere),
+        Triangle(v_bottom, v_left,  v_front, mat_red_sphere),
+        Triangle(v_bottom, v_back,  v_left,  mat_red_sphere),
+        Triangle(v_bottom, v_right, v_back,  mat_red_sphere),
+    ]
 
-smooth_sphere_tris = [
-    Triangle(v_top,    v_right, v_front, mat_red_sphere,
-             normal0=n_top, normal1=n_right, normal2=n_front),
+def _smooth_sphere_tris() -> list[Triangle]:
+    return [
+        Triangle(v_top,    v_right, v_front, mat_red_sphere,
+                 normal0=n_top, normal1=n_right, normal2=n_front),
 
-    Triangle(v_top,    v_front, v_left,  mat_red_sphere,
-             normal0=n_top, normal1=n_front, normal2=n_left),
+        Triangle(v_top,    v_front, v_left,  mat_red_sphere,
+                 normal0=n_top, normal1=n_front, normal2=n_left),
 
-    Triangle(v_top,    v_left,  v_back,  mat_red_sphere,
-             normal0=n_top, normal1=n_left, normal2=n_back),
+        Triangle(v_top,    v_left,  v_back,  mat_red_sphere,
+                 normal0=n_top, normal1=n_left, normal2=n_back),
 
-    Triangle(v_top,    v_back,  v_right, mat_red_sphere,
-             normal0=n_top, normal1=n_back, normal2=n_right),
+        Triangle(v_top,    v_back,  v_right, mat_red_sphere,
+                 normal0=n_top, normal1=n_back, normal2=n_right),
 
-    Triangle(v_bottom, v_front, v_right, mat_red_sphere,
-             normal0=n_bottom, normal1=n_front, normal2=n_right),
+        Triangle(v_bottom, v_front, v_right, mat_red_sphere,
+                 normal0=n_bottom, normal1=n_front, normal2=n_right),
 
-    Triangle(v_bottom, v_left,  v_front, mat_red_sphere,
-             normal0=n_bottom, normal1=n_left, normal2=n_front),
+        Triangle(v_bottom, v_left,  v_front, mat_red_sphere,
+                 normal0=n_bottom, normal1=n_left, normal2=n_front),
 
-    Triangle(v_bottom, v_back,  v_left,  mat_red_sphere,
-             normal0=n_bottom, normal1=n_back, normal2=n_left),
+        Triangle(v_bottom, v_back,  v_left,  mat_red_sphere,
+                 normal0=n_bottom, normal1=n_back, normal2=n_left),
 
-    Triangle(v_bottom, v_right, v_back,  mat_red_sphere,
-             normal0=n_bottom, normal1=n_right, normal2=n_back),
-]
+        Triangle(v_bottom, v_right, v_back,  mat_red_sphere,
+                 normal0=n_bottom, normal1=n_right, normal2=n_back),
+    ]
+
+
+_builders = {
+    'flat_sphere_tris': _flat_sphere_tris,
+    'smooth_sphere_tris': _smooth_sphere_tris,
+}
+
+
+def __getattr__(name: str) -> list[Triangle]:
+    if name not in _builders:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    triangles = _builders[name]()
+    globals()[name] = triangles
+    return triangles
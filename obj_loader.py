@@ -0,0 +1,199 @@
+import hashlib
+import os
+import re
+import numpy as np
+
+from flat_bvh import ARRAY_NAMES, FlatBVH
+
+CACHE_VERSION = 1
+CACHE_SUFFIX = '.cache.npz'
+
+
+LINE_PATTERN = re.compile(r'^[ \t]*(v|vt|vn|f)[ \t]+([^\n]*)', re.MULTILINE)
+
+
+def _bodies_by_keyword(text: str) -> dict[str, list[str]]:
+    #everything after the keyword on every line that starts with one, found in a single regex pass
+    bodies = {'v': [], 'vt': [], 'vn': [], 'f': []}
+    for keyword, body in LINE_PATTERN.findall(text):
+        bodies[keyword].append(body)
+    return bodies
+
+
+def _parse_rows(bodies: list[str], width: int, dtype) -> np.ndarray:
+    #the whole block is tokenized by numpy in one call
+    values = np.fromstring(' '.join(bodies), dtype=dtype, sep=' ')
+    if values.size == len(bodies) * width:
+        return values.reshape(-1, width)
+    #rows with extra components such as a w coordinate or vertex colors
+    return np.array([body.split()[:width] for body in bodies], dtype=dtype)
+
+
+def _tokens_per_line(text: str, line_count: int) -> np.ndarray:
+    data = np.frombuffer(text.encode(), dtype=np.uint8)
+    is_newline = data == ord('\n')
+    separator = is_newline | (data == ord(' ')) | (data == ord('\t')) | (data == ord('\r'))
+    token_start = ~separator & np.concatenate(([True], separator[:-1]))
+    return np.bincount(np.cumsum(is_newline)[token_start], minlength=line_count)
+
+
+def _components_per_token(text: str) -> np.ndarray:
+    #numbers in every whitespace separated token, one more than its slashes
+    data = np.frombuffer(text.encode(), dtype=np.uint8)
+    separator = (data == ord('\n')) | (data == ord(' ')) | (data == ord('\t')) | (data == ord('\r'))
+    token_start = ~separator & np.concatenate(([True], separator[:-1]))
+    token = np.cumsum(token_start) - 1
+    return np.bincount(token[data == ord('/')], minlength=int(token_start.sum())) + 1
+
+
+def _resolve_indices(indices: np.ndarray, count: int) -> np.ndarray:
+    #obj indices start at 1 and negative ones count back from the end
+    return np.where(indices < 0, indices + count, indices - 1)
+
+
+def _unique_rows(rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    #packing a row into one integer key sorts far faster than np.unique(axis=0)
+    sizes = rows.max(axis=0) + 1
+    if np.prod(sizes.astype(np.float64)) >= 2.0 ** 62:
+        unique, inverse = np.unique(rows, axis=0, return_inverse=True)
+        return unique, inverse.reshape(-1)
+    keys = np.ravel_multi_index(tuple(rows.T), tuple(sizes))
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    return np.stack(np.unravel_index(unique_keys, tuple(sizes)), axis=1), inverse
+
+
+def parse_obj(file_path: str) -> dict[str, np.ndarray]:
+    with open(file_path, 'r') as file:
+        text = file.read()
+
+    bodies = _bodies_by_keyword(text)
+    vertex_bodies = bodies['v']
+    texture_bodies = bodies['vt']
+    normal_bodies = bodies['vn']
+    face_bodies = bodies['f']
+    if not vertex_bodies or not face_bodies:
+        raise ValueError(f'File {file_path} has error')
+
+    vertices = _parse_rows(vertex_bodies, 3, np.float64)
+    texture_coordinates = _parse_rows(texture_bodies, 2, np.float64) if texture_bodies else None
+    normals = _parse_rows(normal_bodies, 3, np.float64) if normal_bodies else None
+
+    #format for face: f i j k, f i/j i/j i/j, f i//k i//k i//k or f i/j/k i/j/k i/j/k
+    face_text = '\n'.join(face_bodies).replace('//', '/0/')
+    #faces may mix formats, every corner is widened to v/vt/vn with 0 for the fields it leaves out
+    corner_counts = _tokens_per_line(face_text, len(face_bodies))
+    corner_components = _components_per_token(face_text)
+    values = np.fromstring(face_text.replace('/', ' '), dtype=np.int64, sep=' ')
+    if (corner_components.size != corner_counts.sum() or corner_components.max() > 3
+            or values.size != corner_components.sum()):
+        raise ValueError(f'File {file_path} has error')
+    components = int(corner_components.max())
+    corners = np.zeros((corner_components.size, components), dtype=np.int64)
+    value_corner = np.repeat(np.arange(corner_components.size), corner_components)
+    value_component = np.arange(values.size) - np.repeat(np.cumsum(corner_components) - corner_components,
+                                                         corner_components)
+    corners[value_corner, value_component] = values
+
+    #faces with fewer than three corners are skipped
+    polygon = corner_counts >= 3
+    corners = corners[np.repeat(polygon, corner_counts)]
+    corner_counts = corner_counts[polygon]
+    if corner_counts.size == 0:
+        raise ValueError(f'File {file_path} has error')
+
+    #handling quad and higher faces
+    #(v0, v1, v2), (v0, v2, v3), ...
+    triangle_counts = corner_counts - 2
+    triangle_face = np.repeat(np.arange(len(corner_counts)), triangle_counts)
+    triangle_in_face = np.arange(triangle_face.size) - np.repeat(np.cumsum(triangle_counts) - triangle_counts,
+                                                                 triangle_counts)
+    first_corner = (np.cumsum(corner_counts) - corner_counts)[triangle_face]
+    triangle_corners = np.stack((first_corner,
+                                 first_corner + triangle_in_face + 1,
+                                 first_corner + triangle_in_face + 2), axis=1)
+
+    vertex_indices = _resolve_indices(corners[:, 0], len(vertices))
+    texture_indices = None
+    if texture_coordinates is not None and components >= 2 and (corners[:, 1] != 0).all():
+        texture_indices = _resolve_indices(corners[:, 1], len(texture_coordinates))
+    normal_indices = None
+    if normals is not None and components >= 3 and (corners[:, 2] != 0).all():
+        normal_indices = _resolve_indices(corners[:, 2], len(normals))
+
+    if texture_indices is None and normal_indices is None:
+        return {'vertices': vertices, 'indices': vertex_indices[triangle_corners]}
+
+    #positions, uvs and normals have their own indices in obj, give every distinct combination its own vertex
+    attribute_indices = [vertex_indices]
+    if texture_indices is not None:
+        attribute_indices.append(texture_indices)
+    if normal_indices is not None:
+        attribute_indices.append(normal_indices)
+    combinations, corner_vertex = _unique_rows(np.stack(attribute_indices, axis=1))
+
+    geometry = {'vertices': vertices[combinations[:, 0]], 'indices': corner_vertex[triangle_corners]}
+    if texture_indices is not None:
+        geometry['texture_coordinates'] = texture_coordinates[combinations[:, 1]]
+    if normal_indices is not None:
+        geometry['normals'] = normals[combinations[:, -1]]
+    return geometry
+
+
+def file_hash(file_path: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_path(file_path: str) -> str:
+    return file_path + CACHE_SUFFIX
+
+
+def read_mesh_cache(file_path: str) -> tuple[dict[str, np.ndarray], FlatBVH] | None:
+    path = cache_path(file_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        cache = np.load(path)
+    except (OSError, ValueError):
+        return None
+
+    with cache:
+        if int(cache['version']) != CACHE_VERSION:
+            return None
+        source = os.stat(file_path)
+        #a touched file with the same contents is still a hit, only then is the source hashed
+        if (int(cache['source_mtime_ns']) != source.st_mtime_ns or int(cache['source_size']) != source.st_size) \
+                and str(cache['source_hash']) != file_hash(file_path):
+            return None
+
+        geometry = {name: cache[name] for name in ('vertices', 'indices', 'normals', 'texture_coordinates')
+                    if name in cache.files}
+        bvh = FlatBVH.from_arrays({name: cache['bvh_' + name] for name in ARRAY_NAMES}, int(cache['bvh_max_depth']))
+    return geometry, bvh
+
+
+def write_mesh_cache(file_path: str, geometry: dict[str, np.ndarray], bvh: FlatBVH):
+    source = os.stat(file_path)
+    arrays = {
+        'version': np.array(CACHE_VERSION),
+        'source_mtime_ns': np.array(source.st_mtime_ns),
+        'source_size': np.array(source.st_size),
+        'source_hash': np.array(file_hash(file_path)),
+        'bvh_max_depth': np.array(bvh.max_depth),
+    }
+    arrays.update({name: array for name, array in geometry.items() if array is not None})
+    arrays.update({'bvh_' + name: array for name, array in bvh.arrays().items()})
+
+    path = cache_path(file_path)
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(temporary_path, 'wb') as file:
+            np.savez(file, **arrays)
+        os.replace(temporary_path, path)
+    except OSError:
+        #a read only asset directory just means no cache
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
@@ -0,0 +1,110 @@
+import concurrent.futures
+import os
+from multiprocessing import shared_memory
+import numpy as np
+
+from camera import Camera
+from denoise import denoise_render
+from flat_scene import FlatScene
+from instrumentation import Instrumentation, TileProfile
+from render_settings import RenderSettings
+from sampler import resolve_seed, sampler_key
+from tile_scheduler import TileScheduler
+from wavefront import render_tile, tile_costs, tiles
+
+#per process state, set once by the pool initializer so tasks only carry tile bounds
+_worker_camera: Camera | None = None
+_worker_scene: FlatScene | None = None
+_worker_settings: RenderSettings | None = None
+_worker_memory: list[shared_memory.SharedMemory] = []
+_worker_image: np.ndarray | None = None
+_worker_sample_counts: np.ndarray | None = None
+
+
+def framebuffer_shapes(settings: RenderSettings) -> list[tuple[tuple[int, ...], type]]:
+    #color image then per pixel sample counts
+    return [((settings.height, settings.width, 3), np.float32),
+            ((settings.height, settings.width), np.int32)]
+
+
+def attach_framebuffer(names: list[str], settings: RenderSettings) -> tuple[list[shared_memory.SharedMemory], list[np.ndarray]]:
+    memories = [shared_memory.SharedMemory(name=name) for name in names]
+    arrays = [np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+              for memory, (shape, dtype) in zip(memories, framebuffer_shapes(settings))]
+    return memories, arrays
+
+
+def _initialize_worker(camera: Camera, scene: FlatScene, settings: RenderSettings, framebuffer_names: list[str]):
+    global _worker_camera, _worker_scene, _worker_settings, _worker_memory, _worker_image, _worker_sample_counts
+    _worker_camera = camera
+    _worker_scene = scene
+    _worker_settings = settings
+    _worker_memory, (_worker_image, _worker_sample_counts) = attach_framebuffer(framebuffer_names, settings)
+
+
+def _render_tile_into_framebuffer(tile: tuple[int, int, int, int],
+                                  key: np.ndarray,
+                                  profile: TileProfile | None = None) -> TileProfile | None:
+    row_start, row_end, column_start, column_end = tile
+    tile_color, tile_sample_counts = render_tile(*tile, _worker_camera, _worker_scene, _worker_settings, key, profile)
+    _worker_image[row_start:row_end, column_start:column_end, :] = tile_color
+    _worker_sample_counts[row_start:row_end, column_start:column_end] = tile_sample_counts
+    #the filled in profile travels back to the parent, the one sent along was a copy
+    return profile
+
+
+def render_image_in_processes(camera: Camera,
+                              scene: FlatScene,
+                              settings: RenderSettings,
+                              seed: int | None = None,
+                              max_workers: int | None = None,
+                              instrumentation: Instrumentation | None = None) -> tuple[np.ndarray, np.ndarray]:
+    #resolved once, the denoiser keys its guide pass with it too
+    seed = resolve_seed(seed)
+    key = sampler_key(seed)
+    max_workers = max_workers or os.cpu_count() or 4
+    tile_list = tiles(settings)
+    costs = tile_costs(camera, scene, settings, tile_list, max_workers)
+    scheduler = TileScheduler(tile_list, settings.tile_size, costs, max_workers, settings.min_tile_size)
+
+    framebuffer = [shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * np.dtype(dtype).itemsize)
+                   for shape, dtype in framebuffer_shapes(settings)]
+    try:
+        arrays = [np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+                  for memory, (shape, dtype) in zip(framebuffer, framebuffer_shapes(settings))]
+        for array in arrays:
+            array[:] = 0
+        framebuffer_names = [memory.name for memory in framebuffer]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers,
+                                                    initializer=_initialize_worker,
+                                                    initargs=(camera, scene, settings, framebuffer_names)) as executor:
+            #one tile per worker at a time, so the scheduler sees idle workers and can split the last tiles for them
+            futures = set()
+
+            def submit_next_tile():
+                tile = scheduler.next_tile()
+                if tile is not None:
+                    profile = None if instrumentation is None else instrumentation.tile_profile(tile)
+                    futures.add(executor.submit(_render_tile_into_framebuffer, tile, key, profile))
+
+            for _ in range(max_workers):
+                submit_next_tile()
+            while futures:
+                done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    futures.remove(future)
+                    profile = future.result()
+                    if instrumentation is not None:
+                        instrumentation.add_tile(profile)
+                    submit_next_tile()
+
+        image, sample_counts = (array.copy() for array in arrays)
+        del arrays
+    finally:
+        for memory in framebuffer:
+            memory.close()
+            memory.unlink()
+
+    if settings.denoise:
+        image = denoise_render(image, camera, scene, settings, seed)
+    return image, sample_counts
@@ -1,5 +1,8 @@
 import numpy as np
 import math
+from typing import Self
+
+from sampler import PathSampler
 
 def normalize(vector: np.ndarray) -> np.ndarray:
     norm = np.linalg.norm(vector)
@@ -20,14 +23,43 @@ def schlick(cosine: float, refraction_index: float) -> float:
     r0 = (1.0 - refraction_index) / (1.0 + refraction_index) ** 2
     return r0 + (1.0 - r0) * ((1.0 - cosine) ** 5)
 
-def random_point_in_unit_sphere() -> np.ndarray:
-    while True:
-        point = np.random.uniform(-1.0, 1.0, size=3).astype(np.float32)
-        if np.dot(point, point) < 1.0:
-            return point
+def random_point_in_unit_sphere(rng: np.random.Generator | None = None) -> np.ndarray:
+    return random_points_in_unit_sphere(1, np.random if rng is None else rng)[0].astype(np.float32)
+
+def random_unit_vector(rng: np.random.Generator | None = None) -> np.ndarray:
+    return random_unit_vectors(1, np.random if rng is None else rng)[0].astype(np.float32)
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, norms, out=vectors.copy(), where=norms != 0)
+
+def reflect_rows(unit_vectors: np.ndarray, normals: np.ndarray) -> np.ndarray:
+    dots = np.sum(unit_vectors * normals, axis=-1, keepdims=True)
+    return unit_vectors - 2.0 * dots * normals
+
+def refract_rows(unit_vectors: np.ndarray, normals: np.ndarray, refraction_index_ratios: np.ndarray) -> np.ndarray:
+    #same formula as refract, one row per ray
+    cos_theta = np.minimum(np.sum(-unit_vectors * normals, axis=-1, keepdims=True), 1.0)
+    res_vector_perpendicular = (unit_vectors + cos_theta * normals) + refraction_index_ratios[:, None]
+    perpendicular_squared = np.sum(res_vector_perpendicular * res_vector_perpendicular, axis=-1, keepdims=True)
+    res_vector_parallel = normals * -np.sqrt(np.maximum(0.0, 1.0 - perpendicular_squared))
+    return res_vector_parallel + res_vector_perpendicular
+
+def unit_vectors_from_samples(samples: np.ndarray) -> np.ndarray:
+    #two uniform numbers per row to a direction uniform over the sphere, z uniform in [-1, 1] and an angle around it
+    z = 1.0 - 2.0 * samples[:, 0]
+    radius = np.sqrt(np.maximum(1.0 - z * z, 0.0))
+    phi = 2.0 * math.pi * samples[:, 1]
+    return np.stack((radius * np.cos(phi), radius * np.sin(phi), z), axis=1)
 
-def random_unit_vector() -> np.ndarray:
-    return normalize(random_point_in_unit_sphere())
+def random_points_in_unit_sphere(count: int, rng: np.random.Generator | PathSampler) -> np.ndarray:
+    #sampled directly instead of by rejection so every point costs exactly three numbers,
+    #the cube root spreads points evenly over the volume
+    samples = rng.random((count, 3))
+    return unit_vectors_from_samples(samples) * np.cbrt(samples[:, 2:3])
+
+def random_unit_vectors(count: int, rng: np.random.Generator | PathSampler) -> np.ndarray:
+    return unit_vectors_from_samples(rng.random((count, 2)))
     
 class Ray:
     def __init__(self, origin: np.ndarray, direction: np.ndarray, time: float = 0.0):
@@ -38,3 +70,19 @@ class Ray:
     def position(self, time: float) -> np.ndarray:
         return self.origin + self.direction * time
 
+
+
+class RayBatch:
+    def __init__(self, origins: np.ndarray, directions: np.ndarray, times: np.ndarray):
+        self.origins = origins
+        self.directions = directions
+        self.times = times
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def position(self, times: np.ndarray) -> np.ndarray:
+        return self.origins + self.directions * times[:, None]
+
+    def subset(self, selection: np.ndarray) -> Self:
+        return RayBatch(self.origins[selection], self.directions[selection], self.times[selection])
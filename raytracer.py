@@ -1,60 +1,74 @@
-import math
 import numpy as np
-from PIL import Image
-import concurrent.futures
-import os
 
-from bvh_node import BVHNode
 from camera import Camera
-from materials import Dielectric, Emissive, Lambertian, Metal
-from mesh import Mesh
-from moving_sphere import MovingSphere
-from quad import Quad
-from ray import Ray, normalize, reflect, refract, schlick
-from sphere import Sphere
-from texture import ImageTexture, PerlinNoiseTexture
-from triangle import Triangle
-from normal_interpolation_objects import smooth_sphere_tris, flat_sphere_tris
-
-MAX_DEPTH = 10
-
-def ray_color(ray: Ray, world: BVHNode, depth: int) -> np.ndarray:
-
-    hit_record = world.hit(ray, time_min=1e-3, time_max=float('inf'))
-    
-    if hit_record:
-
-        emitted = hit_record.material.emitted()
-        if depth >= MAX_DEPTH:
-            return emitted
-        
-        attenuation, scatter_ray = hit_record.material.scatter(ray, hit_record)
+from flat_bvh import FlatBVH
+from ray import Ray, normalize
+from accumulation import render_resumable
+from image_io import save_image
+from render_settings import MAX_DEPTH, RUSSIAN_ROULETTE_DEPTH
+from sampler import path_generator, sampler_key
+from scene_file import load_scene
+
+def ray_color(ray: Ray,
+              world: FlatBVH,
+              max_depth: int = MAX_DEPTH,
+              russian_roulette_depth: int = RUSSIAN_ROULETTE_DEPTH,
+              rng: np.random.Generator | None = None) -> np.ndarray:
+    rng = np.random if rng is None else rng
+    color = np.zeros(3, dtype=np.float32)
+    throughput = np.ones(3, dtype=np.float32)
+
+    for depth in range(max_depth + 1):
+        hit_record = world.hit(ray, time_min=1e-3, time_max=float('inf'))
+
+        if not hit_record:
+            unit_direction = normalize(ray.direction)
+            blueness = .5 * (unit_direction[1] + 1.0)
+            white = np.array([1.0, 1.0, 1.0], dtype=np.float32)
+            blue  = np.array([0.5, 0.7, 1.0], dtype=np.float32)
+            color += throughput * (blueness * blue + (1 - blueness) * white)
+            break
+
+        color += throughput * hit_record.material.emitted()
+        if depth >= max_depth:
+            break
+
+        attenuation, scatter_ray = hit_record.material.scatter(ray, hit_record, rng)
         if attenuation is None or scatter_ray is None:
-            return emitted
-        return emitted + attenuation * ray_color(scatter_ray, world, depth + 1)
+            break
+        throughput = throughput * attenuation
 
-    unit_direction = normalize(ray.direction)
-    blueness = .5 * (unit_direction[1] + 1.0)
-    white = np.array([1.0, 1.0, 1.0], dtype=np.float32)
-    blue  = np.array([0.5, 0.7, 1.0], dtype=np.float32)
-    return blueness * blue + (1 - blueness) * white
+        #russian roulette, survivors are scaled up so the estimate stays unbiased
+        if depth + 1 >= russian_roulette_depth:
+            survival_probability = min(float(np.max(throughput)), 0.95)
+            if rng.random() >= survival_probability:
+                break
+            throughput = throughput / survival_probability
+        ray = scatter_ray
+
+    return color
 
 def render_scanline(y: int,
                     width: int,
                     height: int,
                     samples_per_pixel: int,
                     camera: Camera,
-                    world: BVHNode) -> tuple[int, np.ndarray]:
-    
+                    world: FlatBVH,
+                    max_depth: int = MAX_DEPTH,
+                    russian_roulette_depth: int = RUSSIAN_ROULETTE_DEPTH,
+                    key: np.ndarray | None = None) -> tuple[int, np.ndarray]:
+    #every sample draws from its own pixel and sample keyed stream, so a scanline renders the same on any worker
+    key = sampler_key(None) if key is None else key
     row = np.zeros((width, 3), dtype=np.float32)
     for col in range(width):
         pixel_color = np.array([0, 0, 0], dtype=np.float32)
-        for _ in range(samples_per_pixel):
-            horizontal_percentage = (col + np.random.rand()) / (width - 1)
-            vertical_percentage = (y + np.random.rand()) / (height - 1)
+        for sample in range(samples_per_pixel):
+            rng = path_generator(key, y * width + col, sample)
+            horizontal_percentage = (col + rng.random()) / (width - 1)
+            vertical_percentage = (y + rng.random()) / (height - 1)
 
-            ray = camera.get_ray(horizontal_percentage, vertical_percentage)
-            pixel_color += ray_color(ray, world, 0)
+            ray = camera.get_ray(horizontal_percentage, vertical_percentage, rng)
+            pixel_color += ray_color(ray, world, max_depth, russian_roulette_depth, rng=rng)
 
         pixel_color /= samples_per_pixel    
         row[col, :] = pixel_color
@@ -63,140 +77,20 @@ def render_scanline(y: int,
 
 
 def main():
-
-    width = 400
-    height = 225
-    samples_per_pixel = 20
-
-    aspect_ratio = width / height
-    camera_position = np.array([0.0, 0.0, 0.0], dtype=np.float32)
-    camera_look_at_point = np.array([0.0, 0.0, -1.0], dtype=np.float32)
-    up_direction = np.array([0.0, 1.0, 0.0], dtype=np.float32)
-    vertical_fov_degrees = 90.0
-    aperture = 0.01
-    focus_distance = float(np.linalg.norm(camera_position - camera_look_at_point))
-
-    camera = Camera(camera_position,
-                    camera_look_at_point,
-                    up_direction,
-                    vertical_fov_degrees,
-                    aspect_ratio,
-                    aperture=aperture,
-                    focus_distance=focus_distance,
-                    shutter_open_time=0.0,
-                    shutter_close_time=1.0)
-
-    material_ground = Lambertian(np.array([0.8, 0.8, 0.0], dtype=np.float32))
-    material_center = Dielectric(1.5)  # glass center
-    material_left   = Lambertian(np.array([0.8, 0.3, 0.3], dtype=np.float32))
-    material_right  = Metal(np.array([0.9, 0.9, 0.9], dtype=np.float32), fuzz=0.0)
-    material_light = Emissive(np.array([4.0, 4.0, 4.0], dtype=np.float32))
-
-    dry_riverbed_texture = ImageTexture('textures/dry_riverbed_rock.jpg')
-    material_triangle = Lambertian(texture=dry_riverbed_texture)
-
-    rocky_terrain_texture = ImageTexture('textures/rocky_terrain.jpg')
-    material_rocky_terrain = Lambertian(texture=rocky_terrain_texture)
-
-    material_mesh = Lambertian(np.array([0.1, 0.6, 0.9], dtype=np.float32))
-    vertices = np.array([
-        [-1.0, 0.0, -3.0],
-        [ 1.0, 0.0, -3.0],
-        [ 1.0, 2.0, -3.0],
-        [-1.0, 2.0, -3.0],
-    ], dtype=np.float32)
-    indices = [
-        (0, 1, 2),
-        (0, 2, 3),
-    ]
-    mesh_instance = Mesh.from_vertices_indices(vertices, indices, material_mesh)
-
-    quad = Quad(
-        v0=np.array([-1.0, 0.0, -1.0], dtype=np.float32),
-        v1=np.array([1.0, 0.0, -1.0], dtype=np.float32),
-        v2=np.array([1.0, 2.0, -1.0], dtype=np.float32),
-        v3=np.array([-1.0, 2.0, -1.0], dtype=np.float32),
-        material=Lambertian(np.array([0.8, 0.8, 0.8], dtype=np.float32)),
-    )
-
-    perlin_tex = PerlinNoiseTexture(scale=4.0, base_color=np.array([0.2, 0.6, 0.9], dtype=np.float32))
-    mat_perlin = Lambertian(texture=perlin_tex)
-
-    
-    world = BVHNode([
-        Sphere(
-            center=np.array([0.0, 0.0, -0.5], dtype=np.float32),
-            radius=0.2,
-            material=material_center
-        ),
-        Sphere(
-            center=np.array([-1.0, 0.0, -1.5], dtype=np.float32),
-            radius=0.4,
-            material=material_left
-        ),
-        Sphere(
-            center=np.array([1.0, 0.0, -2.0], dtype=np.float32),
-            radius=0.5,
-            material=material_right
-        ),
-        Sphere(
-            center=np.array([0.0, -100.5, -1.2], dtype=np.float32),
-            radius=100.0,
-            material=material_rocky_terrain
-        ),
-        Sphere(
-            center=np.array([0.0, 3.0, -0.9], dtype=np.float32),
-            radius=0.5,
-            material=material_light,
-        ),
-        Triangle(
-            v0=np.array([-5.0, -1.0, -3.0], dtype=np.float32),
-            v1=np.array([ -1.0, -1.0, -3.0], dtype=np.float32),
-            v2=np.array([ 0.0,  1.0, -3.0], dtype=np.float32),
-            material=material_triangle,
-            texture_xy0=np.array([0.0, 0.0], dtype=np.float32),
-            texture_xy1=np.array([0.0, 0.8], dtype=np.float32),
-            texture_xy2=np.array([0.4, 1.0], dtype=np.float32)
-        ),
-        mesh_instance,
-        Mesh.load_from_file('stuff_to_load/star.mesh', material_mesh),
-        MovingSphere(
-            center0=np.array([-1.5, 0.4, -0.9], dtype=np.float32),
-            center1=np.array([-1.5, 0.8, -0.9], dtype=np.float32),
-            time0=0.0,
-            time1=1.0,
-            radius=0.3,
-            material=material_ground
-        ),
-        Sphere(
-            center=np.array([-0.8, .7, -1.5], dtype=np.float32),
-            radius=0.4,
-            material=mat_perlin,
-        )
-    ])
-
-    normal_interpolation_example = BVHNode(smooth_sphere_tris)
-
-    image = np.zeros(shape=(height, width, 3), dtype=np.float32)
-    max_workers = os.cpu_count() or 4
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [
-            executor.submit(
-                render_scanline, y, width, height, samples_per_pixel, camera, world
-            )
-            for y in range(height)
-        ]
-
-        for future in concurrent.futures.as_completed(futures):
-            y, row = future.result()
-
-            image[height - 1 - y, :, :] = row
-
-    image_uint8 = (np.clip(image, 0.0, 1.0) * 255).astype(np.uint8)
-
-    rendered_image = Image.fromarray(image_uint8, mode='RGB')
-    rendered_image.save('output.png')
+    #the scene itself lives in scenes/default.json and is compiled into scenes/.scene_cache on first use
+    camera, scene, settings = load_scene('scenes/default.json')
+
+    #samples land in output.checkpoint as they finish, rerunning resumes where a killed render stopped.
+    #output.png is rewritten every few seconds so the render can be watched as it converges
+    accumulation = render_resumable(camera, scene, settings, 'output.checkpoint',
+                                    on_preview=lambda buffer: save_image(buffer.image(), 'output.png'),
+                                    preview_interval=5.0)
+    image = accumulation.denoised_image(camera, scene, settings) if settings.denoise else accumulation.image()
+
+    #output.pfm keeps the linear radiance, python image_io.py output.pfm tonemaps it again without rendering
+    save_image(image, 'output.pfm')
+    save_image(image, 'output.png')
     print('yayy')
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
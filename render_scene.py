@@ -0,0 +1,150 @@
+import argparse
+import functools
+import os
+from contextlib import nullcontext
+
+
+def parse_arguments(arguments: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Render a json scene file to a png')
+    parser.add_argument('scene', help='scene description, see scenes/default.json')
+    parser.add_argument('-o', '--output', default='output.png',
+                        help='with --animation a {frame} field is filled in, otherwise the frame number is appended')
+    parser.add_argument('--width', type=int)
+    parser.add_argument('--height', type=int)
+    parser.add_argument('--samples', type=int, help='samples per pixel')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--threads', action='store_true', help='render with threads instead of processes')
+    parser.add_argument('--tile-size', type=int)
+    parser.add_argument('--backend', choices=('auto', 'numpy', 'numba'),
+                        help='intersect with numpy or with kernels compiled by numba, auto picks numba when installed')
+    parser.add_argument('--tile-timings', metavar='PATH',
+                        help='write the seconds every tile took to a json file, to tune --tile-size with')
+    parser.add_argument('--listen', metavar='HOST:PORT',
+                        help='deal tiles to workers started with distributed.py HOST:PORT, '
+                             'plus --workers local ones')
+    parser.add_argument('--denoise', action='store_true', help='filter the image with the albedo, normal and depth buffers')
+    parser.add_argument('--animation', action='store_true', help="render every frame of the scene's animation")
+    parser.add_argument('--checkpoint', help='directory to accumulate into, a rerun resumes from it')
+    parser.add_argument('--progressive', action='store_true',
+                        help='render in passes and rewrite the output as samples accumulate')
+    parser.add_argument('--samples-per-pass', type=int, default=4)
+    parser.add_argument('--preview-interval', type=float, default=0.0,
+                        help='seconds between progressive outputs, 0 writes one after every pass')
+    parser.add_argument('--hdr', metavar='PATH',
+                        help='also save the linear radiance as a .pfm, image_io.py tonemaps it again later. '
+                             'an output ending in .pfm is saved linear as well')
+    parser.add_argument('--exposure', type=float, default=0.0, help='in stops')
+    parser.add_argument('--tonemap', choices=('clamp', 'reinhard', 'aces'), default='clamp')
+    parser.add_argument('--gamma', type=float, default=1.0)
+    parser.add_argument('--no-cache', action='store_true', help='rebuild the scene instead of loading it compiled')
+    parser.add_argument('--compile-only', action='store_true', help='only build and cache the compiled scene')
+    return parser.parse_args(arguments)
+
+
+def main(arguments: list[str] | None = None):
+    arguments = parse_arguments(arguments)
+    #the renderer is imported after argument parsing so --help and bad arguments return immediately
+    from scene_file import load_scene
+
+    overrides = {'width': arguments.width, 'height': arguments.height, 'samples_per_pixel': arguments.samples,
+                 'tile_size': arguments.tile_size, 'denoise': arguments.denoise or None, 'backend': arguments.backend}
+    camera, scene, settings = load_scene(arguments.scene,
+                                         use_cache=not arguments.no_cache,
+                                         settings_overrides={name: value for name, value in overrides.items()
+                                                             if value is not None})
+    if arguments.compile_only:
+        return
+
+    coordinator = None
+    if arguments.listen:
+        from distributed import TileCoordinator, parse_address
+        #one coordinator for every pass and frame so remote workers keep their scene and connection
+        coordinator = TileCoordinator(parse_address(arguments.listen))
+        coordinator.start_local_workers(arguments.workers or 0)
+        print(f'waiting for workers on {coordinator.address[0]}:{coordinator.address[1]}')
+        render_pass = coordinator.render
+    elif arguments.threads:
+        from wavefront import render_image
+        render_pass = functools.partial(render_image, max_workers=arguments.workers)
+    else:
+        from process_renderer import render_image_in_processes
+        render_pass = functools.partial(render_image_in_processes, max_workers=arguments.workers)
+
+    instrumentation = None
+    if arguments.tile_timings:
+        from instrumentation import Instrumentation
+        instrumentation = Instrumentation(settings)
+        render_pass = functools.partial(render_pass, instrumentation=instrumentation)
+
+    try:
+        render(arguments, camera, scene, settings, render_pass)
+    finally:
+        if coordinator is not None:
+            coordinator.close()
+    if instrumentation is not None:
+        write_tile_timings(instrumentation, arguments.tile_timings)
+
+
+def render(arguments: argparse.Namespace, camera, scene, settings, render_pass):
+    if arguments.animation:
+        from animation import render_animation
+        from scene_file import load_animation
+        animation = load_animation(arguments.scene, settings)
+        if animation is None:
+            raise SystemExit(f'{arguments.scene} has no animation section')
+        output, hdr = frame_path(arguments.output), arguments.hdr and frame_path(arguments.hdr)
+        for image, statistics in render_animation(animation, scene, settings, seed=arguments.seed,
+                                                  render_frame=render_pass):
+            save_outputs(arguments, image, output.format(frame=statistics.frame),
+                         hdr and hdr.format(frame=statistics.frame))
+            print(f'frame {statistics.frame}: update {statistics.update_seconds:.3f}s'
+                  f'{" (bvh rebuilt)" if statistics.bvh_rebuilt else ""}, render {statistics.render_seconds:.1f}s')
+        return
+
+    if arguments.checkpoint or arguments.progressive:
+        import tempfile
+        from accumulation import render_resumable
+
+        def preview(buffer):
+            save_outputs(arguments, buffer.image(), arguments.output, arguments.hdr)
+            print(f'pass {buffer.passes}: {int(buffer.sample_counts.min())}/{settings.samples_per_pixel} samples')
+
+        #a progressive render without a checkpoint accumulates in a directory that goes away afterwards
+        with tempfile.TemporaryDirectory() if arguments.checkpoint is None else nullcontext() as temporary:
+            accumulation = render_resumable(camera, scene, settings, arguments.checkpoint or temporary,
+                                            samples_per_pass=arguments.samples_per_pass, seed=arguments.seed,
+                                            render_pass=render_pass,
+                                            on_preview=preview if arguments.progressive else None,
+                                            preview_interval=arguments.preview_interval)
+            image = accumulation.denoised_image(camera, scene, settings) if settings.denoise else accumulation.image()
+    else:
+        image, _ = render_pass(camera, scene, settings, seed=arguments.seed)
+
+    save_outputs(arguments, image, arguments.output, arguments.hdr)
+
+
+def frame_path(path: str) -> str:
+    if '{frame' in path:
+        return path
+    root, extension = os.path.splitext(path)
+    return root + '_{frame:04d}' + extension
+
+
+def write_tile_timings(instrumentation, path: str):
+    import json
+    timings = {'summary': instrumentation.summary()['tiles'],
+               'tiles': [{'tile': list(tile), 'seconds': seconds}
+                         for tile, seconds in sorted(instrumentation.tile_seconds().items())]}
+    with open(path, 'w') as file:
+        json.dump(timings, file)
+
+
+def save_outputs(arguments: argparse.Namespace, image, output: str, hdr: str | None):
+    from image_io import save_image
+    save_image(image, output, arguments.exposure, arguments.tonemap, arguments.gamma)
+    if hdr:
+        save_image(image, hdr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+from dataclasses import dataclass
+
+MAX_DEPTH = 10
+#bounces before russian roulette may end a path
+RUSSIAN_ROULETTE_DEPTH = 3
+
+
+@dataclass
+class RenderSettings:
+    width: int
+    height: int
+    samples_per_pixel: int
+    max_depth: int = MAX_DEPTH
+    russian_roulette_depth: int = RUSSIAN_ROULETTE_DEPTH
+    tile_size: int = 32
+    #tiles are dealt hardest first by the cost of a sparse one sample pre-pass, and split down to min_tile_size
+    #once fewer are left than there are workers
+    tile_cost_prepass: bool = True
+    min_tile_size: int = 8
+    #rays traced together per wavefront, bounds the size of the (N, 3) path arrays
+    max_rays_per_batch: int = 1 << 16
+    #adaptive sampling stops a pixel between min_samples_per_pixel and samples_per_pixel once the
+    #95% confidence interval of its mean is narrower than adaptive_tolerance on every channel
+    adaptive_sampling: bool = False
+    min_samples_per_pixel: int = 8
+    adaptive_tolerance: float = 0.02
+    #sample a light at every diffuse hit and combine it with the bounce through multiple importance sampling
+    next_event_estimation: bool = True
+    #walk camera rays through the bvh in packets of neighbouring directions instead of one ray at a time
+    packet_traversal: bool = True
+    #closest hits through kernels compiled with numba, auto uses them when numba is installed, see jit_kernels.py
+    backend: str = 'auto'
+    #filter the finished image with an edge avoiding wavelet guided by albedo, normal and depth buffers
+    denoise: bool = False
@@ -0,0 +1,124 @@
+from typing import Self
+import numpy as np
+
+from jit_kernels import compile_kernel, numba
+
+#philox 4x32-10 from salmon et al., "parallel random numbers: as easy as 1, 2, 3"
+PHILOX_MULTIPLIERS = (np.uint64(0xD2511F53), np.uint64(0xCD9E8D57))
+PHILOX_KEY_INCREMENTS = (np.uint64(0x9E3779B9), np.uint64(0xBB67AE85))
+PHILOX_ROUNDS = 10
+WORD_MASK = np.uint64(0xFFFFFFFF)
+#each bounce draws its numbers for different uses from separate streams, so adding a number to one use never shifts
+#the numbers of another
+STREAM_CAMERA, STREAM_SCATTER, STREAM_LIGHT, STREAM_ROULETTE = range(4)
+STREAMS_PER_BOUNCE = 4
+
+
+def sampler_key(seed: int | None) -> np.ndarray:
+    #two 32 bit key words, like np.random.default_rng a seed of None draws fresh entropy
+    return np.random.SeedSequence(seed).generate_state(2, np.uint32)
+
+
+def resolve_seed(seed: int | None) -> int:
+    #a seed of None drawn once, so every pass of one render that keys streams from it sees the same entropy
+    return np.random.SeedSequence(seed).entropy
+
+
+@compile_kernel
+def _philox_blocks(counters, first_key, second_key, bits):
+    #philox below one block at a time, rows of counters to rows of bits
+    for block in range(len(counters)):
+        word0, word1, word2, word3 = counters[block, 0], counters[block, 1], counters[block, 2], counters[block, 3]
+        round_first_key, round_second_key = first_key, second_key
+        for _ in range(PHILOX_ROUNDS):
+            first_product = PHILOX_MULTIPLIERS[0] * word0
+            second_product = PHILOX_MULTIPLIERS[1] * word2
+            word0, word1, word2, word3 = ((second_product >> np.uint64(32)) ^ word1 ^ round_first_key,
+                                          second_product & WORD_MASK,
+                                          (first_product >> np.uint64(32)) ^ word3 ^ round_second_key,
+                                          first_product & WORD_MASK)
+            round_first_key = (round_first_key + PHILOX_KEY_INCREMENTS[0]) & WORD_MASK
+            round_second_key = (round_second_key + PHILOX_KEY_INCREMENTS[1]) & WORD_MASK
+        bits[block, 0], bits[block, 1], bits[block, 2], bits[block, 3] = word0, word1, word2, word3
+
+
+def philox(counter: tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray], key: np.ndarray) -> np.ndarray:
+    #four 32 bit counter words, broadcast against each other, to four random 32 bit words each.
+    #products of two 32 bit words fit in uint64, so one multiply gives both halves
+    first_key, second_key = np.uint64(key[0]), np.uint64(key[1])
+    if numba is not None:
+        #the same integer arithmetic compiled, so the bits are the same with or without numba
+        shape = np.broadcast_shapes(*(np.shape(word) for word in counter))
+        counters = np.empty(shape + (4,), dtype=np.uint64)
+        for index, word in enumerate(counter):
+            counters[..., index] = word
+        bits = np.empty(counters.shape, dtype=np.uint32)
+        _philox_blocks(counters.reshape(-1, 4), first_key, second_key, bits.reshape(-1, 4))
+        return bits
+    words = [np.asarray(word, dtype=np.uint64) for word in np.broadcast_arrays(*counter)]
+    for _ in range(PHILOX_ROUNDS):
+        first_product = PHILOX_MULTIPLIERS[0] * words[0]
+        second_product = PHILOX_MULTIPLIERS[1] * words[2]
+        words = [(second_product >> np.uint64(32)) ^ words[1] ^ first_key,
+                 second_product & WORD_MASK,
+                 (first_product >> np.uint64(32)) ^ words[3] ^ second_key,
+                 first_product & WORD_MASK]
+        first_key = (first_key + PHILOX_KEY_INCREMENTS[0]) & WORD_MASK
+        second_key = (second_key + PHILOX_KEY_INCREMENTS[1]) & WORD_MASK
+    return np.stack(words, axis=-1).astype(np.uint32)
+
+
+def path_generator(key: np.ndarray, pixel_index: int, sample_index: int, stream: int = 0) -> np.random.Generator:
+    #the same keying for code that draws one number at a time, numpy's own philox walks the stream
+    return np.random.Generator(np.random.Philox(counter=[0, pixel_index, sample_index, stream],
+                                                key=[int(key[0]), int(key[1])]))
+
+
+class PathSampler:
+    #random numbers for a batch of paths. every path draws from its own philox stream, keyed by the render's seed and
+    #counted by pixel, sample, bounce and use, so a path gets the same numbers whichever tile, batch, thread or machine
+    #traces it. a call hands out the next dimensions of every path's stream at once, four per philox block.
+    #random and uniform take the same arguments as np.random.Generator's, the first axis is always the paths
+    def __init__(self,
+                 key: np.ndarray,
+                 pixel_indices: np.ndarray,
+                 sample_indices: np.ndarray,
+                 stream_index: int = 0,
+                 dimension: int = 0):
+        self.key = key
+        self.pixel_indices = np.asarray(pixel_indices, dtype=np.uint64)
+        self.sample_indices = np.asarray(sample_indices, dtype=np.uint64)
+        self.stream_index = stream_index
+        self.dimension = dimension
+
+    def __len__(self) -> int:
+        return len(self.pixel_indices)
+
+    def subset(self, selection: np.ndarray) -> Self:
+        #the selected paths carry on from the same dimension
+        return PathSampler(self.key, self.pixel_indices[selection], self.sample_indices[selection],
+                           self.stream_index, self.dimension)
+
+    def stream(self, bounce: int, use: int) -> Self:
+        return PathSampler(self.key, self.pixel_indices, self.sample_indices, bounce * STREAMS_PER_BOUNCE + use)
+
+    def random(self, size: int | tuple[int, ...] | None = None) -> np.ndarray:
+        shape = (len(self),) if size is None else (size,) if isinstance(size, int) else tuple(size)
+        if shape[0] != len(self):
+            raise ValueError(f'{len(self)} paths cannot draw {shape[0]} rows of random numbers')
+        per_path = int(np.prod(shape[1:], dtype=np.int64))
+        first_block = self.dimension // 4
+        blocks = np.arange(first_block, (self.dimension + per_path + 3) // 4, dtype=np.uint64)
+        bits = philox((blocks, self.pixel_indices[:, None], self.sample_indices[:, None], self.stream_index), self.key)
+        offset = self.dimension - 4 * first_block
+        self.dimension += per_path
+        bits = bits.reshape(len(self), 4 * len(blocks))[:, offset:offset + per_path]
+        return (bits * 2.0 ** -32).reshape(shape)
+
+    def uniform(self, low: float = 0.0, high: float = 1.0, size: int | tuple[int, ...] | None = None) -> np.ndarray:
+        return low + (high - low) * self.random(size)
+
+    def generator(self, index: int) -> np.random.Generator:
+        #a scalar stream for path index, for code that draws its numbers one at a time
+        return path_generator(self.key, int(self.pixel_indices[index]), int(self.sample_indices[index]),
+                              self.stream_index)
@@ -0,0 +1,250 @@
+import functools
+import glob
+import hashlib
+import json
+import os
+import pickle
+import numpy as np
+
+import normal_interpolation_objects
+from animation import Animation, interpolate_keyframes, keyframe_transform
+from camera import Camera
+from flat_bvh import FlatBVH
+from flat_scene import FlatScene
+from instance import Instance
+from materials import Dielectric, Emissive, Lambertian, Material, Metal
+from mesh import Mesh
+from moving_sphere import MovingSphere
+from obj_loader import file_hash
+from quad import Quad
+from render_settings import RenderSettings
+from sphere import Sphere
+from texture import ImageTexture, PerlinNoiseTexture, Texture
+from triangle import Triangle
+
+#compiled scenes are also keyed by the renderer's source files, so the version only needs a bump for changes
+#that do not show in them
+SCENE_CACHE_VERSION = 5
+SCENE_CACHE_DIRECTORY = '.scene_cache'
+RENDERER_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def read_scene_description(scene_path: str) -> dict:
+    with open(scene_path) as file:
+        return json.load(file)
+
+
+def _vector(values) -> np.ndarray:
+    return np.array(values, dtype=np.float32)
+
+
+def _optional_vectors(values, count: int) -> list[np.ndarray | None]:
+    return [None] * count if values is None else [_vector(value) for value in values]
+
+
+def build_camera(description: dict, aspect_ratio: float) -> Camera:
+    return Camera(_vector(description['position']),
+                  _vector(description['look_at']),
+                  _vector(description.get('up', [0.0, 1.0, 0.0])),
+                  description.get('vertical_fov_degrees', 90.0),
+                  description.get('aspect_ratio', aspect_ratio),
+                  aperture=description.get('aperture', 0.0),
+                  focus_distance=description.get('focus_distance'),
+                  shutter_open_time=description.get('shutter_open_time', 0.0),
+                  shutter_close_time=description.get('shutter_close_time', 0.0))
+
+
+def build_settings(description: dict) -> RenderSettings:
+    return RenderSettings(**description)
+
+
+def _resolve(path: str, base_directory: str) -> str:
+    return os.path.normpath(os.path.join(base_directory, path))
+
+
+def build_texture(description: dict, base_directory: str) -> Texture:
+    texture_type = description['type']
+    if texture_type == 'image':
+        return ImageTexture(_resolve(description['path'], base_directory),
+                            memory_map=description.get('memory_map', False))
+    if texture_type == 'perlin':
+        return PerlinNoiseTexture(scale=description.get('scale', 1.0),
+                                  base_color=_vector(description.get('base_color', [1.0, 1.0, 1.0])),
+                                  interpolation=description.get('interpolation', 'nearest'),
+                                  lattice_cache=description.get('lattice_cache', False),
+                                  seed=description.get('seed', 0))
+    raise ValueError(f'Unknown texture type {texture_type}')
+
+
+def build_material(description: dict, textures: dict[str, Texture]) -> Material:
+    material_type = description['type']
+    if material_type == 'lambertian':
+        if 'texture' in description:
+            return Lambertian(texture=textures[description['texture']])
+        return Lambertian(_vector(description['color']))
+    if material_type == 'metal':
+        return Metal(_vector(description['color']), fuzz=description.get('fuzz', 0.0))
+    if material_type == 'dielectric':
+        return Dielectric(description['refraction_index'])
+    if material_type == 'emissive':
+        return Emissive(_vector(description['color']))
+    raise ValueError(f'Unknown material type {material_type}')
+
+
+def build_mesh(description: dict, material: Material, base_directory: str) -> Mesh:
+    if 'path' in description:
+        return Mesh.load_from_file(_resolve(description['path'], base_directory), material)
+    return Mesh(np.array(description['vertices'], dtype=np.float32),
+                np.array(description['indices'], dtype=np.int32),
+                material,
+                normals=description.get('normals'),
+                texture_coordinates=description.get('texture_coordinates'))
+
+
+def build_object(description: dict, materials: dict[str, Material], meshes: dict[str, Mesh], base_directory: str):
+    object_type = description['type']
+    if object_type == 'example':
+        #the prebuilt triangle lists of normal_interpolation_objects, e.g. smooth_sphere_tris
+        return getattr(normal_interpolation_objects, description['name'])
+    if object_type == 'instance':
+        #a placement of one of the shared meshes, translate, rotate_degrees, scale and pivot as in keyframes
+        material = materials[description['material']] if 'material' in description else None
+        return Instance(meshes[description['mesh']], keyframe_transform(description), material)
+
+    material = materials[description['material']]
+    if object_type == 'sphere':
+        return Sphere(center=_vector(description['center']), radius=description['radius'], material=material)
+    if object_type == 'moving_sphere':
+        return MovingSphere(center0=_vector(description['center0']),
+                            center1=_vector(description['center1']),
+                            time0=description.get('time0', 0.0),
+                            time1=description.get('time1', 1.0),
+                            radius=description['radius'],
+                            material=material)
+    if object_type == 'triangle':
+        vertices = [_vector(vertex) for vertex in description['vertices']]
+        texture_xy = _optional_vectors(description.get('texture_coordinates'), 3)
+        normals = _optional_vectors(description.get('normals'), 3)
+        return Triangle(*vertices, material, *texture_xy, *normals)
+    if object_type == 'quad':
+        vertices = [_vector(vertex) for vertex in description['vertices']]
+        texture_xy = _optional_vectors(description.get('texture_coordinates'), 4)
+        return Quad(*vertices, material, *texture_xy)
+    if object_type == 'mesh':
+        return build_mesh(description, material, base_directory)
+    raise ValueError(f'Unknown object type {object_type}')
+
+
+def build_world(description: dict, base_directory: str) -> FlatBVH:
+    textures = {name: build_texture(texture, base_directory)
+                for name, texture in description.get('textures', {}).items()}
+    materials = {name: build_material(material, textures)
+                 for name, material in description.get('materials', {}).items()}
+    #meshes loaded once and placed by any number of instance objects
+    meshes = {name: build_mesh(mesh, materials[mesh['material']], base_directory)
+              for name, mesh in description.get('meshes', {}).items()}
+    return FlatBVH([build_object(item, materials, meshes, base_directory) for item in description['objects']])
+
+
+def referenced_files(description: dict, base_directory: str) -> list[str]:
+    paths = [item['path'] for item in description.get('textures', {}).values() if 'path' in item]
+    paths += [item['path'] for item in description.get('meshes', {}).values() if 'path' in item]
+    paths += [item['path'] for item in description['objects'] if 'path' in item]
+    return sorted({_resolve(path, base_directory) for path in paths})
+
+
+@functools.cache
+def renderer_source_digest() -> str:
+    #a compiled scene is a pickle of the renderer's objects, any change to the code that builds or holds them can
+    #change what the pickle has to contain
+    digest = hashlib.blake2b(digest_size=16)
+    for path in sorted(glob.glob(os.path.join(RENDERER_DIRECTORY, '*.py'))):
+        digest.update(os.path.basename(path).encode())
+        with open(path, 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def scene_key(description: dict, base_directory: str) -> str:
+    #camera and render settings are cheap to rebuild, so only what goes into the FlatScene is hashed
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(SCENE_CACHE_VERSION).encode())
+    digest.update(renderer_source_digest().encode())
+    geometry = {name: description.get(name) for name in ('textures', 'materials', 'meshes', 'objects')}
+    digest.update(json.dumps(geometry, sort_keys=True).encode())
+    for path in referenced_files(description, base_directory):
+        digest.update(path.encode())
+        digest.update(file_hash(path).encode())
+    return digest.hexdigest()
+
+
+def compiled_scene_path(scene_path: str, key: str) -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(scene_path)), SCENE_CACHE_DIRECTORY, key + '.pickle')
+
+
+def _read_compiled_scene(path: str) -> FlatScene | None:
+    try:
+        with open(path, 'rb') as file:
+            scene = pickle.load(file)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        #missing, truncated or written by code that has since changed
+        return None
+    return scene if isinstance(scene, FlatScene) else None
+
+
+def _write_compiled_scene(path: str, scene: FlatScene):
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temporary_path, 'wb') as file:
+            pickle.dump(scene, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, path)
+    except OSError:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+
+def load_scene(scene_path: str,
+               use_cache: bool = True,
+               settings_overrides: dict | None = None) -> tuple[Camera, FlatScene, RenderSettings]:
+    #the FlatScene with its geometry buffers, built bvh and decoded textures is compiled once per content hash
+    description = read_scene_description(scene_path)
+    base_directory = os.path.dirname(os.path.abspath(scene_path))
+    settings = build_settings({**description['render'], **(settings_overrides or {})})
+    camera = build_camera(description['camera'], settings.width / settings.height)
+
+    key = scene_key(description, base_directory)
+    compiled_path = compiled_scene_path(scene_path, key)
+    scene = _read_compiled_scene(compiled_path) if use_cache else None
+    if scene is None:
+        scene = FlatScene(build_world(description, base_directory))
+        if use_cache:
+            _write_compiled_scene(compiled_path, scene)
+    return camera, scene, settings
+
+
+def load_animation(scene_path: str, settings: RenderSettings) -> Animation | None:
+    #the optional animation section, camera keyframes override fields of the scene camera and object keyframes
+    #are keyed by the 'id' given to top level objects
+    description = read_scene_description(scene_path)
+    animation = description.get('animation')
+    if animation is None:
+        return None
+    object_indices = {item['id']: index for index, item in enumerate(description['objects']) if 'id' in item}
+    unknown = set(animation.get('objects', {})) - set(object_indices)
+    if unknown:
+        raise ValueError(f'Animation refers to objects without a matching id: {sorted(unknown)}')
+
+    camera_keyframes = animation.get('camera')
+    aspect_ratio = settings.width / settings.height
+
+    def camera_at(frame: int) -> Camera:
+        camera_description = description['camera']
+        if camera_keyframes:
+            camera_description = {**camera_description, **interpolate_keyframes(camera_keyframes, frame)}
+        return build_camera(camera_description, aspect_ratio)
+
+    return Animation(frame_count=animation['frames'],
+                     camera_at=camera_at,
+                     object_keyframes={object_indices[name]: keyframes
+                                       for name, keyframes in animation.get('objects', {}).items()})
@@ -31,23 +31,17 @@ class Sphere:
             if not (time_min <= hit_time <= time_max):
                 return None
         
-        hit_point = ray.position(hit_time)
-        outward_normal = normalize(hit_point - self.center)
+        return HitRecord(hit_time, ray, self, self.material)
 
-        front_face = np.dot(ray.direction, outward_normal) < 0.0
+    def hit_normal(self, hit_record: HitRecord) -> tuple[np.ndarray, bool]:
+        outward_normal = normalize(hit_record.point - self.center)
+        front_face = np.dot(hit_record.ray.direction, outward_normal) < 0.0
         normal = outward_normal if front_face else -outward_normal
+        return normal, front_face
 
-        local_point = (hit_point - self.center) / self.radius
-        texture_coordinates = self.sphere_texture_coordinates(local_point)
-
-        return HitRecord(
-            time=hit_time,
-            point=hit_point,
-            normal=normal,
-            material=self.material,
-            front_face=front_face,
-            texture_coordinates=texture_coordinates
-        )
+    def hit_texture_coordinates(self, hit_record: HitRecord) -> np.ndarray:
+        local_point = (hit_record.point - self.center) / self.radius
+        return self.sphere_texture_coordinates(local_point)
     
     def bounding_box(self) -> Axis_Aligned_Bounding_Box:
         radius_vector = np.array([self.radius, self.radius, self.radius], dtype=np.float32)
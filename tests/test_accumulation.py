@@ -0,0 +1,90 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import numpy as np
+import pytest
+
+from accumulation import METADATA_FILE, AccumulationBuffer, render_resumable
+from camera import Camera
+from flat_bvh import FlatBVH
+from flat_scene import FlatScene
+from materials import Lambertian
+from render_settings import RenderSettings
+from sphere import Sphere
+from wavefront import render_image
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def render_checkpoint(scene_path: str, checkpoint_path: str, samples: int, *options: str) -> dict:
+    #every call is a new process, as when a render is stopped and started again
+    subprocess.run([sys.executable, os.path.join(REPOSITORY_DIRECTORY, 'render_scene.py'), scene_path,
+                    '--width', '8', '--height', '6', '--samples', str(samples), '--samples-per-pass', '2',
+                    '--seed', '1', '--threads', '--workers', '1', '--checkpoint', checkpoint_path,
+                    '-o', os.path.join(os.path.dirname(checkpoint_path), 'output.png'), *options],
+                   check=True, capture_output=True)
+    with open(os.path.join(checkpoint_path, METADATA_FILE)) as file:
+        return json.load(file)
+
+
+def test_checkpoint_resumes_in_another_process(tmp_path):
+    scene_path = str(tmp_path / 'animated.json')
+    shutil.copy(os.path.join(REPOSITORY_DIRECTORY, 'scenes', 'animated.json'), scene_path)
+    checkpoint_path = str(tmp_path / 'checkpoint')
+
+    #a compiled scene cache miss, then a hit, then no cache at all must all find the same checkpoint
+    assert render_checkpoint(scene_path, checkpoint_path, 2)['passes'] == 1
+    assert render_checkpoint(scene_path, checkpoint_path, 4)['passes'] == 2
+    assert render_checkpoint(scene_path, checkpoint_path, 6, '--no-cache')['passes'] == 3
+    assert AccumulationBuffer.open(checkpoint_path).sample_counts.min() == 6
+
+
+def test_mismatched_checkpoint_is_kept(tmp_path):
+    checkpoint_path = str(tmp_path / 'checkpoint')
+    buffer = AccumulationBuffer(checkpoint_path, 4, 3, 'first')
+    buffer.add(buffer.color_sum + 1.0, buffer.sample_counts + 1)
+    buffer.checkpoint()
+
+    with pytest.raises(ValueError):
+        AccumulationBuffer(checkpoint_path, 4, 3, 'second')
+    with pytest.raises(ValueError):
+        AccumulationBuffer(checkpoint_path, 5, 3, 'first')
+    kept = AccumulationBuffer.open(checkpoint_path)
+    assert kept.passes == 1
+    assert kept.sample_counts.min() == 1
+
+
+def test_checkpoint_resumes_with_other_backend_and_tile_size(tmp_path):
+    scene_path = str(tmp_path / 'animated.json')
+    shutil.copy(os.path.join(REPOSITORY_DIRECTORY, 'scenes', 'animated.json'), scene_path)
+    checkpoint_path = str(tmp_path / 'checkpoint')
+
+    assert render_checkpoint(scene_path, checkpoint_path, 2, '--backend', 'numpy', '--tile-size', '4')['passes'] == 1
+    assert render_checkpoint(scene_path, checkpoint_path, 4, '--backend', 'auto', '--tile-size', '16')['passes'] == 2
+
+
+def test_adaptive_sampling_carries_across_passes(tmp_path):
+    #the sphere's pixels stay noisy, the sky around it converges at the first few samples
+    camera = Camera(np.array([0.0, 0.0, 0.0]), np.array([0.0, 0.0, -1.0]), np.array([0.0, 1.0, 0.0]), 60.0, 1.0)
+    scene = FlatScene(FlatBVH([Sphere(np.array([0.0, 0.0, -2.0], dtype=np.float32), 0.5,
+                                      Lambertian(np.array([0.7, 0.7, 0.7], dtype=np.float32)))]))
+    settings = RenderSettings(8, 8, 64, adaptive_sampling=True, min_samples_per_pixel=4, adaptive_tolerance=0.05)
+    checkpoint_path = str(tmp_path / 'checkpoint')
+
+    def render_pass(camera, scene, settings, seed):
+        return render_image(camera, scene, settings, seed=seed, max_workers=1)
+
+    buffer = render_resumable(camera, scene, settings, checkpoint_path, samples_per_pass=4, seed=0,
+                              render_pass=render_pass)
+    counts = buffer.sample_counts
+    assert counts.max() == 64
+    assert 4 <= counts.min() < 64
+    assert np.array_equal(buffer.converged, counts < 64)
+
+    #a finished adaptive render resumes to nothing left to do
+    resumed = render_resumable(camera, scene, settings, checkpoint_path, samples_per_pass=4, seed=0,
+                               render_pass=render_pass)
+    assert resumed.passes == buffer.passes
+    np.testing.assert_array_equal(resumed.sample_counts, counts)
@@ -0,0 +1,105 @@
+import copy
+import numpy as np
+
+from animation import Animation, interpolate_keyframes, render_animation, transform_matrix
+from camera import Camera
+from flat_bvh import FlatBVH
+from flat_scene import FlatScene
+from instance import Instance
+from materials import Lambertian
+from mesh import Mesh
+from ray import RayBatch
+from render_settings import RenderSettings
+from sphere import Sphere
+from wavefront import render_image
+
+MATERIAL = Lambertian(np.array([0.5, 0.5, 0.5], dtype=np.float32))
+
+
+def grid_mesh(resolution: int) -> Mesh:
+    coordinates = np.linspace(-1.0, 1.0, resolution + 1)
+    x, z = np.meshgrid(coordinates, coordinates)
+    vertices = np.stack((x, 0.2 * np.sin(3.0 * x) * np.cos(2.0 * z), z), axis=-1).reshape(-1, 3)
+    row, column = np.mgrid[0:resolution, 0:resolution]
+    corner = (row * (resolution + 1) + column).ravel()
+    below = corner + resolution + 1
+    indices = np.concatenate((np.stack((corner, below, corner + 1), axis=1),
+                              np.stack((corner + 1, below, below + 1), axis=1)))
+    return Mesh(vertices, indices, MATERIAL)
+
+
+def moving_objects(rng: np.random.Generator) -> list:
+    objects = [Sphere(rng.uniform(-2.0, 2.0, 3).astype(np.float32), float(rng.uniform(0.1, 0.4)), MATERIAL)
+               for _ in range(20)]
+    objects.append(grid_mesh(6))
+    objects.append(Instance(grid_mesh(4), transform_matrix(translate=(0.0, 1.0, 0.0), scale=0.5)))
+    return objects
+
+
+def random_rays(rng: np.random.Generator, count: int = 3000) -> RayBatch:
+    origins = rng.normal(size=(count, 3))
+    origins *= 5.0 / np.linalg.norm(origins, axis=1, keepdims=True)
+    return RayBatch(origins, rng.uniform(-2.0, 2.0, (count, 3)) - origins, np.zeros(count))
+
+
+def rebuilt(scene: FlatScene) -> FlatScene:
+    scene = copy.copy(scene)
+    scene.bvh = FlatBVH.from_bounds(*scene.primitive_bounds())
+    return scene
+
+
+def assert_same_hits(scene: FlatScene, expected: FlatScene, rays: RayBatch):
+    for coherent in (False, True):
+        hits = scene.closest_hits(rays, 1e-3, float('inf'), coherent=coherent, backend='numpy')
+        expected_hits = expected.closest_hits(rays, 1e-3, float('inf'), coherent=coherent, backend='numpy')
+        np.testing.assert_array_equal(hits[1], expected_hits[1])
+        np.testing.assert_allclose(hits[0], expected_hits[0], rtol=1e-9)
+
+
+def test_refitted_bvh_finds_the_hits_of_a_rebuilt_one():
+    scene = FlatScene(FlatBVH(moving_objects(np.random.default_rng(0))))
+    rays = random_rays(np.random.default_rng(1))
+    transforms = {0: transform_matrix(translate=(0.4, 0.2, -0.3)),
+                  20: transform_matrix(rotate_degrees=(20.0, 40.0, 0.0), scale=1.3, pivot=(0.0, 0.0, 0.0)),
+                  21: transform_matrix(translate=(-0.5, 0.0, 0.5), rotate_degrees=(0.0, 90.0, 0.0))}
+    assert not scene.transform_objects(transforms)
+    assert_same_hits(scene, rebuilt(scene), rays)
+    #moving the objects somewhere else again starts from their original geometry
+    assert not scene.transform_objects({0: transform_matrix(translate=(-0.4, 0.0, 0.0))})
+    assert_same_hits(scene, rebuilt(scene), rays)
+
+
+def test_objects_left_out_go_back_to_rest():
+    objects = moving_objects(np.random.default_rng(2))
+    scene = FlatScene(FlatBVH(objects))
+    rest = FlatScene(FlatBVH(objects))
+    scene.transform_objects({5: transform_matrix(translate=(1.0, 1.0, 1.0)), 21: transform_matrix(scale=2.0)})
+    scene.transform_objects({})
+    assert_same_hits(scene, rest, random_rays(np.random.default_rng(3)))
+
+
+def test_keyframes_are_blended_and_held():
+    keyframes = [{'frame': 10, 'translate': [2.0, 0.0, 0.0], 'scale': 2.0}, {'frame': 0, 'translate': [0.0, 0.0, 0.0]}]
+    assert interpolate_keyframes(keyframes, -5)['translate'] == [0.0, 0.0, 0.0]
+    assert interpolate_keyframes(keyframes, 15)['scale'] == 2.0
+    np.testing.assert_allclose(interpolate_keyframes(keyframes, 2.5)['translate'], [0.5, 0.0, 0.0])
+    matrix = transform_matrix(rotate_degrees=(0.0, 0.0, 90.0), pivot=(1.0, 0.0, 0.0))
+    np.testing.assert_allclose(matrix @ [2.0, 0.0, 0.0, 1.0], [1.0, 1.0, 0.0, 1.0], atol=1e-12)
+
+
+def test_animation_frames_follow_the_keyframes():
+    scene = FlatScene(FlatBVH([Sphere(np.array([0.0, -100.5, 0.0], dtype=np.float32), 100.0, MATERIAL),
+                               Sphere(np.array([0.0, 0.0, 0.0], dtype=np.float32), 0.5, MATERIAL)]))
+    camera = Camera(np.array([0.0, 0.5, 3.0]), np.array([0.0, 0.0, 0.0]), np.array([0.0, 1.0, 0.0]), 40.0, 1.0)
+    keyframes = [{'frame': 0, 'translate': [-1.0, 0.0, 0.0]}, {'frame': 2, 'translate': [1.0, 0.0, 0.0]}]
+    animation = Animation(3, lambda frame: camera, {1: keyframes})
+
+    def render_frame(camera, scene, settings, seed):
+        return render_image(camera, scene, settings, seed=seed, max_workers=1)
+
+    frames = list(render_animation(animation, scene, RenderSettings(12, 12, 2), seed=0, render_frame=render_frame))
+    assert [statistics.frame for _, statistics in frames] == [0, 1, 2]
+    #the sphere crosses from the left half of the image to the right one
+    first, last = frames[0][0], frames[-1][0]
+    assert first[:, :6].mean() < first[:, 6:].mean() - 0.02
+    assert last[:, 6:].mean() < last[:, :6].mean() - 0.02
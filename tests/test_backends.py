@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+from animation import transform_matrix
+from flat_bvh import FlatBVH
+from flat_scene import FlatScene
+from instance import Instance
+from materials import Lambertian
+from mesh import Mesh
+from moving_sphere import MovingSphere
+from ray import RayBatch
+from sphere import Sphere
+from triangle import Triangle
+
+pytest.importorskip('numba')
+
+#the kernels sum in a different order than numpy, so times and normals only agree to rounding
+TOLERANCE = 1e-9
+
+
+def grid_mesh(resolution: int, material) -> Mesh:
+    coordinates = np.linspace(-1.0, 1.0, resolution + 1)
+    x, z = np.meshgrid(coordinates, coordinates)
+    vertices = np.stack((x, 0.2 * np.sin(3.0 * x) * np.cos(2.0 * z), z), axis=-1).reshape(-1, 3)
+    row, column = np.mgrid[0:resolution, 0:resolution]
+    corner = (row * (resolution + 1) + column).ravel()
+    below = corner + resolution + 1
+    indices = np.concatenate((np.stack((corner, below, corner + 1), axis=1),
+                              np.stack((corner + 1, below, below + 1), axis=1)))
+    return Mesh(vertices, indices, material)
+
+
+def sphere_objects(rng: np.random.Generator) -> list:
+    material = Lambertian(np.array([0.5, 0.5, 0.5], dtype=np.float32))
+    objects = [Sphere(np.array(rng.uniform(-2.0, 2.0, 3), dtype=np.float32), float(rng.uniform(0.2, 0.6)), material)
+               for _ in range(30)]
+    #moving spheres are hit where they are at each ray's time
+    objects += [MovingSphere(rng.uniform(-2.0, 2.0, 3), rng.uniform(-2.0, 2.0, 3), 0.0, 1.0, 0.3, material)
+                for _ in range(10)]
+    return objects
+
+
+def triangle_objects(rng: np.random.Generator) -> list:
+    material = Lambertian(np.array([0.5, 0.5, 0.5], dtype=np.float32))
+    objects = [Triangle(*(rng.uniform(-2.0, 2.0, 3) for _ in range(3)), material) for _ in range(40)]
+    objects.append(grid_mesh(12, material))
+    return objects
+
+
+def instance_objects(rng: np.random.Generator) -> list:
+    material = Lambertian(np.array([0.5, 0.5, 0.5], dtype=np.float32))
+    meshes = [grid_mesh(8, material), grid_mesh(5, material)]
+    return [Instance(meshes[index % 2], transform_matrix(translate=rng.uniform(-2.0, 2.0, 3),
+                                                         rotate_degrees=rng.uniform(0.0, 360.0, 3),
+                                                         scale=float(rng.uniform(0.3, 1.0))))
+            for index in range(25)]
+
+
+def random_rays(rng: np.random.Generator, count: int = 4000) -> RayBatch:
+    #from a shell around the scene towards points inside it, at random shutter times
+    origins = rng.normal(size=(count, 3))
+    origins *= 5.0 / np.linalg.norm(origins, axis=1, keepdims=True)
+    targets = rng.uniform(-2.0, 2.0, (count, 3))
+    return RayBatch(origins, targets - origins, rng.uniform(0.0, 1.0, count))
+
+
+@pytest.fixture(params=[sphere_objects, triangle_objects, instance_objects, 'mixed'],
+                ids=['spheres', 'triangles', 'instances', 'mixed'])
+def scene(request) -> FlatScene:
+    rng = np.random.default_rng(7)
+    if request.param == 'mixed':
+        objects = sphere_objects(rng) + triangle_objects(rng) + instance_objects(rng)
+    else:
+        objects = request.param(rng)
+    return FlatScene(FlatBVH(objects))
+
+
+@pytest.mark.parametrize('coherent', [False, True])
+def test_closest_hits_match(scene, coherent):
+    rays = random_rays(np.random.default_rng(3))
+    numpy_time, numpy_primitive, numpy_u, numpy_v = scene.closest_hits(rays, 1e-3, float('inf'), coherent=coherent,
+                                                                       backend='numpy')
+    numba_time, numba_primitive, numba_u, numba_v = scene.closest_hits(rays, 1e-3, float('inf'), coherent=coherent,
+                                                                       backend='numba')
+    hit = numpy_primitive >= 0
+    assert hit.sum() > len(rays) // 10
+    np.testing.assert_array_equal(numba_primitive, numpy_primitive)
+    np.testing.assert_allclose(numba_time[hit], numpy_time[hit], rtol=TOLERANCE)
+    np.testing.assert_allclose(numba_u, numpy_u, atol=TOLERANCE)
+    np.testing.assert_allclose(numba_v, numpy_v, atol=TOLERANCE)
+
+
+def test_intersect_matches(scene):
+    rays = random_rays(np.random.default_rng(4))
+    numpy_mask, numpy_records = scene.intersect(rays, 1e-3, float('inf'), backend='numpy')
+    numba_mask, numba_records = scene.intersect(rays, 1e-3, float('inf'), backend='numba')
+    np.testing.assert_array_equal(numba_mask, numpy_mask)
+    np.testing.assert_array_equal(numba_records.primitive_index, numpy_records.primitive_index)
+    np.testing.assert_allclose(numba_records.time, numpy_records.time, rtol=TOLERANCE)
+    np.testing.assert_allclose(numba_records.normal, numpy_records.normal, atol=TOLERANCE)
+
+
+def test_refitted_scene_matches():
+    #the kernels walk the bvh as transform_objects leaves it
+    scene = FlatScene(FlatBVH(sphere_objects(np.random.default_rng(7)) + instance_objects(np.random.default_rng(8))))
+    scene.transform_objects({0: transform_matrix(translate=(0.5, -0.3, 0.2)),
+                             45: transform_matrix(rotate_degrees=(0.0, 30.0, 0.0), scale=1.5)})
+    rays = random_rays(np.random.default_rng(5))
+    numpy_hits = scene.closest_hits(rays, 1e-3, float('inf'), backend='numpy')
+    numba_hits = scene.closest_hits(rays, 1e-3, float('inf'), backend='numba')
+    np.testing.assert_array_equal(numba_hits[1], numpy_hits[1])
+    np.testing.assert_allclose(numba_hits[0], numpy_hits[0], rtol=TOLERANCE)
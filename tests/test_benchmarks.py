@@ -0,0 +1,40 @@
+import json
+import sys
+import numpy as np
+
+import benchmarks.run
+from benchmarks.run import camera_rays, measure_build
+from benchmarks.scenes import SCENES
+from render_settings import RenderSettings
+from sampler import sampler_key
+
+
+def test_every_scene_builds_and_is_seen_by_its_camera():
+    settings = RenderSettings(32, 18, 1)
+    for scene_name, scene_builder in SCENES.items():
+        metrics, camera, _, scene = measure_build(scene_builder, settings.width / settings.height)
+        assert metrics['primitive_count'] > 0 and metrics['bvh_node_count'] > 0, scene_name
+        rays, _ = camera_rays(camera, settings, sampler_key(0), 0)
+        _, primitives, _, _ = scene.closest_hits(rays, 1e-3, float('inf'))
+        assert (primitives >= 0).mean() > 0.2, scene_name
+
+
+def test_run_records_and_compares_results(tmp_path, monkeypatch, capsys):
+    #references are kept out of the repository's own cache
+    monkeypatch.setattr(benchmarks.run, 'CACHE_DIRECTORY', str(tmp_path / 'cache'))
+    output_path = tmp_path / 'results.json'
+    arguments = ['run.py', '--scenes', 'spheres', '--width', '16', '--height', '9', '--repeats', '1',
+                 '--max-samples', '2', '--reference-samples', '4', '--scalar-rows', '1', '--scalar-samples', '1',
+                 '--output', str(output_path)]
+    monkeypatch.setattr(sys, 'argv', arguments)
+    benchmarks.run.main()
+    results = json.loads(output_path.read_text())
+    metrics = results['scenes']['spheres']
+    assert [point['samples_per_pixel'] for point in metrics['convergence']] == [1, 2]
+    assert metrics['path_rays_per_second'] > 0 and metrics['scalar_speedup'] > 0
+    assert np.isfinite(metrics['convergence'][-1]['denoised_rmse'])
+    assert (tmp_path / 'cache').exists()
+
+    monkeypatch.setattr(sys, 'argv', arguments[:-1] + [str(tmp_path / 'again.json'), '--compare', str(output_path)])
+    benchmarks.run.main()
+    assert 'spheres: build_seconds x' in capsys.readouterr().out
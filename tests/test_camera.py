@@ -0,0 +1,61 @@
+import numpy as np
+
+from camera import Camera
+
+
+class FixedSamples:
+    #hands out preset samples in the order the camera asks for them
+    def __init__(self, samples: np.ndarray):
+        self.samples = samples.ravel()
+        self.position = 0
+
+    def random(self, size=None):
+        count = 1 if size is None else int(np.prod(size))
+        values = self.samples[self.position:self.position + count]
+        self.position += count
+        return values[0] if size is None else values.reshape(size)
+
+
+def make_camera(**keywords) -> Camera:
+    return Camera(np.array([1.0, 2.0, 5.0]), np.array([0.0, 0.5, 0.0]), np.array([0.0, 1.0, 0.0]), 45.0, 1.6,
+                  shutter_open_time=0.25, shutter_close_time=0.75, **keywords)
+
+
+def test_pixel_rays_match_single_camera_rays():
+    camera = make_camera()
+    rng = np.random.default_rng(0)
+    pixel_x = rng.integers(0, 32, 50)
+    pixel_y = rng.integers(0, 20, 50)
+    samples = rng.random((50, 5))
+    rays = camera.pixel_rays(pixel_x, pixel_y, 32, 20, FixedSamples(samples))
+    for i in range(50):
+        ray = camera.get_ray((pixel_x[i] + samples[i, 0]) / 31, (pixel_y[i] + samples[i, 1]) / 19,
+                             FixedSamples(samples[i, 2:3]))
+        np.testing.assert_allclose(rays.origins[i], ray.origin)
+        np.testing.assert_allclose(rays.directions[i], ray.direction, rtol=1e-12, atol=1e-12)
+        assert rays.times[i] == ray.time
+    assert (0.25 <= rays.times).all() and (rays.times <= 0.75).all()
+
+
+def test_lens_rays_meet_on_the_focus_plane():
+    camera = make_camera(aperture=0.4, focus_distance=3.0)
+    samples = np.random.default_rng(1).random((200, 5))
+    samples[:, :2] = 0.5
+    rays = camera.pixel_rays(np.full(200, 10), np.full(200, 7), 32, 20, FixedSamples(samples))
+    #every lens point aims at the same point on the plane in focus
+    focus_points = rays.origins + rays.directions
+    np.testing.assert_allclose(focus_points, np.broadcast_to(focus_points[0], focus_points.shape), atol=1e-12)
+    lens_offsets = rays.origins - camera.origin
+    assert np.linalg.norm(lens_offsets, axis=1).max() <= 0.2 + 1e-12
+    np.testing.assert_allclose(lens_offsets @ camera.camera_backward, 0.0, atol=1e-12)
+
+
+def test_concentric_mapping_fills_the_disk_evenly():
+    samples = np.random.default_rng(2).random((20000, 2))
+    points = Camera.concentric_disk_points(samples)
+    radii = np.linalg.norm(points, axis=1)
+    assert radii.max() <= 1.0 + 1e-12
+    #equal areas of the square go to equal areas of the disk
+    assert abs(np.mean(radii < 0.5) - 0.25) < 0.01
+    np.testing.assert_allclose(Camera.concentric_disk_points(np.array([[0.5, 0.5], [1.0, 1.0], [1.0, 0.5]])),
+                               [[0.0, 0.0], [np.sqrt(0.5), np.sqrt(0.5)], [1.0, 0.0]], atol=1e-12)
@@ -0,0 +1,54 @@
+import numpy as np
+
+from camera import Camera
+from denoise import FeatureBuffers, denoise_atrous, denoise_render, render_features
+from flat_bvh import FlatBVH
+from flat_scene import FlatScene
+from materials import Lambertian
+from render_settings import RenderSettings
+from sphere import Sphere
+from wavefront import render_image
+
+RED = np.array([0.8, 0.2, 0.2], dtype=np.float32)
+
+
+def sphere_scene() -> tuple[Camera, FlatScene]:
+    camera = Camera(np.array([0.0, 0.0, 3.0]), np.array([0.0, 0.0, 0.0]), np.array([0.0, 1.0, 0.0]), 40.0, 1.0)
+    return camera, FlatScene(FlatBVH([Sphere(np.array([0.0, 0.0, 0.0], dtype=np.float32), 1.0, Lambertian(RED))]))
+
+
+def test_features_describe_the_first_hit():
+    camera, scene = sphere_scene()
+    features = render_features(camera, scene, RenderSettings(16, 16, 1), seed=0)
+    center = features.depth.shape[0] // 2
+    #the sphere's front is 2 units from the camera and faces it, the corners see nothing
+    np.testing.assert_allclose(features.albedo[center, center], RED, rtol=1e-6)
+    np.testing.assert_allclose(features.depth[center, center], 2.0, atol=0.05)
+    assert features.normal[center, center, 2] > 0.99
+    np.testing.assert_array_equal(features.albedo[0, 0], [1.0, 1.0, 1.0])
+    assert features.depth[0, 0] == 0.0 and not features.normal[0, 0].any()
+
+
+def test_filter_smooths_noise_but_keeps_edges():
+    rng = np.random.default_rng(0)
+    normal = np.zeros((32, 32, 3))
+    normal[:, :16, 2] = 1.0
+    normal[:, 16:, 0] = 1.0
+    features = FeatureBuffers(albedo=np.ones((32, 32, 3)), normal=normal, depth=np.ones((32, 32)))
+    clean = np.where(np.arange(32)[None, :, None] < 16, 0.2, 0.8) * np.ones((32, 32, 3))
+    noisy = (clean + rng.normal(0.0, 0.05, clean.shape)).astype(np.float32)
+    denoised = denoise_atrous(noisy, features)
+    assert denoised.dtype == np.float32
+    assert np.abs(denoised - clean).mean() < 0.5 * np.abs(noisy - clean).mean()
+    #the two sides differ in normal, so neither bleeds into the other
+    np.testing.assert_allclose(denoised[:, 14:16].mean(), 0.2, atol=0.02)
+    np.testing.assert_allclose(denoised[:, 16:18].mean(), 0.8, atol=0.02)
+
+
+def test_denoise_setting_filters_the_render():
+    camera, scene = sphere_scene()
+    settings = RenderSettings(16, 16, 2)
+    image, _ = render_image(camera, scene, settings, seed=4, max_workers=1)
+    denoised, _ = render_image(camera, scene, RenderSettings(16, 16, 2, denoise=True), seed=4, max_workers=1)
+    np.testing.assert_array_equal(denoised, denoise_render(image, camera, scene, settings, seed=4))
+    assert not np.array_equal(denoised, image)
@@ -0,0 +1,66 @@
+import threading
+from multiprocessing.connection import Client
+import numpy as np
+
+from camera import Camera
+from distributed import DEFAULT_AUTHKEY, TileCoordinator, parse_address, render_image_distributed
+from flat_bvh import FlatBVH
+from flat_scene import FlatScene
+from materials import Lambertian, Metal
+from render_settings import RenderSettings
+from sphere import Sphere
+from wavefront import render_image
+
+
+def small_scene() -> tuple[Camera, FlatScene]:
+    camera = Camera(np.array([0.0, 1.0, 4.0]), np.array([0.0, 0.5, 0.0]), np.array([0.0, 1.0, 0.0]), 40.0, 1.5)
+    objects = [Sphere(np.array([0.0, -100.0, 0.0], dtype=np.float32), 100.0,
+                      Lambertian(np.array([0.5, 0.6, 0.5], dtype=np.float32))),
+               Sphere(np.array([0.0, 0.5, 0.0], dtype=np.float32), 0.5,
+                      Metal(np.array([0.8, 0.7, 0.6], dtype=np.float32), 0.2))]
+    return camera, FlatScene(FlatBVH(objects))
+
+
+def test_addresses_default_to_localhost():
+    assert parse_address('render-farm:5000') == ('render-farm', 5000)
+    assert parse_address(':5000') == ('localhost', 5000)
+
+
+def test_workers_render_the_same_image_as_threads():
+    camera, scene = small_scene()
+    settings = RenderSettings(24, 16, 3, tile_size=8)
+    expected_image, expected_counts = render_image(camera, scene, settings, seed=2, max_workers=1)
+    image, sample_counts = render_image_distributed(camera, scene, settings, seed=2, max_workers=2)
+    np.testing.assert_array_equal(sample_counts, expected_counts)
+    np.testing.assert_allclose(image, expected_image, rtol=1e-5, atol=1e-6)
+
+
+def test_tiles_of_a_lost_worker_are_dealt_again():
+    camera, scene = small_scene()
+    settings = RenderSettings(24, 16, 2, tile_size=8)
+    expected_image, _ = render_image(camera, scene, settings, seed=3, max_workers=1)
+    taken = []
+    connected = threading.Event()
+
+    def vanishing_worker(address):
+        #takes the scene and its first tiles, then goes away without rendering them
+        connection = Client(address, authkey=DEFAULT_AUTHKEY)
+        connected.set()
+        connection.send(('ready', 0))
+        connection.recv()
+        taken.append(connection.recv()[2])
+        connection.close()
+
+    with TileCoordinator(worker_timeout=10.0) as coordinator:
+        worker = threading.Thread(target=vanishing_worker, args=(coordinator.address,))
+        worker.start()
+        connected.wait()
+        coordinator.start_local_workers(1)
+        image, sample_counts = coordinator.render(camera, scene, settings, seed=3)
+        #a second render on the same coordinator ignores whatever is left of the first
+        second_image, _ = coordinator.render(camera, scene, settings, seed=3)
+        worker.join()
+    assert taken
+    assert (sample_counts == 2).all()
+    np.testing.assert_allclose(image, expected_image, rtol=1e-5, atol=1e-6)
+    np.testing.assert_array_equal(second_image, image)
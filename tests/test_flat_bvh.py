@@ -0,0 +1,108 @@
+import numpy as np
+
+from camera import Camera
+from flat_bvh import PACKET_SIZE, FlatBVH, direction_packets
+from flat_scene import FlatScene
+from materials import Lambertian
+from mesh import Mesh
+from ray import Ray, RayBatch
+from sampler import STREAM_CAMERA, PathSampler, sampler_key
+from sphere import Sphere
+from triangle import Triangle
+
+MATERIAL = Lambertian(np.array([0.5, 0.5, 0.5], dtype=np.float32))
+
+
+def grid_mesh(resolution: int) -> Mesh:
+    coordinates = np.linspace(-1.0, 1.0, resolution + 1)
+    x, z = np.meshgrid(coordinates, coordinates)
+    vertices = np.stack((x, 0.2 * np.sin(3.0 * x) * np.cos(2.0 * z), z), axis=-1).reshape(-1, 3)
+    row, column = np.mgrid[0:resolution, 0:resolution]
+    corner = (row * (resolution + 1) + column).ravel()
+    below = corner + resolution + 1
+    indices = np.concatenate((np.stack((corner, below, corner + 1), axis=1),
+                              np.stack((corner + 1, below, below + 1), axis=1)))
+    return Mesh(vertices, indices, MATERIAL)
+
+
+def random_objects(rng: np.random.Generator) -> list:
+    objects = [Sphere(rng.uniform(-2.0, 2.0, 3).astype(np.float32), float(rng.uniform(0.1, 0.4)), MATERIAL)
+               for _ in range(30)]
+    objects += [Triangle(*(rng.uniform(-2.0, 2.0, 3).astype(np.float32) for _ in range(3)), MATERIAL)
+                for _ in range(30)]
+    return objects
+
+
+def random_rays(rng: np.random.Generator, count: int) -> RayBatch:
+    origins = rng.normal(size=(count, 3))
+    origins *= 5.0 / np.linalg.norm(origins, axis=1, keepdims=True)
+    return RayBatch(origins, rng.uniform(-2.0, 2.0, (count, 3)) - origins, np.zeros(count))
+
+
+def test_closest_hits_match_testing_every_object():
+    rng = np.random.default_rng(0)
+    objects = random_objects(rng)
+    scene = FlatScene(FlatBVH(objects))
+    rays = random_rays(rng, 300)
+    closest_time, closest_primitive, _, _ = scene.closest_hits(rays, time_min=1e-3, time_max=float('inf'))
+    for i in range(len(rays)):
+        ray = Ray(rays.origins[i], rays.directions[i], 0.0)
+        hits = [hit for hit in (object.hit(ray, 1e-3, float('inf')) for object in objects) if hit]
+        if not hits:
+            assert closest_primitive[i] == -1
+        else:
+            assert closest_primitive[i] >= 0
+            np.testing.assert_allclose(closest_time[i], min(hit.time for hit in hits), rtol=1e-5)
+
+
+def test_scene_reuses_mesh_bvh(monkeypatch):
+    mesh = grid_mesh(10)
+    objects = random_objects(np.random.default_rng(1)) + [mesh]
+    world = FlatBVH(objects)
+    expected = FlatScene(world)
+    expected.bvh = FlatBVH.from_bounds(*expected.primitive_bounds())
+
+    built = []
+    build = FlatBVH._build
+
+    def recording_build(self, minimums, maximums, *arguments, **keywords):
+        built.append(len(minimums))
+        build(self, minimums, maximums, *arguments, **keywords)
+
+    monkeypatch.setattr(FlatBVH, '_build', recording_build)
+    scene = FlatScene(world)
+    #the top level holds the 60 loose primitives and one box for the mesh, the mesh's own tree is copied in
+    assert built == [len(objects)]
+    assert scene.bvh.max_depth >= mesh.bvh.max_depth
+    np.testing.assert_array_equal(np.sort(scene.bvh.primitive_indices), np.arange(len(scene.bvh.primitive_indices)))
+
+    rays = random_rays(np.random.default_rng(2), 3000)
+    for coherent in (False, True):
+        expected_hits = expected.closest_hits(rays, 1e-3, float('inf'), coherent=coherent, backend='numpy')
+        hits = scene.closest_hits(rays, 1e-3, float('inf'), coherent=coherent, backend='numpy')
+        np.testing.assert_array_equal(hits[1], expected_hits[1])
+        np.testing.assert_allclose(hits[0], expected_hits[0])
+
+
+def test_packets_group_every_ray_once():
+    directions = np.random.default_rng(3).normal(size=(1000, 3))
+    packets = direction_packets(directions, PACKET_SIZE)
+    assert packets.shape[1] == PACKET_SIZE
+    np.testing.assert_array_equal(np.sort(packets[packets >= 0]), np.arange(1000))
+
+
+def test_packets_find_the_hits_of_single_rays():
+    objects = random_objects(np.random.default_rng(4)) + [grid_mesh(12)]
+    scene = FlatScene(FlatBVH(objects))
+    #camera rays through every pixel, with a lens so the packets are not just one point, then scattered ones
+    camera = Camera(np.array([0.0, 1.0, 6.0]), np.array([0.0, 0.0, 0.0]), np.array([0.0, 1.0, 0.0]), 50.0, 1.5,
+                    aperture=0.2, focus_distance=6.0)
+    pixel_y, pixel_x = np.divmod(np.repeat(np.arange(48 * 32), 2), 48)
+    sampler = PathSampler(sampler_key(0), np.repeat(np.arange(48 * 32), 2), np.tile([0, 1], 48 * 32))
+    camera_rays = camera.pixel_rays(pixel_x, pixel_y, 48, 32, sampler.stream(0, STREAM_CAMERA))
+    for rays in (camera_rays, random_rays(np.random.default_rng(5), 2000)):
+        single = scene.closest_hits(rays, 1e-3, float('inf'), coherent=False, backend='numpy')
+        packets = scene.closest_hits(rays, 1e-3, float('inf'), coherent=True, backend='numpy')
+        assert (single[1] >= 0).sum() > len(rays) // 10
+        for packet_result, single_result in zip(packets, single):
+            np.testing.assert_array_equal(packet_result, single_result)
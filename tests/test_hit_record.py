@@ -0,0 +1,58 @@
+import numpy as np
+
+from flat_bvh import FlatBVH
+from hit_record import HitRecord
+from materials import Lambertian
+from moving_sphere import MovingSphere
+from ray import Ray
+from sphere import Sphere
+
+MATERIAL = Lambertian(np.array([0.5, 0.5, 0.5], dtype=np.float32))
+
+
+class CountingSphere(Sphere):
+    #counts how often its hit records are shaded
+    def __init__(self, center: np.ndarray, radius: float):
+        super().__init__(center, radius, MATERIAL)
+        self.normal_calls = 0
+        self.texture_calls = 0
+
+    def hit_normal(self, hit_record: HitRecord) -> tuple[np.ndarray, bool]:
+        self.normal_calls += 1
+        return super().hit_normal(hit_record)
+
+    def hit_texture_coordinates(self, hit_record: HitRecord) -> np.ndarray:
+        self.texture_calls += 1
+        return super().hit_texture_coordinates(hit_record)
+
+
+def test_fields_are_worked_out_once_when_read():
+    sphere = CountingSphere(np.array([0.0, 0.0, -3.0], dtype=np.float32), 1.0)
+    hit = sphere.hit(Ray(np.array([0.0, 0.0, 0.0]), np.array([0.0, 0.0, -2.0]), 0.0), 1e-3, float('inf'))
+    assert sphere.normal_calls == 0 and sphere.texture_calls == 0
+    np.testing.assert_allclose(hit.point, [0.0, 0.0, -2.0])
+    assert hit.front_face
+    np.testing.assert_allclose(hit.normal, [0.0, 0.0, 1.0], atol=1e-6)
+    hit.texture_coordinates
+    hit.texture_coordinates
+    assert sphere.normal_calls == 1 and sphere.texture_calls == 1
+
+
+def test_hits_from_inside_face_the_ray():
+    sphere = Sphere(np.array([0.0, 0.0, 0.0], dtype=np.float32), 2.0, MATERIAL)
+    hit = sphere.hit(Ray(np.array([0.0, 0.0, 0.0]), np.array([1.0, 0.0, 0.0]), 0.0), 1e-3, float('inf'))
+    assert not hit.front_face
+    np.testing.assert_allclose(hit.normal, [-1.0, 0.0, 0.0], atol=1e-6)
+    moving = MovingSphere(np.array([0.0, 0.0, -3.0]), np.array([2.0, 0.0, -3.0]), 0.0, 1.0, 1.0, MATERIAL)
+    #the normal is taken from where the sphere is at the ray's time
+    hit = moving.hit(Ray(np.array([1.0, 0.0, 0.0]), np.array([0.0, 0.0, -1.0]), 0.5), 1e-3, float('inf'))
+    np.testing.assert_allclose(hit.normal, [0.0, 0.0, 1.0], atol=1e-6)
+
+
+def test_only_the_closest_hit_is_shaded():
+    spheres = [CountingSphere(np.array([0.0, 0.0, -2.0 * index], dtype=np.float32), 0.5) for index in range(1, 9)]
+    world = FlatBVH(spheres)
+    hit = world.hit(Ray(np.array([0.0, 0.0, 0.0]), np.array([0.0, 0.0, -1.0]), 0.0), 1e-3, float('inf'))
+    assert hit.primitive is spheres[0]
+    hit.normal
+    assert [sphere.normal_calls for sphere in spheres] == [1] + [0] * 7
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from image_io import main, read_pfm, save_image, tonemap, write_pfm
+
+
+def test_pfm_keeps_linear_radiance(tmp_path):
+    image = np.random.default_rng(0).exponential(2.0, (5, 7, 3)).astype(np.float32)
+    image[0, 0] = [1e-6, 50.0, 1e4]
+    save_image(image, str(tmp_path / 'render.pfm'))
+    np.testing.assert_array_equal(read_pfm(str(tmp_path / 'render.pfm')), image)
+    assert not list(tmp_path.glob('*.partial*'))
+
+
+def test_pfm_reads_big_endian_and_greyscale(tmp_path):
+    #rows are stored bottom to top
+    rows = np.array([[1.0, 2.0], [3.0, 4.0]], dtype='>f4')
+    (tmp_path / 'grey.pfm').write_bytes(b'Pf\r\n2 2\r\n1.0\r\n' + rows[::-1].tobytes())
+    image = read_pfm(str(tmp_path / 'grey.pfm'))
+    assert image.shape == (2, 2, 3)
+    np.testing.assert_array_equal(image[..., 1], rows)
+    (tmp_path / 'short.pfm').write_bytes(b'PF\n4 4\n-1.0\n' + bytes(8))
+    with pytest.raises(ValueError):
+        read_pfm(str(tmp_path / 'short.pfm'))
+
+
+def test_tonemap_operators():
+    image = np.array([[[0.0, 0.5, 4.0]]], dtype=np.float32)
+    np.testing.assert_array_equal(tonemap(image), [[[0, 127, 255]]])
+    np.testing.assert_array_equal(tonemap(image, exposure=1.0)[0, 0, 1], 255)
+    #the curves compress highlights instead of clipping them
+    assert tonemap(image, operator='reinhard')[0, 0, 2] == int(0.8 * 255)
+    assert 0 < tonemap(image, operator='aces')[0, 0, 1] < tonemap(image, operator='aces')[0, 0, 2] < 255
+    assert tonemap(image, gamma=2.2)[0, 0, 1] > tonemap(image)[0, 0, 1]
+    with pytest.raises(ValueError):
+        tonemap(image, operator='filmic')
+
+
+def test_saved_radiance_is_tonemapped_again_later(tmp_path):
+    image = np.random.default_rng(1).exponential(1.0, (4, 6, 3)).astype(np.float32)
+    write_pfm(image, str(tmp_path / 'render.pfm'))
+    main([str(tmp_path / 'render.pfm'), '-o', str(tmp_path / 'render.png'),
+          '--exposure', '-1', '--tonemap', 'reinhard'])
+    with Image.open(tmp_path / 'render.png') as png:
+        np.testing.assert_array_equal(np.asarray(png), tonemap(image, -1.0, 'reinhard'))
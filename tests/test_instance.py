@@ -0,0 +1,81 @@
+import numpy as np
+
+from animation import transform_matrix
+from flat_bvh import FlatBVH
+from flat_scene import FlatScene
+from instance import Instance
+from materials import Lambertian
+from mesh import Mesh
+from ray import Ray, RayBatch
+
+MATERIAL = Lambertian(np.array([0.5, 0.5, 0.5], dtype=np.float32))
+
+
+def grid_mesh(resolution: int) -> Mesh:
+    coordinates = np.linspace(-1.0, 1.0, resolution + 1)
+    x, z = np.meshgrid(coordinates, coordinates)
+    vertices = np.stack((x, 0.2 * np.sin(3.0 * x) * np.cos(2.0 * z), z), axis=-1).reshape(-1, 3)
+    row, column = np.mgrid[0:resolution, 0:resolution]
+    corner = (row * (resolution + 1) + column).ravel()
+    below = corner + resolution + 1
+    indices = np.concatenate((np.stack((corner, below, corner + 1), axis=1),
+                              np.stack((corner + 1, below, below + 1), axis=1)))
+    return Mesh(vertices, indices, MATERIAL)
+
+
+def placements(rng: np.random.Generator, count: int) -> list[np.ndarray]:
+    return [transform_matrix(translate=rng.uniform(-2.0, 2.0, 3), rotate_degrees=rng.uniform(0.0, 360.0, 3),
+                             scale=float(rng.uniform(0.3, 1.0)))
+            for _ in range(count)]
+
+
+def transformed_mesh(mesh: Mesh, matrix: np.ndarray) -> Mesh:
+    return Mesh(mesh.vertices @ matrix[:3, :3].T + matrix[:3, 3], mesh.indices, mesh.material)
+
+
+def random_rays(rng: np.random.Generator, count: int = 3000) -> RayBatch:
+    origins = rng.normal(size=(count, 3))
+    origins *= 5.0 / np.linalg.norm(origins, axis=1, keepdims=True)
+    return RayBatch(origins, rng.uniform(-2.0, 2.0, (count, 3)) - origins, np.zeros(count))
+
+
+def test_instances_hit_like_copies_of_the_mesh():
+    mesh = grid_mesh(6)
+    matrices = placements(np.random.default_rng(0), 12)
+    instanced = FlatScene(FlatBVH([Instance(mesh, matrix) for matrix in matrices]))
+    copied = FlatScene(FlatBVH([transformed_mesh(mesh, matrix) for matrix in matrices]))
+    #one shared copy of the triangles however many instances there are
+    assert len(instanced.instanced_v0) == len(mesh.indices)
+
+    rays = random_rays(np.random.default_rng(1))
+    hit_mask, hit_records = instanced.intersect(rays, 1e-3, float('inf'), backend='numpy')
+    expected_mask, expected_records = copied.intersect(rays, 1e-3, float('inf'), backend='numpy')
+    assert hit_mask.sum() > len(rays) // 10
+    #rays grazing an edge may fall either side of it in the two spaces
+    assert (hit_mask != expected_mask).sum() <= 2
+    both = (hit_mask & expected_mask)[hit_mask]
+    expected_both = (hit_mask & expected_mask)[expected_mask]
+    np.testing.assert_allclose(hit_records.time[both], expected_records.time[expected_both], rtol=1e-4)
+    np.testing.assert_allclose(hit_records.normal[both], expected_records.normal[expected_both], atol=1e-3)
+
+
+def test_scalar_instance_hits_match_the_copied_mesh():
+    mesh = grid_mesh(4)
+    matrix = transform_matrix(translate=(0.5, 0.2, -0.3), rotate_degrees=(30.0, 60.0, 10.0), scale=0.7)
+    instance = Instance(mesh, matrix)
+    copy = transformed_mesh(mesh, matrix)
+    box = instance.bounding_box()
+    assert (copy.vertices >= box.minimum_vertice - 1e-5).all() and (copy.vertices <= box.maximum_vertice + 1e-5).all()
+
+    rng = np.random.default_rng(2)
+    hits = 0
+    for origin, target in zip(rng.normal(0.0, 3.0, (300, 3)), rng.uniform(-0.3, 0.3, (300, 3)) + matrix[:3, 3]):
+        ray = Ray(origin, target - origin, 0.0)
+        hit = instance.hit(ray, 1e-3, float('inf'))
+        expected = copy.hit(ray, 1e-3, float('inf'))
+        if hit is None or expected is None:
+            continue
+        hits += 1
+        np.testing.assert_allclose(hit.time, expected.time, rtol=1e-4)
+        np.testing.assert_allclose(hit.normal, expected.normal, atol=1e-3)
+    assert hits > 100
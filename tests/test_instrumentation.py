@@ -0,0 +1,57 @@
+import numpy as np
+from PIL import Image
+
+from camera import Camera
+from flat_bvh import FlatBVH
+from flat_scene import FlatScene
+from instrumentation import Instrumentation, ProfilerHook
+from materials import Lambertian
+from render_settings import RenderSettings
+from sphere import Sphere
+from wavefront import render_image, tiles
+
+
+class RecordingHook(ProfilerHook):
+    def __init__(self):
+        self.started = []
+        self.ended = []
+        self.tiles = []
+
+    def start_stage(self, stage: str, tile: tuple[int, int, int, int]):
+        self.started.append((stage, tile))
+
+    def end_stage(self, stage: str, tile: tuple[int, int, int, int], seconds: float):
+        self.ended.append((stage, tile))
+
+    def end_tile(self, profile):
+        self.tiles.append(profile.tile)
+
+
+def test_instrumented_render_counts_every_path(tmp_path):
+    camera = Camera(np.array([0.0, 0.5, 3.0]), np.array([0.0, 0.0, 0.0]), np.array([0.0, 1.0, 0.0]), 40.0, 1.5)
+    material = Lambertian(np.array([0.5, 0.5, 0.5], dtype=np.float32))
+    scene = FlatScene(FlatBVH([Sphere(np.array([0.0, -100.5, 0.0], dtype=np.float32), 100.0, material),
+                               Sphere(np.array([0.0, 0.0, 0.0], dtype=np.float32), 0.5, material)]))
+    settings = RenderSettings(24, 16, 3, tile_size=8)
+    hook = RecordingHook()
+    instrumentation = Instrumentation(settings, [hook])
+    image, _ = render_image(camera, scene, settings, seed=1, max_workers=1, instrumentation=instrumentation)
+
+    #profiling only watches, the image is the one rendered without it
+    expected_image, _ = render_image(camera, scene, settings, seed=1, max_workers=1)
+    np.testing.assert_array_equal(image, expected_image)
+
+    assert sorted(hook.tiles) == sorted(tiles(settings))
+    assert sorted(hook.started) == sorted(hook.ended)
+    assert ('tile', (0, 8, 0, 8)) in hook.started
+    assert sum(instrumentation.path_lengths.values()) == 24 * 16 * 3
+    summary = instrumentation.summary()
+    assert summary['tiles']['count'] == len(tiles(settings))
+    assert summary['counters']['rays'] >= 24 * 16 * 3
+    #every pixel below the horizon crossed the scene's bvh
+    assert (instrumentation.heatmaps['cost'][8:] > 0).all()
+
+    instrumentation.write_heatmap(str(tmp_path / 'cost.png'))
+    with Image.open(tmp_path / 'cost.png') as heatmap:
+        assert heatmap.size == (24, 16)
+        assert heatmap.mode == 'RGB'
@@ -0,0 +1,92 @@
+import numpy as np
+
+from flat_bvh import FlatBVH
+from flat_scene import FlatScene
+from materials import Lambertian
+from mesh import Mesh
+from ray import Ray, RayBatch
+from triangle import Triangle, hit_triangles
+
+MATERIAL = Lambertian(np.array([0.5, 0.5, 0.5], dtype=np.float32))
+
+
+def bumpy_mesh(resolution: int) -> Mesh:
+    #a height field with smooth normals and texture coordinates at every vertex
+    coordinates = np.linspace(-1.0, 1.0, resolution + 1)
+    x, z = np.meshgrid(coordinates, coordinates)
+    height = 0.3 * np.sin(3.0 * x) * np.cos(2.0 * z)
+    vertices = np.stack((x, height, z), axis=-1).reshape(-1, 3)
+    normals = np.stack((-0.9 * np.cos(3.0 * x) * np.cos(2.0 * z), np.ones_like(x),
+                        0.6 * np.sin(3.0 * x) * np.sin(2.0 * z)), axis=-1).reshape(-1, 3)
+    texture_coordinates = np.stack((0.5 * (x + 1.0), 0.5 * (z + 1.0)), axis=-1).reshape(-1, 2)
+    row, column = np.mgrid[0:resolution, 0:resolution]
+    corner = (row * (resolution + 1) + column).ravel()
+    below = corner + resolution + 1
+    indices = np.concatenate((np.stack((corner, below, corner + 1), axis=1),
+                              np.stack((corner + 1, below, below + 1), axis=1)))
+    return Mesh(vertices, indices, MATERIAL, normals, texture_coordinates)
+
+
+def face_triangles(mesh: Mesh) -> list[Triangle]:
+    return [Triangle(*mesh.vertices[face], MATERIAL, *mesh.texture_coordinates[face], *mesh.normals[face])
+            for face in mesh.indices]
+
+
+def random_rays(rng: np.random.Generator, count: int) -> RayBatch:
+    origins = rng.normal(size=(count, 3))
+    origins *= 4.0 / np.linalg.norm(origins, axis=1, keepdims=True)
+    return RayBatch(origins, rng.uniform(-1.0, 1.0, (count, 3)) * [1.0, 0.3, 1.0] - origins, np.zeros(count))
+
+
+def test_leaf_test_matches_one_triangle_at_a_time():
+    rng = np.random.default_rng(0)
+    triangle = Triangle(*rng.uniform(-1.0, 1.0, (3, 3)), MATERIAL)
+    rays = random_rays(rng, 400)
+    times, u, v = hit_triangles(rays.origins, rays.directions, triangle.v0, triangle.e1, triangle.e2, triangle.normal,
+                                1e-3, float('inf'))
+    hit_count = 0
+    for i in range(len(rays)):
+        hit = triangle.hit(Ray(rays.origins[i], rays.directions[i], 0.0), 1e-3, float('inf'))
+        if hit is None:
+            assert times[i] == np.inf
+            continue
+        hit_count += 1
+        np.testing.assert_allclose((times[i], u[i], v[i]), (hit.time, hit.u, hit.v), rtol=1e-12)
+    assert hit_count > 10
+
+
+def test_mesh_hits_like_separate_triangles():
+    mesh = bumpy_mesh(6)
+    triangles = face_triangles(mesh)
+    rays = random_rays(np.random.default_rng(1), 300)
+    hit_count = 0
+    for origin, direction in zip(rays.origins, rays.directions):
+        ray = Ray(origin, direction, 0.0)
+        hit = mesh.hit(ray, 1e-3, float('inf'))
+        triangle_hits = [hit for hit in (triangle.hit(ray, 1e-3, float('inf')) for triangle in triangles) if hit]
+        if not triangle_hits:
+            assert hit is None
+            continue
+        hit_count += 1
+        expected = min(triangle_hits, key=lambda hit: hit.time)
+        np.testing.assert_allclose(hit.time, expected.time, rtol=1e-6)
+        np.testing.assert_allclose(hit.normal, expected.normal, atol=1e-5)
+        assert hit.front_face == expected.front_face
+        np.testing.assert_allclose(hit.texture_coordinates, expected.texture_coordinates, atol=1e-5)
+    assert hit_count > 100
+
+
+def test_flat_scene_shades_mesh_hits_like_the_mesh():
+    mesh = bumpy_mesh(10)
+    scene = FlatScene(FlatBVH([mesh]))
+    rays = random_rays(np.random.default_rng(2), 500)
+    hit_mask, hit_records = scene.intersect(rays, 1e-3, float('inf'), backend='numpy')
+    assert hit_mask.sum() > 200
+    for record_index, ray_index in enumerate(np.flatnonzero(hit_mask)):
+        hit = mesh.hit(Ray(rays.origins[ray_index], rays.directions[ray_index], 0.0), 1e-3, float('inf'))
+        np.testing.assert_allclose(hit_records.time[record_index], hit.time, rtol=1e-6)
+        np.testing.assert_allclose(hit_records.point[record_index], hit.point, atol=1e-6)
+        np.testing.assert_allclose(hit_records.normal[record_index], hit.normal, atol=1e-5)
+        assert hit_records.front_face[record_index] == hit.front_face
+        assert hit_records.has_texture_coordinates[record_index]
+        np.testing.assert_allclose(hit_records.texture_coordinates[record_index], hit.texture_coordinates, atol=1e-5)
@@ -0,0 +1,35 @@
+import numpy as np
+
+from obj_loader import parse_obj
+
+MIXED_FACES = '''v 0 0 0
+v 1 0 0
+v 1 1 0
+v 0 1 0
+vt 0 0
+vt 1 0
+vt 1 1
+vn 0 0 1
+f 1 2 3
+f 1/1/1 3/3/1 4/2/1
+f 2//1 3//1 4//1
+f 1/1 2/2 4/3
+'''
+
+
+def test_mixed_face_formats(tmp_path):
+    path = tmp_path / 'mixed.obj'
+    path.write_text(MIXED_FACES)
+    geometry = parse_obj(str(path))
+    #not every corner has a texture coordinate or normal, so only the positions are kept
+    assert set(geometry) == {'vertices', 'indices'}
+    np.testing.assert_array_equal(geometry['indices'], [[0, 1, 2], [0, 2, 3], [1, 2, 3], [0, 1, 3]])
+
+
+def test_uniform_faces_keep_their_attributes(tmp_path):
+    path = tmp_path / 'quad.obj'
+    path.write_text(MIXED_FACES.split('f ')[0] + 'f 1/1/1 2/2/1 3/3/1 4/2/1\n')
+    geometry = parse_obj(str(path))
+    assert len(geometry['indices']) == 2
+    assert geometry['texture_coordinates'].shape == (4, 2)
+    np.testing.assert_array_equal(geometry['normals'], np.tile([0.0, 0.0, 1.0], (4, 1)))
@@ -0,0 +1,38 @@
+import numpy as np
+
+from camera import Camera
+from flat_bvh import FlatBVH
+from flat_scene import FlatScene
+from instrumentation import Instrumentation
+from materials import Dielectric, Lambertian, Metal
+from process_renderer import render_image_in_processes
+from render_settings import RenderSettings
+from sphere import Sphere
+from wavefront import render_image
+
+
+def small_scene() -> tuple[Camera, FlatScene]:
+    camera = Camera(np.array([0.0, 1.0, 4.0]), np.array([0.0, 0.5, 0.0]), np.array([0.0, 1.0, 0.0]), 40.0, 1.5)
+    objects = [Sphere(np.array([0.0, -100.0, 0.0], dtype=np.float32), 100.0,
+                      Lambertian(np.array([0.5, 0.6, 0.5], dtype=np.float32))),
+               Sphere(np.array([-1.0, 0.5, 0.0], dtype=np.float32), 0.5, Dielectric(1.5)),
+               Sphere(np.array([1.0, 0.5, 0.0], dtype=np.float32), 0.5,
+                      Metal(np.array([0.8, 0.7, 0.6], dtype=np.float32), 0.1))]
+    return camera, FlatScene(FlatBVH(objects))
+
+
+def test_processes_render_the_same_image_as_threads():
+    #every pixel draws from its own streams, so neither the workers nor how the tiles are split change the image
+    camera, scene = small_scene()
+    settings = RenderSettings(24, 16, 4, tile_size=8, min_tile_size=4)
+    expected_instrumentation = Instrumentation(settings)
+    expected_image, expected_counts = render_image(camera, scene, settings, seed=5, max_workers=1,
+                                                   instrumentation=expected_instrumentation)
+    instrumentation = Instrumentation(settings)
+    image, sample_counts = render_image_in_processes(camera, scene, settings, seed=5, max_workers=2,
+                                                     instrumentation=instrumentation)
+    np.testing.assert_array_equal(sample_counts, expected_counts)
+    np.testing.assert_allclose(image, expected_image, rtol=1e-6, atol=1e-6)
+    #the profiles come back from the workers filled in
+    assert instrumentation.path_lengths == expected_instrumentation.path_lengths
+    np.testing.assert_array_equal(instrumentation.heatmaps['cost'], expected_instrumentation.heatmaps['cost'])
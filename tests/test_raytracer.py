@@ -0,0 +1,23 @@
+import numpy as np
+
+import raytracer
+from camera import Camera
+from flat_bvh import FlatBVH
+from materials import Lambertian
+from sampler import sampler_key
+from sphere import Sphere
+
+
+def test_render_scanline_passes_russian_roulette_depth(monkeypatch):
+    depths = []
+
+    def recording_ray_color(ray, world, max_depth, russian_roulette_depth, rng=None):
+        depths.append((max_depth, russian_roulette_depth))
+        return np.zeros(3, dtype=np.float32)
+
+    monkeypatch.setattr(raytracer, 'ray_color', recording_ray_color)
+    camera = Camera(np.array([0.0, 0.0, 0.0]), np.array([0.0, 0.0, -1.0]), np.array([0.0, 1.0, 0.0]), 90.0, 1.0)
+    world = FlatBVH([Sphere(np.array([0.0, 0.0, -1.0], dtype=np.float32), 0.5,
+                            Lambertian(np.array([0.5, 0.5, 0.5], dtype=np.float32)))])
+    raytracer.render_scanline(0, 2, 2, 2, camera, world, max_depth=6, russian_roulette_depth=1, key=sampler_key(0))
+    assert depths == [(6, 1)] * 4
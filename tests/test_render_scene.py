@@ -0,0 +1,41 @@
+import json
+import os
+import shutil
+import numpy as np
+from PIL import Image
+
+from image_io import read_pfm
+from render_scene import main
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_cli_renders_a_scene_file(tmp_path):
+    scene_path = str(tmp_path / 'animated.json')
+    shutil.copy(os.path.join(REPOSITORY_DIRECTORY, 'scenes', 'animated.json'), scene_path)
+    main([scene_path, '-o', str(tmp_path / 'render.png'), '--hdr', str(tmp_path / 'render.pfm'),
+          '--width', '12', '--height', '8', '--samples', '2', '--seed', '1', '--threads', '--workers', '1',
+          '--tile-timings', str(tmp_path / 'tiles.json')])
+    with Image.open(tmp_path / 'render.png') as image:
+        assert image.size == (12, 8)
+    radiance = read_pfm(str(tmp_path / 'render.pfm'))
+    assert radiance.shape == (8, 12, 3) and radiance.max() > 0.0
+    timings = json.loads((tmp_path / 'tiles.json').read_text())
+    assert timings['summary']['count'] == len(timings['tiles']) == 1
+
+    #the same seed renders the same image again, this time from the compiled scene
+    main([scene_path, '-o', str(tmp_path / 'again.pfm'), '--width', '12', '--height', '8', '--samples', '2',
+          '--seed', '1', '--threads', '--workers', '1'])
+    np.testing.assert_array_equal(read_pfm(str(tmp_path / 'again.pfm')), radiance)
+
+
+def test_cli_renders_animation_frames(tmp_path):
+    scene_path = str(tmp_path / 'animated.json')
+    with open(os.path.join(REPOSITORY_DIRECTORY, 'scenes', 'animated.json')) as file:
+        description = json.load(file)
+    description['animation']['frames'] = 2
+    with open(scene_path, 'w') as file:
+        json.dump(description, file)
+    main([scene_path, '--animation', '-o', str(tmp_path / 'frame.png'), '--width', '8', '--height', '6',
+          '--samples', '1', '--threads', '--workers', '1'])
+    assert sorted(os.listdir(tmp_path)) == ['.scene_cache', 'animated.json', 'frame_0000.png', 'frame_0001.png']
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+import sampler
+from sampler import STREAM_CAMERA, STREAM_SCATTER, PathSampler, philox, resolve_seed, sampler_key
+
+
+def test_philox_matches_the_reference_vectors():
+    #known answers of philox 4x32-10 from the random123 distribution
+    zeros = philox((np.uint64(0),) * 4, np.array([0, 0], dtype=np.uint32))
+    np.testing.assert_array_equal(zeros, [0x6627e8d5, 0xe169c58d, 0xbc57ac4c, 0x9b00dbd8])
+    ones = philox((np.uint64(0xFFFFFFFF),) * 4, np.array([0xFFFFFFFF, 0xFFFFFFFF], dtype=np.uint32))
+    np.testing.assert_array_equal(ones, [0x408f276d, 0x41c83b0e, 0xa20bc7c6, 0x6d5451fd])
+
+
+def test_compiled_and_numpy_philox_agree(monkeypatch):
+    rng = np.random.default_rng(0)
+    counter = tuple(rng.integers(0, 2 ** 32, 500, dtype=np.uint64) for _ in range(4))
+    key = sampler_key(1)
+    bits = philox(counter, key)
+    monkeypatch.setattr(sampler, 'numba', None)
+    np.testing.assert_array_equal(philox(counter, key), bits)
+
+
+def test_paths_draw_the_same_numbers_in_any_batch():
+    key = sampler_key(2)
+    pixels = np.arange(40)
+    samples = np.arange(40) % 3
+    numbers = PathSampler(key, pixels, samples).stream(1, STREAM_SCATTER).random((40, 7))
+    assert 0.0 <= numbers.min() and numbers.max() < 1.0
+    #a reversed batch, a subset and dimensions drawn a few at a time all see the same stream
+    order = np.arange(40)[::-1]
+    reversed_paths = PathSampler(key, pixels[order], samples[order]).stream(1, STREAM_SCATTER)
+    np.testing.assert_array_equal(reversed_paths.random((40, 7)), numbers[order])
+    paths = PathSampler(key, pixels, samples).stream(1, STREAM_SCATTER)
+    first = paths.random((40, 3))
+    rest = paths.subset(slice(10, 20)).random((10, 4))
+    np.testing.assert_array_equal(first, numbers[:, :3])
+    np.testing.assert_array_equal(rest, numbers[10:20, 3:])
+
+
+def test_streams_keys_and_samples_are_independent():
+    pixels = np.arange(1000)
+    draws = [PathSampler(sampler_key(3), pixels, np.zeros(1000)).stream(0, STREAM_CAMERA).random(),
+             PathSampler(sampler_key(3), pixels, np.zeros(1000)).stream(0, STREAM_SCATTER).random(),
+             PathSampler(sampler_key(3), pixels, np.ones(1000)).stream(0, STREAM_CAMERA).random(),
+             PathSampler(sampler_key(4), pixels, np.zeros(1000)).stream(0, STREAM_CAMERA).random()]
+    correlations = np.corrcoef(draws)
+    assert np.abs(correlations[np.triu_indices(4, 1)]).max() < 0.1
+    assert abs(draws[0].mean() - 0.5) < 0.03
+    with pytest.raises(ValueError):
+        PathSampler(sampler_key(3), pixels, np.zeros(1000)).random(10)
+
+
+def test_resolved_seeds_key_the_same_streams():
+    np.testing.assert_array_equal(sampler_key(resolve_seed(7)), sampler_key(7))
+    #fresh entropy each time, but one resolved seed always gives the same key
+    seed = resolve_seed(None)
+    assert seed != resolve_seed(None)
+    np.testing.assert_array_equal(sampler_key(seed), np.random.SeedSequence(seed).generate_state(2, np.uint32))
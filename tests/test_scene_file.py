@@ -0,0 +1,89 @@
+import json
+import os
+import pickle
+import shutil
+import numpy as np
+import pytest
+
+import scene_file
+from scene_file import SCENE_CACHE_DIRECTORY, compiled_scene_path, load_scene, read_scene_description, scene_key
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_source_digest_follows_the_sources(tmp_path, monkeypatch):
+    (tmp_path / 'flat_scene.py').write_text('class FlatScene:\n    pass\n')
+    monkeypatch.setattr(scene_file, 'RENDERER_DIRECTORY', str(tmp_path))
+    scene_file.renderer_source_digest.cache_clear()
+    try:
+        before = scene_file.renderer_source_digest()
+        (tmp_path / 'flat_scene.py').write_text('class FlatScene:\n    light_count = 0\n')
+        scene_file.renderer_source_digest.cache_clear()
+        assert scene_file.renderer_source_digest() != before
+    finally:
+        scene_file.renderer_source_digest.cache_clear()
+
+
+def test_cache_from_an_older_layout_is_rebuilt(tmp_path, monkeypatch):
+    scene_path = str(tmp_path / 'animated.json')
+    shutil.copy(os.path.join(REPOSITORY_DIRECTORY, 'scenes', 'animated.json'), scene_path)
+    description = read_scene_description(scene_path)
+
+    #a cache written by older sources, from before FlatScene had a light list
+    monkeypatch.setattr(scene_file, 'renderer_source_digest', lambda: 'older sources')
+    _, older_scene, _ = load_scene(scene_path)
+    for name in ('light_primitives', 'light_count', 'light_selection_probability', 'light_emission', 'light_cdf'):
+        delattr(older_scene, name)
+    with open(compiled_scene_path(scene_path, scene_key(description, str(tmp_path))), 'wb') as file:
+        pickle.dump(older_scene, file)
+    monkeypatch.undo()
+
+    _, scene, _ = load_scene(scene_path)
+    assert scene.light_count == len(scene.light_primitives)
+    assert len(os.listdir(tmp_path / SCENE_CACHE_DIRECTORY)) == 2
+
+
+def test_compiled_scene_is_reused_until_its_geometry_changes(tmp_path, monkeypatch):
+    scene_path = tmp_path / 'animated.json'
+    shutil.copy(os.path.join(REPOSITORY_DIRECTORY, 'scenes', 'animated.json'), scene_path)
+    camera, scene, settings = load_scene(str(scene_path), settings_overrides={'width': 32, 'samples_per_pixel': 2})
+    assert (settings.width, settings.height, settings.samples_per_pixel) == (32, 180, 2)
+    np.testing.assert_allclose(camera.origin, [0.0, 1.0, 3.0])
+    assert len(scene.sphere_radius) == 3 and scene.light_count == 1
+
+    def no_build(description, base_directory):
+        raise AssertionError('the compiled scene should have been loaded')
+
+    #render settings and the camera are not part of the compiled scene
+    description = json.loads(scene_path.read_text())
+    description['render']['width'] = 64
+    description['camera']['vertical_fov_degrees'] = 30.0
+    scene_path.write_text(json.dumps(description))
+    monkeypatch.setattr(scene_file, 'build_world', no_build)
+    _, cached_scene, _ = load_scene(str(scene_path))
+    np.testing.assert_array_equal(cached_scene.sphere_radius, scene.sphere_radius)
+    monkeypatch.undo()
+
+    description['materials']['red']['color'] = [0.2, 0.8, 0.2]
+    scene_path.write_text(json.dumps(description))
+    _, recolored_scene, _ = load_scene(str(scene_path))
+    assert len(os.listdir(tmp_path / SCENE_CACHE_DIRECTORY)) == 2
+    _, uncached_scene, _ = load_scene(str(scene_path), use_cache=False)
+    assert len(os.listdir(tmp_path / SCENE_CACHE_DIRECTORY)) == 2
+    np.testing.assert_array_equal(uncached_scene.sphere_radius, recolored_scene.sphere_radius)
+
+
+def test_animation_keyframes_follow_object_ids(tmp_path):
+    scene_path = os.path.join(REPOSITORY_DIRECTORY, 'scenes', 'animated.json')
+    _, _, settings = load_scene(scene_path, use_cache=False)
+    animation = scene_file.load_animation(scene_path, settings)
+    assert animation.frame_count == 24
+    #the ball is the second object, it rises half way through
+    np.testing.assert_allclose(animation.transforms(12)[1][:3, 3], [0.0, 1.0, 0.0])
+    np.testing.assert_allclose(animation.camera_at(23).origin, [2.0, 1.5, 2.5])
+
+    description = read_scene_description(scene_path)
+    description['animation']['objects']['missing'] = [{'frame': 0}]
+    (tmp_path / 'broken.json').write_text(json.dumps(description))
+    with pytest.raises(ValueError):
+        scene_file.load_animation(str(tmp_path / 'broken.json'), settings)
@@ -0,0 +1,109 @@
+import os
+import pickle
+import numpy as np
+from PIL import Image
+
+from texture import MIP_CACHE_SUFFIX, ImageTexture, Perlin, PerlinNoiseTexture, build_mip_levels, mip_level_shapes
+
+
+def write_texture(path, rng: np.random.Generator, height: int = 16, width: int = 8) -> np.ndarray:
+    texels = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    Image.fromarray(texels).save(path)
+    return texels
+
+
+def test_mip_levels_average_the_level_above():
+    texels = np.random.default_rng(0).integers(0, 256, (8, 5, 3), dtype=np.uint8)
+    levels = build_mip_levels(texels)
+    assert [level.shape[:2] for level in levels] == mip_level_shapes(8, 5) == [(8, 5), (4, 2), (2, 1), (1, 1)]
+    assert all(level.dtype == np.uint8 for level in levels)
+    #the odd last column is dropped
+    expected = texels[:2, :2].reshape(-1, 3).astype(np.float32).mean(axis=0)
+    np.testing.assert_allclose(levels[1][0, 0], expected, atol=1.0)
+
+
+def test_batched_samples_match_scalar_samples(tmp_path):
+    rng = np.random.default_rng(1)
+    write_texture(tmp_path / 'texture.png', rng)
+    texture = ImageTexture(str(tmp_path / 'texture.png'))
+    x = rng.uniform(-0.1, 1.1, 200)
+    y = rng.uniform(-0.1, 1.1, 200)
+    points = np.zeros((200, 3))
+    expected = np.array([texture.sample(float(x[i]), float(y[i]), points[i]) for i in range(200)])
+    np.testing.assert_allclose(texture.sample_batch(x, y, points), expected, rtol=1e-6)
+    #a footprint of about one texel keeps the full resolution level
+    np.testing.assert_allclose(texture.sample_batch(x, y, points, np.full(200, 1.0 / 16.0)), expected, rtol=1e-6)
+
+
+def test_wide_footprints_sample_coarser_levels(tmp_path):
+    texels = write_texture(tmp_path / 'texture.png', np.random.default_rng(2))
+    texture = ImageTexture(str(tmp_path / 'texture.png'))
+    np.testing.assert_array_equal(texture.mip_levels(np.array([0.0, 1.0 / 16.0, 1.0 / 8.0, 1.0 / 2.0, 4.0])),
+                                  [0, 0, 1, 3, 4])
+    colors = texture.sample_batch(np.array([0.3]), np.array([0.7]), np.zeros((1, 3)), np.array([1.0]))
+    np.testing.assert_allclose(colors[0], texels.reshape(-1, 3).mean(axis=0) / 255.0, atol=2.0 / 255.0)
+
+
+def test_textures_of_one_file_share_their_levels(tmp_path):
+    write_texture(tmp_path / 'texture.png', np.random.default_rng(3))
+    first = ImageTexture(str(tmp_path / 'texture.png'))
+    second = ImageTexture(str(tmp_path / 'texture.png'))
+    assert all(first_level is second_level for first_level, second_level in zip(first.levels, second.levels))
+
+
+def test_memory_mapped_levels_come_from_the_cache_file(tmp_path):
+    path = str(tmp_path / 'texture.png')
+    write_texture(path, np.random.default_rng(4), 64, 64)
+    decoded = ImageTexture(path)
+    mapped = ImageTexture(path, memory_map=True)
+    assert os.path.exists(path + MIP_CACHE_SUFFIX)
+    for decoded_level, mapped_level in zip(decoded.levels, mapped.levels):
+        assert isinstance(mapped_level.base, np.memmap) or isinstance(mapped_level, np.memmap)
+        np.testing.assert_array_equal(mapped_level, decoded_level)
+    #pickles, like the ones sent to worker processes, carry the file name instead of the texels
+    state = pickle.dumps(mapped)
+    assert len(state) < decoded.levels[0].nbytes
+    np.testing.assert_array_equal(pickle.loads(state).levels[0], decoded.levels[0])
+
+
+def noise_points(rng: np.random.Generator, count: int = 500) -> np.ndarray:
+    #negative coordinates and ones past the 256 cell lattice wrap around
+    return rng.uniform(-300.0, 300.0, (count, 3))
+
+
+def test_batched_noise_matches_scalar_noise():
+    points = noise_points(np.random.default_rng(5))
+    for lattice_cache in (False, True):
+        perlin = Perlin(lattice_cache=lattice_cache)
+        np.testing.assert_array_equal(perlin.noise_batch(points), [perlin.noise(point) for point in points])
+        np.testing.assert_array_equal(perlin.turbulence_batch(points, 7),
+                                      [perlin.turbulence(point, 7) for point in points])
+    texture = PerlinNoiseTexture(scale=4.0, base_color=np.array([0.9, 0.6, 0.3], dtype=np.float32))
+    expected = [texture.sample(0.0, 0.0, point) for point in points]
+    np.testing.assert_allclose(texture.sample_batch(np.zeros(500), np.zeros(500), points), expected, rtol=1e-5)
+
+
+def test_smooth_noise_passes_through_the_lattice():
+    rng = np.random.default_rng(6)
+    corners = np.floor(noise_points(rng))
+    nearest = Perlin().noise_batch(corners)
+    np.testing.assert_allclose(Perlin(interpolation='trilinear').noise_batch(corners), nearest)
+    #gradient noise is zero on the lattice and continuous between cells
+    gradient = Perlin(interpolation='gradient')
+    np.testing.assert_allclose(gradient.noise_batch(corners), 0.0, atol=1e-12)
+    steps = rng.normal(size=(500, 3)) * 1e-6
+    points = noise_points(rng)
+    assert np.abs(gradient.noise_batch(points + steps) - gradient.noise_batch(points)).max() < 1e-4
+    assert gradient.noise(points[0]) == gradient.noise_batch(points[:1])[0]
+
+
+def test_noise_tables_follow_the_seed():
+    points = noise_points(np.random.default_rng(7))
+    np.testing.assert_array_equal(Perlin(seed=3).noise_batch(points), Perlin(seed=3).noise_batch(points))
+    assert not np.array_equal(Perlin(seed=3).noise_batch(points), Perlin(seed=4).noise_batch(points))
+    perlin = Perlin(lattice_cache=True)
+    expected = perlin.noise_batch(points)
+    #the cached lattice is left out of pickles and rebuilt on the other side
+    copy = pickle.loads(pickle.dumps(perlin))
+    assert copy._lattice is None
+    np.testing.assert_array_equal(copy.noise_batch(points), expected)
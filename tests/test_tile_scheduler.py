@@ -0,0 +1,78 @@
+import numpy as np
+
+from camera import Camera
+from flat_bvh import FlatBVH
+from flat_scene import FlatScene
+from materials import Lambertian
+from render_settings import RenderSettings
+from sphere import Sphere
+from tile_scheduler import TileScheduler, morton_codes, schedule_order, split_tile
+from wavefront import tile_costs, tiles
+
+
+def dealt_tiles(scheduler: TileScheduler) -> list[tuple[int, int, int, int]]:
+    dealt = []
+    while (tile := scheduler.next_tile()) is not None:
+        dealt.append(tile)
+    return dealt
+
+
+def coverage(tile_list: list[tuple[int, int, int, int]], settings: RenderSettings) -> np.ndarray:
+    covered = np.zeros((settings.height, settings.width), dtype=np.int32)
+    for row_start, row_end, column_start, column_end in tile_list:
+        covered[row_start:row_end, column_start:column_end] += 1
+    return covered
+
+
+def test_morton_order_walks_quadrant_by_quadrant():
+    tile_list = tiles(RenderSettings(64, 64, 1, tile_size=16))
+    order = [tile_list[index][:3:2] for index in schedule_order(tile_list, 16)]
+    assert order[:4] == [(0, 0), (0, 16), (16, 0), (16, 16)]
+    assert order[4:8] == [(0, 32), (0, 48), (16, 32), (16, 48)]
+    assert len(set(morton_codes(tile_list, 16).tolist())) == len(tile_list)
+
+
+def test_costs_put_the_hardest_tiles_first():
+    tile_list = tiles(RenderSettings(64, 32, 1, tile_size=16))
+    costs = np.array([1.0, 5.0, 1.0, 2.0, 1.0, 5.0, 1.0, 1.0])
+    order = schedule_order(tile_list, 16, costs)
+    assert order[:3] == [1, 5, 3]
+    #equal costs keep morton order
+    assert order[3:] == [index for index in schedule_order(tile_list, 16) if costs[index] == 1.0]
+
+
+def test_split_tile_down_to_the_minimum():
+    assert split_tile((0, 16, 0, 16), 8) == [(0, 8, 0, 8), (0, 8, 8, 16), (8, 16, 0, 8), (8, 16, 8, 16)]
+    assert split_tile((0, 16, 0, 12), 8) == [(0, 8, 0, 12), (8, 16, 0, 12)]
+    assert split_tile((0, 15, 0, 15), 8) == [(0, 15, 0, 15)]
+
+
+def test_scheduler_deals_every_pixel_once():
+    settings = RenderSettings(70, 45, 1, tile_size=32, min_tile_size=8)
+    tile_list = tiles(settings)
+    single = dealt_tiles(TileScheduler(tile_list, settings.tile_size))
+    assert sorted(single) == sorted(tile_list)
+    #with more workers than tiles left, the last tiles are split so every worker has something
+    dealt = dealt_tiles(TileScheduler(tile_list, settings.tile_size, worker_count=4, min_tile_size=8))
+    assert len(dealt) > len(tile_list)
+    assert (coverage(dealt, settings) == 1).all()
+    assert min(min(tile[1] - tile[0], tile[3] - tile[2]) for tile in dealt) >= 5
+
+
+def test_prepass_finds_the_expensive_tiles():
+    #a cluster of small spheres on the right, empty sky on the left
+    material = Lambertian(np.array([0.5, 0.5, 0.5], dtype=np.float32))
+    rng = np.random.default_rng(0)
+    objects = [Sphere(np.array([rng.uniform(0.5, 5.0), rng.uniform(-1.5, 1.5), rng.uniform(-1.0, 0.0)],
+                               dtype=np.float32), 0.1, material) for _ in range(200)]
+    camera = Camera(np.array([0.0, 0.0, 4.0]), np.array([0.0, 0.0, 0.0]), np.array([0.0, 1.0, 0.0]), 60.0, 2.0)
+    scene = FlatScene(FlatBVH(objects))
+    settings = RenderSettings(64, 32, 1, tile_size=16)
+    tile_list = tiles(settings)
+    costs = tile_costs(camera, scene, settings, tile_list, 2)
+    left = [index for index, tile in enumerate(tile_list) if tile[3] <= 16]
+    right = [index for index, tile in enumerate(tile_list) if tile[2] >= 48]
+    assert costs[right].min() > costs[left].max()
+    assert tile_costs(camera, scene, settings, tile_list, len(tile_list)) is None
+    assert tile_costs(camera, scene, RenderSettings(64, 32, 1, tile_size=16, tile_cost_prepass=False),
+                      tile_list, 2) is None
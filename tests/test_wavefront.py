@@ -0,0 +1,87 @@
+import dataclasses
+import numpy as np
+
+import wavefront
+from camera import Camera
+from flat_bvh import FlatBVH
+from flat_scene import FlatScene
+from materials import Dielectric, Emissive, Lambertian, Metal
+from moving_sphere import MovingSphere
+from raytracer import render_scanline
+from render_settings import RenderSettings
+from sampler import sampler_key
+from sphere import Sphere
+from wavefront import render_image, render_tile
+
+GREY = Lambertian(np.array([0.7, 0.7, 0.7], dtype=np.float32))
+
+
+def test_moving_light_is_sampled_at_the_path_time():
+    #a light sweeping from left to right over the floor during the shutter lights both halves the same
+    camera = Camera(np.array([0.0, 3.0, 0.0]), np.array([0.0, 0.0, 0.0]), np.array([0.0, 0.0, -1.0]), 60.0, 1.0,
+                    shutter_open_time=0.0, shutter_close_time=1.0)
+    light = MovingSphere(np.array([-2.0, 0.6, 0.0]), np.array([2.0, 0.6, 0.0]), 0.0, 1.0, 0.3,
+                         Emissive(np.array([8.0, 8.0, 8.0], dtype=np.float32)))
+    scene = FlatScene(FlatBVH([Sphere(np.array([0.0, -100.0, 0.0], dtype=np.float32), 100.0, GREY), light]))
+
+    images = {}
+    for next_event_estimation in (True, False):
+        settings = RenderSettings(12, 12, 256, max_depth=3, next_event_estimation=next_event_estimation)
+        images[next_event_estimation], _ = render_image(camera, scene, settings, seed=0, max_workers=1)
+    for image in images.values():
+        assert abs(image[:, :6].mean() - image[:, 6:].mean()) < 0.03
+    #light sampling and bounces that reach the light estimate the same image
+    assert abs(images[True].mean() - images[False].mean()) < 0.02
+
+
+def test_denoiser_guides_use_the_render_seed(monkeypatch):
+    #with no seed given the guide pass must still follow the camera streams the render drew
+    camera = Camera(np.array([0.0, 1.0, 3.0]), np.array([0.0, 0.0, 0.0]), np.array([0.0, 1.0, 0.0]), 40.0, 1.0)
+    scene = FlatScene(FlatBVH([Sphere(np.array([0.0, 0.0, 0.0], dtype=np.float32), 1.0, GREY)]))
+    keyed_seeds = []
+    guide_seeds = []
+    monkeypatch.setattr(wavefront, 'sampler_key', lambda seed: keyed_seeds.append(seed) or sampler_key(seed))
+    monkeypatch.setattr(wavefront, 'denoise_render',
+                        lambda image, camera, scene, settings, seed: guide_seeds.append(seed) or image)
+    render_image(camera, scene, RenderSettings(8, 8, 2, denoise=True), max_workers=1)
+    assert guide_seeds[0] is not None
+    assert guide_seeds == keyed_seeds[:1]
+
+
+def test_adaptive_sampling_stops_converged_pixels_early():
+    camera = Camera(np.array([0.0, 0.5, 3.0]), np.array([0.0, 0.0, 0.0]), np.array([0.0, 1.0, 0.0]), 40.0, 1.0)
+    scene = FlatScene(FlatBVH([Sphere(np.array([0.0, -100.5, 0.0], dtype=np.float32), 100.0, GREY),
+                               Sphere(np.array([0.0, 0.0, 0.0], dtype=np.float32), 0.5, GREY)]))
+    settings = RenderSettings(12, 12, 32, min_samples_per_pixel=4, adaptive_tolerance=0.05)
+    key = sampler_key(9)
+    fixed_sum, fixed_counts = render_tile(0, 12, 0, 12, camera, scene, settings, key)
+    adaptive_settings = dataclasses.replace(settings, adaptive_sampling=True)
+    color_sum, sample_counts = render_tile(0, 12, 0, 12, camera, scene, adaptive_settings, key)
+
+    assert (fixed_counts == 32).all()
+    #the sky converges on its first samples while the lit floor and sphere keep sampling
+    assert sample_counts[0].max() == 4
+    assert sample_counts.max() == 32
+    assert 4 <= sample_counts.min() and sample_counts.sum() < fixed_counts.sum()
+    #a pixel's samples come from the same streams however many it takes, so pixels that ran to the end match
+    finished = sample_counts == 32
+    np.testing.assert_allclose(color_sum[finished], fixed_sum[finished], rtol=1e-5)
+
+
+def test_wavefront_converges_to_the_scalar_render():
+    #both estimate the same image, with the emissive sphere lit only by paths that reach it
+    camera = Camera(np.array([0.0, 1.0, 4.0]), np.array([0.0, 0.5, 0.0]), np.array([0.0, 1.0, 0.0]), 40.0, 1.0)
+    objects = [Sphere(np.array([0.0, -100.0, 0.0], dtype=np.float32), 100.0, GREY),
+               Sphere(np.array([-0.6, 0.5, 0.0], dtype=np.float32), 0.5, Dielectric(1.5)),
+               Sphere(np.array([0.6, 0.5, 0.0], dtype=np.float32), 0.5,
+                      Metal(np.array([0.8, 0.6, 0.4], dtype=np.float32), 0.3)),
+               Sphere(np.array([0.0, 1.5, -1.0], dtype=np.float32), 0.3,
+                      Emissive(np.array([4.0, 4.0, 4.0], dtype=np.float32)))]
+    world = FlatBVH(objects)
+    settings = RenderSettings(8, 8, 48, max_depth=4)
+    key = sampler_key(0)
+    rows = [render_scanline(y, 8, 8, 48, camera, world, 4, settings.russian_roulette_depth, key)[1] for y in range(8)]
+    scalar_image = np.array(rows[::-1])
+    image, _ = render_image(camera, FlatScene(world), settings, seed=1, max_workers=1)
+    np.testing.assert_allclose(image.mean(axis=(0, 1)), scalar_image.mean(axis=(0, 1)), rtol=0.03)
+    np.testing.assert_allclose(image.mean(axis=1), scalar_image.mean(axis=1), atol=0.08)
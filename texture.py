@@ -1,37 +1,191 @@
 import math
+import os
 from PIL import Image
 import numpy as np
 
+from ray import random_unit_vectors
+
 class Texture:
     def sample(self, x: float, y: float, point: np.ndarray) -> np.ndarray:
         raise NotImplementedError
 
+    def sample_batch(self,
+                     x: np.ndarray,
+                     y: np.ndarray,
+                     points: np.ndarray,
+                     footprints: np.ndarray | None = None) -> np.ndarray:
+        #footprints, when known, are how much of the texture one sample covers, textures without levels ignore them
+        colors = np.empty((len(x), 3), dtype=np.float32)
+        for i in range(len(x)):
+            colors[i] = self.sample(float(x[i]), float(y[i]), points[i])
+        return colors
+
+MIP_CACHE_SUFFIX = '.mips.npy'
+
+#every ImageTexture of the same file shares one set of levels
+_texture_levels: dict[tuple[str, bool], list[np.ndarray]] = {}
+
+
+def mip_level_shapes(height: int, width: int) -> list[tuple[int, int]]:
+    shapes = [(height, width)]
+    while shapes[-1] != (1, 1):
+        height, width = shapes[-1]
+        shapes.append((max(1, height // 2), max(1, width // 2)))
+    return shapes
+
+
+def build_mip_levels(texels: np.ndarray) -> list[np.ndarray]:
+    #every level averages 2x2 texels of the one above, an odd last row or column is dropped
+    levels = [texels]
+    while levels[-1].shape[:2] != (1, 1):
+        level = levels[-1].astype(np.float32)
+        height, width = level.shape[:2]
+        if height > 1:
+            level = 0.5 * (level[0:height // 2 * 2:2] + level[1:height // 2 * 2:2])
+        if width > 1:
+            level = 0.5 * (level[:, 0:width // 2 * 2:2] + level[:, 1:width // 2 * 2:2])
+        levels.append((level + 0.5).astype(np.uint8))
+    return levels
+
+
+def _split_levels(buffer: np.ndarray, height: int, width: int) -> list[np.ndarray]:
+    levels = []
+    offset = 0
+    for level_height, level_width in mip_level_shapes(height, width):
+        size = level_height * level_width * 3
+        levels.append(buffer[offset:offset + size].reshape(level_height, level_width, 3))
+        offset += size
+    return levels
+
+
+def _memory_mapped_levels(filename: str) -> list[np.ndarray]:
+    #all levels packed into one flat uint8 .npy next to the image, rebuilt when the image is newer
+    path = filename + MIP_CACHE_SUFFIX
+    with Image.open(filename) as image:
+        width, height = image.size
+    expected_size = sum(level_height * level_width * 3 for level_height, level_width in mip_level_shapes(height, width))
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(filename):
+        try:
+            buffer = np.load(path, mmap_mode='r')
+            if buffer.dtype == np.uint8 and buffer.shape == (expected_size,):
+                return _split_levels(buffer, height, width)
+        except (OSError, ValueError):
+            pass
+
+    levels = _decoded_levels(filename)
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(temporary_path, 'wb') as file:
+            np.save(file, np.concatenate([level.ravel() for level in levels]))
+        os.replace(temporary_path, path)
+    except OSError:
+        #a read only texture directory just means the levels stay in memory
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        return levels
+    return _split_levels(np.load(path, mmap_mode='r'), height, width)
+
+
+def _decoded_levels(filename: str) -> list[np.ndarray]:
+    with Image.open(filename) as image:
+        return build_mip_levels(np.asarray(image.convert('RGB'), dtype=np.uint8))
+
+
+def load_texture_levels(filename: str, memory_map: bool = False) -> list[np.ndarray]:
+    key = (os.path.realpath(filename), memory_map)
+    if key not in _texture_levels:
+        _texture_levels[key] = _memory_mapped_levels(filename) if memory_map else _decoded_levels(filename)
+    return _texture_levels[key]
+
+
 class ImageTexture(Texture):
-    def __init__(self, filename: str):
-        image = Image.open(filename).convert('RGB')
-        self.width, self.height = image.size
-        self.data = np.asarray(image, dtype=np.float32) / 255.0
+    #uint8 texels with a mip chain, levels are shared by every texture of the same file
+    def __init__(self, filename: str, memory_map: bool = False):
+        self.filename = filename
+        self.memory_map = memory_map
+        self.levels = load_texture_levels(filename, memory_map)
+        self.height, self.width = self.levels[0].shape[:2]
+
+    def __getstate__(self) -> dict:
+        #memory mapped levels are mapped again from the cache file instead of being copied
+        state = self.__dict__.copy()
+        if self.memory_map:
+            del state['levels']
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        if 'levels' not in state:
+            self.levels = load_texture_levels(self.filename, self.memory_map)
 
     def sample(self, x: float, y: float, point: np.ndarray) -> np.ndarray:
         x = max(0.0, min(1.0, x))
         y = 1.0 - max(0.0, min(1.0, y))
         x = int(x * (self.width - 1))
         y = int(y * (self.height - 1))
-        return self.data[y, x, :]
+        return self.levels[0][y, x, :].astype(np.float32) / 255.0
+
+    def mip_levels(self, footprints: np.ndarray) -> np.ndarray:
+        #footprints are the texture coordinate extent of one sample, the level where that covers about one texel
+        texel_footprints = np.maximum(footprints * max(self.width, self.height), 1.0)
+        return np.minimum(np.floor(np.log2(texel_footprints)).astype(np.intp), len(self.levels) - 1)
+
+    def sample_batch(self,
+                     x: np.ndarray,
+                     y: np.ndarray,
+                     points: np.ndarray,
+                     footprints: np.ndarray | None = None) -> np.ndarray:
+        x = np.clip(x, 0.0, 1.0)
+        y = 1.0 - np.clip(y, 0.0, 1.0)
+        colors = np.empty((len(x), 3), dtype=np.float32)
+        level_indices = np.zeros(len(x), dtype=np.intp) if footprints is None else self.mip_levels(footprints)
+        for level_index in np.unique(level_indices):
+            selected = level_indices == level_index
+            level = self.levels[level_index]
+            level_height, level_width = level.shape[:2]
+            columns = (x[selected] * (level_width - 1)).astype(np.intp)
+            rows = (y[selected] * (level_height - 1)).astype(np.intp)
+            colors[selected] = level[rows, columns, :]
+        colors *= 1.0 / 255.0
+        return colors
     
+NOISE_INTERPOLATIONS = ('nearest', 'trilinear', 'gradient')
+
+
 class Perlin:
-    def __init__(self, point_count: int = 256):
+    #interpolation 'nearest' is the original blocky value noise and stays bit for bit the same as noise()
+    #'trilinear' smooths the lattice values, 'gradient' dots random lattice vectors like Perlin's own noise.
+    #the tables come from a generator of their own seeded with seed, so a scene's noise is the same on every run
+    def __init__(self,
+                 point_count: int = 256,
+                 interpolation: str = 'nearest',
+                 lattice_cache: bool = False,
+                 seed: int | None = 0):
+        if interpolation not in NOISE_INTERPOLATIONS:
+            raise ValueError(f'Unknown noise interpolation {interpolation}')
         self.point_count = point_count
-        self.random_floats = np.random.rand(point_count).astype(np.float32)
-        permutation = np.arange(point_count, dtype=np.int32)
-        np.random.shuffle(permutation)
-        self.permutation_x = permutation.copy()
-        np.random.shuffle(permutation)
-        self.permutation_y = permutation.copy()
-        np.random.shuffle(permutation)
-        self.permutation_z = permutation.copy()
+        self.interpolation = interpolation
+        self.lattice_cache = lattice_cache
+        rng = np.random.default_rng(seed)
+        self.random_floats = rng.random(point_count, dtype=np.float32)
+        self.permutation_x = rng.permutation(point_count).astype(np.int32)
+        self.permutation_y = rng.permutation(point_count).astype(np.int32)
+        self.permutation_z = rng.permutation(point_count).astype(np.int32)
+        #drawn after the tables so the other modes keep the same random stream as before
+        self.random_vectors = None
+        if interpolation == 'gradient':
+            self.random_vectors = random_unit_vectors(point_count, rng)
+        self._lattice = None
+
+    def __getstate__(self) -> dict:
+        #the lattice is cheaper to rebuild than to send to every worker
+        state = self.__dict__.copy()
+        state['_lattice'] = None
+        return state
 
     def noise(self, point: np.ndarray) -> float:
+        if self.interpolation != 'nearest':
+            return float(self.noise_batch(np.asarray(point)[None])[0])
         x = int(math.floor(point[0])) & self.point_count - 1
         y = int(math.floor(point[1])) & self.point_count - 1
         z = int(math.floor(point[2])) & self.point_count - 1
@@ -47,13 +201,71 @@ class Perlin:
             weight *= 0.5
             temp_point *= 2.0
         return abs(accumulator)
+
+    def lattice(self) -> np.ndarray:
+        #the xor of the three permutations for every lattice cell, one gather instead of three
+        if self._lattice is None:
+            dtype = np.uint8 if self.point_count <= 256 else np.int32
+            self._lattice = (self.permutation_x[:, None, None]
+                             ^ self.permutation_y[None, :, None]
+                             ^ self.permutation_z[None, None, :]).astype(dtype)
+        return self._lattice
+
+    def _lattice_indices(self, cells: np.ndarray) -> np.ndarray:
+        if self.lattice_cache:
+            return self.lattice()[cells[:, 0], cells[:, 1], cells[:, 2]]
+        return self.permutation_x[cells[:, 0]] ^ self.permutation_y[cells[:, 1]] ^ self.permutation_z[cells[:, 2]]
+
+    def noise_batch(self, points: np.ndarray) -> np.ndarray:
+        floors = np.floor(points)
+        cells = floors.astype(np.int64) & self.point_count - 1
+        if self.interpolation == 'nearest':
+            return self.random_floats[self._lattice_indices(cells)].astype(np.float64)
+
+        fraction = points - floors
+        #hermite smoothing hides the lattice's grid lines
+        smooth = fraction * fraction * (3.0 - 2.0 * fraction)
+        result = np.zeros(len(points))
+        for corner in np.ndindex(2, 2, 2):
+            corner = np.array(corner)
+            indices = self._lattice_indices((cells + corner) & self.point_count - 1)
+            weight = np.prod(np.where(corner == 1, smooth, 1.0 - smooth), axis=1)
+            if self.interpolation == 'trilinear':
+                result += weight * self.random_floats[indices]
+            else:
+                result += weight * np.einsum('ij,ij->i', self.random_vectors[indices], fraction - corner)
+        return result
+
+    def turbulence_batch(self, points: np.ndarray, depth: int = 6) -> np.ndarray:
+        #same operations in the same order as turbulence, so nearest noise matches it exactly
+        accumulator = np.zeros(len(points))
+        temp_points = np.array(points, copy=True)
+        weight = 1.0
+        for _ in range(depth):
+            accumulator += weight * self.noise_batch(temp_points)
+            weight *= 0.5
+            temp_points *= 2.0
+        return np.abs(accumulator)
     
 class PerlinNoiseTexture(Texture):
-    def __init__(self, scale: float = 1.0, base_color: np.ndarray = np.array([1.0, 1.0, 1.0], dtype=np.float32)):
+    def __init__(self,
+                 scale: float = 1.0,
+                 base_color: np.ndarray = np.array([1.0, 1.0, 1.0], dtype=np.float32),
+                 interpolation: str = 'nearest',
+                 lattice_cache: bool = False,
+                 seed: int | None = 0):
         self.scale = scale
-        self.noise = Perlin()
+        self.noise = Perlin(interpolation=interpolation, lattice_cache=lattice_cache, seed=seed)
         self.base_color = base_color
 
     def sample(self, x: float, y: float, point: np.ndarray) -> np.ndarray:
         t = 0.5 * (1.0 + math.sin(self.scale * point[2] + 10.0 * self.noise.turbulence(point)))
-        return t * self.base_color
\ No newline at end of file
+        return t * self.base_color
+
+    def sample_batch(self,
+                     x: np.ndarray,
+                     y: np.ndarray,
+                     points: np.ndarray,
+                     footprints: np.ndarray | None = None) -> np.ndarray:
+        t = 0.5 * (1.0 + np.sin(self.scale * points[:, 2] + 10.0 * self.noise.turbulence_batch(points)))
+        return t.astype(np.float32)[:, None] * self.base_color
@@ -0,0 +1,69 @@
+import collections
+import threading
+import numpy as np
+
+
+def morton_codes(tile_list: list[tuple[int, int, int, int]], tile_size: int) -> np.ndarray:
+    #interleaves the bits of each tile's row and column in the tile grid, so walking the codes in order visits the
+    #image quadrant by quadrant and neighbouring tiles, which share textures and bvh nodes, render close in time
+    rows = np.array([tile[0] for tile in tile_list], dtype=np.uint64) // np.uint64(tile_size)
+    columns = np.array([tile[2] for tile in tile_list], dtype=np.uint64) // np.uint64(tile_size)
+    codes = np.zeros(len(tile_list), dtype=np.uint64)
+    for bit in range(32):
+        codes |= ((rows >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2 * bit + 1)
+        codes |= ((columns >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2 * bit)
+    return codes
+
+
+def schedule_order(tile_list: list[tuple[int, int, int, int]],
+                   tile_size: int,
+                   costs: np.ndarray | None = None) -> list[int]:
+    #tile indices hardest first, equal or unknown costs in morton order
+    codes = morton_codes(tile_list, tile_size)
+    if costs is None:
+        return np.argsort(codes, kind='stable').tolist()
+    return np.lexsort((codes, -np.asarray(costs))).tolist()
+
+
+def split_tile(tile: tuple[int, int, int, int], min_tile_size: int) -> list[tuple[int, int, int, int]]:
+    #quarters in morton order, halves when only one side is long enough, the tile itself when neither is
+    row_start, row_end, column_start, column_end = tile
+    row_splits = [row_start, row_end]
+    if row_end - row_start >= 2 * min_tile_size:
+        row_splits.insert(1, (row_start + row_end + 1) // 2)
+    column_splits = [column_start, column_end]
+    if column_end - column_start >= 2 * min_tile_size:
+        column_splits.insert(1, (column_start + column_end + 1) // 2)
+    return [(top, bottom, left, right)
+            for top, bottom in zip(row_splits, row_splits[1:])
+            for left, right in zip(column_splits, column_splits[1:])]
+
+
+class TileScheduler:
+    #one queue that every worker takes its next tile from, hardest first. a worker that runs dry simply takes the
+    #next tile, so there is nothing to steal. once fewer tiles are left than workers, the tile being dealt is split
+    #down towards min_tile_size and its other parts go to the front of the queue, so the last workers run out of work
+    #together instead of one large tile holding up the frame
+    def __init__(self,
+                 tile_list: list[tuple[int, int, int, int]],
+                 tile_size: int,
+                 costs: np.ndarray | None = None,
+                 worker_count: int = 1,
+                 min_tile_size: int = 8):
+        self.worker_count = worker_count
+        self.min_tile_size = min_tile_size
+        self._pending = collections.deque(tile_list[index] for index in schedule_order(tile_list, tile_size, costs))
+        self._lock = threading.Lock()
+
+    def next_tile(self) -> tuple[int, int, int, int] | None:
+        with self._lock:
+            if not self._pending:
+                return None
+            tile = self._pending.popleft()
+            while len(self._pending) + 1 < self.worker_count:
+                parts = split_tile(tile, self.min_tile_size)
+                if len(parts) == 1:
+                    break
+                tile = parts[0]
+                self._pending.extendleft(reversed(parts[1:]))
+            return tile
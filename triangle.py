@@ -6,6 +6,34 @@ from materials import Material
 from ray import Ray, normalize
 
 
+def hit_triangles(origins: np.ndarray,
+                  directions: np.ndarray,
+                  v0: np.ndarray,
+                  e1: np.ndarray,
+                  e2: np.ndarray,
+                  normals: np.ndarray,
+                  time_min: float,
+                  time_max: float | np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    #Triangle.hit over rows of rays and triangles, a single ray broadcasts against many triangles
+    #returns hit times with inf for misses plus the barycentric u and v
+    negative_directions = -directions
+    cramer_denominator = np.sum(negative_directions * normals, axis=-1)
+    ray_is_parallel = np.abs(cramer_denominator) < 1e-6
+    cramer_denominator = np.where(ray_is_parallel, 1.0, cramer_denominator)
+
+    v0_to_ray_origin = origins - v0
+    u = np.sum(v0_to_ray_origin * np.cross(e2, negative_directions), axis=-1) / cramer_denominator
+    v = np.sum(e1 * np.cross(v0_to_ray_origin, negative_directions), axis=-1) / cramer_denominator
+    time = np.sum(e1 * np.cross(e2, v0_to_ray_origin), axis=-1) / cramer_denominator
+
+    hit = (~ray_is_parallel
+           & (0.0 <= u) & (u <= 1.0)
+           & (0.0 <= v) & (v <= 1.0)
+           & (u + v <= 1.0)
+           & (time_min <= time) & (time <= time_max))
+    return np.where(hit, time, np.inf), u, v
+
+
 class Triangle:
     def __init__(self,
                  v0: np.ndarray,
@@ -35,14 +63,14 @@ class Triangle:
     
     def hit(self, ray: Ray, time_min: float, time_max: float) -> HitRecord | None:
         #triple product scaler
-        ray_is_parallel = abs(np.dot(-ray.direction, np.cross(self.e1, self.e2))) < 1e-6
+        cramer_denominator = np.dot(-ray.direction, self.normal)
+        ray_is_parallel = abs(cramer_denominator) < 1e-6
         if ray_is_parallel:
             return None
         
         #cramers rule
         #solving uE1 + vE2 - time * direction = (ray_origin - v0)
         v0_to_ray_origin = ray.origin - self.v0
-        cramer_denominator = np.dot(-ray.direction, np.cross(self.e1, self.e2))
 
         u_cramer_numerator = np.dot(v0_to_ray_origin, np.cross(self.e2, -ray.direction))
         u = u_cramer_numerator / cramer_denominator
@@ -62,10 +90,12 @@ class Triangle:
         if not (time_min <= time <= time_max):
             return None
         
-        point = ray.position(time)
+        return HitRecord(time, ray, self, self.material, u, v)
 
+    def hit_normal(self, hit_record: HitRecord) -> tuple[np.ndarray, bool]:
+        u, v = hit_record.u, hit_record.v
         outward_normal = normalize(self.normal)
-        front_face = np.dot(ray.direction, outward_normal) < 0.0
+        front_face = np.dot(hit_record.ray.direction, outward_normal) < 0.0
         if self.normal0 is not None and self.normal1 is not None and self.normal2 is not None:
             #phong shading / gouraud-style normal interpolation
             smooth_normal = normalize(
@@ -76,21 +106,15 @@ class Triangle:
             normal = smooth_normal if front_face else -smooth_normal
         else:
             normal = outward_normal if front_face else -outward_normal
+        return normal, front_face
 
-        texture_xy = None
-        if self.texture_xy0 is not None and self.texture_xy1 is not None and self.texture_xy2 is not None:
-            texture_xy = ((1.0 - u - v) * self.texture_xy0
-                          + u * self.texture_xy1
-                          + v * self.texture_xy2)
-
-        return HitRecord(
-            time=time,
-            point=point,
-            normal=normal,
-            material=self.material,
-            front_face=front_face,
-            texture_coordinates=texture_xy
-        )
+    def hit_texture_coordinates(self, hit_record: HitRecord) -> np.ndarray | None:
+        if self.texture_xy0 is None or self.texture_xy1 is None or self.texture_xy2 is None:
+            return None
+        u, v = hit_record.u, hit_record.v
+        return ((1.0 - u - v) * self.texture_xy0
+                + u * self.texture_xy1
+                + v * self.texture_xy2)
     
     def bounding_box(self) -> Axis_Aligned_Bounding_Box:
         minimum_vertice = np.minimum(np.minimum(self.v0, self.v1), self.v2)
@@ -0,0 +1,386 @@
+import concurrent.futures
+import math
+import os
+import threading
+import numpy as np
+
+from camera import Camera
+from denoise import denoise_render
+from flat_scene import FlatScene
+from hit_record import HitRecordBatch
+from instrumentation import Instrumentation, TileProfile, profile_stage
+from ray import RayBatch, normalize_rows
+from render_settings import RUSSIAN_ROULETTE_DEPTH, RenderSettings
+from sampler import STREAM_CAMERA, STREAM_LIGHT, STREAM_ROULETTE, STREAM_SCATTER, PathSampler, resolve_seed, sampler_key
+from tile_scheduler import TileScheduler
+
+WHITE = np.array([1.0, 1.0, 1.0], dtype=np.float32)
+BLUE = np.array([0.5, 0.7, 1.0], dtype=np.float32)
+CONFIDENCE_Z = 1.96
+#pixels between the samples of the tile cost pre-pass in each direction, and the seed of its own streams
+PREPASS_STRIDE = 8
+PREPASS_SEED = 0
+
+
+def background_color_batch(directions: np.ndarray) -> np.ndarray:
+    unit_directions = normalize_rows(directions)
+    blueness = .5 * (unit_directions[:, 1:2] + 1.0)
+    return blueness * BLUE + (1 - blueness) * WHITE
+
+
+def power_heuristic(pdf: np.ndarray, other_pdf: np.ndarray) -> np.ndarray:
+    #multiple importance sampling weight of a sample drawn with pdf when other_pdf could also have drawn it
+    pdf_squared = pdf * pdf
+    return pdf_squared / np.maximum(pdf_squared + other_pdf * other_pdf, 1e-300)
+
+
+def estimate_direct_light(scene: FlatScene,
+                          hit_records: HitRecordBatch,
+                          albedo: np.ndarray,
+                          times: np.ndarray,
+                          sampler: PathSampler,
+                          profile: TileProfile | None = None,
+                          backend: str = 'numpy') -> np.ndarray:
+    #next event estimation at diffuse hits, one light sample and shadow ray each, weighted against the
+    #cosine weighted bounce that could also have reached the light
+    normals = hit_records.normal
+    points = hit_records.point + normals * 1e-3
+    directions, light_pdf, lights = scene.sample_lights(points, times, sampler)
+    cosine = np.einsum('ij,ij->i', normals, directions)
+    direct_light = np.zeros((len(hit_records), 3))
+    candidates = np.flatnonzero((light_pdf > 0.0) & (cosine > 0.0))
+    if candidates.size == 0:
+        return direct_light
+
+    shadow_rays = RayBatch(points[candidates], directions[candidates], times[candidates])
+    _, first_hit, _, _ = scene.closest_hits(shadow_rays, time_min=1e-3, time_max=float('inf'), profile=profile,
+                                            backend=backend)
+    visible = candidates[first_hit == lights[candidates]]
+    #lambertian brdf times cosine is albedo times the cosine pdf
+    bsdf_pdf = cosine[visible] / math.pi
+    weight = power_heuristic(light_pdf[visible], bsdf_pdf)
+    direct_light[visible] = (albedo[visible] * scene.light_emission[lights[visible]]
+                             * (bsdf_pdf * weight / light_pdf[visible])[:, None])
+    return direct_light
+
+
+def trace_paths(rays: RayBatch,
+                scene: FlatScene,
+                max_depth: int,
+                sampler: PathSampler,
+                russian_roulette_depth: int = RUSSIAN_ROULETTE_DEPTH,
+                profile: TileProfile | None = None,
+                pixel_spread_angle: float = 0.0,
+                next_event_estimation: bool = True,
+                packet_traversal: bool = False,
+                backend: str = 'numpy') -> np.ndarray:
+    radiance = np.zeros((len(rays), 3))
+    throughput = np.ones((len(rays), 3))
+    path_indices = np.arange(len(rays))
+    sample_lights = next_event_estimation and scene.light_count > 0
+    #solid angle pdf of the diffuse bounce that made each ray, 0 for camera rays and specular bounces
+    bounce_pdf = np.zeros(len(rays))
+    #distance every path has travelled, its ray cone is pixel_spread_angle times as wide
+    path_distance = np.zeros(len(rays))
+    if profile is not None:
+        path_cost = np.zeros(len(rays))
+        path_lengths = np.zeros(len(rays), dtype=np.int64)
+
+    for depth in range(max_depth + 1):
+        if len(path_indices) == 0:
+            break
+
+        #intersect
+        with profile_stage(profile, 'intersect'):
+            #only the camera rays are coherent enough for packets
+            hit_mask, hit_records = scene.intersect(rays, time_min=1e-3, time_max=float('inf'), profile=profile,
+                                                    coherent=packet_traversal and depth == 0, backend=backend)
+        if profile is not None:
+            path_cost[path_indices] += profile.ray_cost
+            path_lengths[path_indices] += 1
+        missed = ~hit_mask
+        with profile_stage(profile, 'background'):
+            radiance[path_indices[missed]] += throughput[missed] * background_color_batch(rays.directions[missed])
+        path_indices = path_indices[hit_mask]
+        throughput = throughput[hit_mask]
+        bounce_pdf = bounce_pdf[hit_mask]
+        rays = rays.subset(hit_mask)
+        path_distance = path_distance[hit_mask] + hit_records.time * np.linalg.norm(rays.directions, axis=1)
+        #the scene reports texture coordinate change per unit distance, scaled to the cone width here
+        hit_records.texture_footprint = hit_records.texture_footprint * (pixel_spread_angle * path_distance)
+
+        #lights reached by a diffuse bounce were also sampled directly from its origin
+        count = len(path_indices)
+        emission_weight = np.ones(count)
+        if sample_lights:
+            bounced_to_light = np.flatnonzero((bounce_pdf > 0.0) & scene.is_light(hit_records.primitive_index))
+            if bounced_to_light.size:
+                light_pdf = scene.light_pdf(rays.origins[bounced_to_light],
+                                            rays.directions[bounced_to_light],
+                                            rays.times[bounced_to_light],
+                                            hit_records.primitive_index[bounced_to_light],
+                                            hit_records.time[bounced_to_light])
+                emission_weight[bounced_to_light] = power_heuristic(bounce_pdf[bounced_to_light], light_pdf)
+
+        #shade, one group of paths per material
+        emitted = np.zeros((count, 3))
+        attenuation = np.zeros((count, 3))
+        scatter_origins = np.zeros((count, 3))
+        scatter_directions = np.zeros((count, 3))
+        scattered = np.zeros(count, dtype=bool)
+        scatter_pdf = np.zeros(count)
+        diffuse = np.zeros(count, dtype=bool)
+        #every path keeps drawing from its own streams whichever paths are still around
+        path_sampler = sampler.subset(path_indices)
+        scatter_sampler = path_sampler.stream(depth, STREAM_SCATTER)
+        order = np.argsort(hit_records.material_index, kind='stable')
+        material_indices, group_starts = np.unique(hit_records.material_index[order], return_index=True)
+        for material_index, group in zip(material_indices, np.split(order, group_starts[1:])):
+            material = scene.materials[material_index]
+            emitted[group] = material.emitted_batch(len(group))
+            if profile is not None:
+                profile.material_hits[type(material).__name__] += len(group)
+            if depth >= max_depth:
+                continue
+            #scatter
+            with profile_stage(profile, f'scatter:{type(material).__name__}'):
+                group_attenuation, scatter_rays, group_scattered = material.scatter_batch(rays.subset(group),
+                                                                                          hit_records.subset(group),
+                                                                                          scatter_sampler.subset(group))
+            attenuation[group] = group_attenuation
+            scatter_origins[group] = scatter_rays.origins
+            scatter_directions[group] = scatter_rays.directions
+            scattered[group] = group_scattered
+            if sample_lights and material.diffuse:
+                diffuse[group] = True
+                cosine = np.einsum('ij,ij->i', hit_records.normal[group], normalize_rows(scatter_rays.directions))
+                scatter_pdf[group] = np.maximum(cosine, 0.0) / math.pi
+        radiance[path_indices] += throughput * emitted * emission_weight[:, None]
+
+        if diffuse.any():
+            with profile_stage(profile, 'direct_light'):
+                shading = np.flatnonzero(diffuse)
+                #shadow rays are traced at the path's own time, where the bounce would have found a moving light
+                direct_light = estimate_direct_light(scene, hit_records.subset(shading), attenuation[shading],
+                                                     rays.times[shading],
+                                                     path_sampler.stream(depth, STREAM_LIGHT).subset(shading), profile,
+                                                     backend)
+                radiance[path_indices[shading]] += throughput[shading] * direct_light
+
+        #compact survivors
+        path_indices = path_indices[scattered]
+        throughput = throughput[scattered] * attenuation[scattered]
+        path_distance = path_distance[scattered]
+        bounce_pdf = scatter_pdf[scattered]
+        rays = RayBatch(scatter_origins[scattered], scatter_directions[scattered], rays.times[scattered])
+
+        #russian roulette, survivors are scaled up so the estimate stays unbiased
+        if depth + 1 >= russian_roulette_depth:
+            survival_probability = np.minimum(throughput.max(axis=1), 0.95)
+            roulette_sampler = sampler.subset(path_indices).stream(depth, STREAM_ROULETTE)
+            survived = roulette_sampler.random(len(path_indices)) < survival_probability
+            path_indices = path_indices[survived]
+            throughput = throughput[survived] / survival_probability[survived, None]
+            path_distance = path_distance[survived]
+            bounce_pdf = bounce_pdf[survived]
+            rays = rays.subset(survived)
+
+    if profile is not None:
+        profile.path_cost = path_cost
+        lengths, counts = np.unique(path_lengths, return_counts=True)
+        profile.path_lengths.update(dict(zip(lengths.tolist(), counts.tolist())))
+    return radiance
+
+
+def sample_pixels(pixel_x: np.ndarray,
+                  pixel_y: np.ndarray,
+                  sample_counts: np.ndarray,
+                  camera: Camera,
+                  scene: FlatScene,
+                  settings: RenderSettings,
+                  key: np.ndarray,
+                  profile: TileProfile | None = None,
+                  first_samples: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+    #traces sample_counts[i] paths through pixel i, numbered on from first_samples[i], returns per pixel sums and
+    #sums of squares
+    pixel_count = len(pixel_x)
+    color_sum = np.zeros((pixel_count, 3))
+    color_square_sum = np.zeros((pixel_count, 3))
+    sample_pixel = np.repeat(np.arange(pixel_count), sample_counts)
+    sample_index = np.arange(sample_pixel.size) - np.repeat(np.cumsum(sample_counts) - sample_counts, sample_counts)
+    if first_samples is not None:
+        sample_index += first_samples[sample_pixel]
+    pixel_index = pixel_y * settings.width + pixel_x
+    for start in range(0, sample_pixel.size, settings.max_rays_per_batch):
+        batch_pixel = sample_pixel[start:start + settings.max_rays_per_batch]
+        sampler = PathSampler(key, pixel_index[batch_pixel], sample_index[start:start + settings.max_rays_per_batch])
+        with profile_stage(profile, 'camera_rays'):
+            rays = camera.pixel_rays(pixel_x[batch_pixel], pixel_y[batch_pixel], settings.width, settings.height,
+                                     sampler.stream(0, STREAM_CAMERA))
+        radiance = trace_paths(rays, scene, settings.max_depth, sampler, settings.russian_roulette_depth, profile,
+                               camera.pixel_spread_angle(settings.height), settings.next_event_estimation,
+                               settings.packet_traversal, settings.backend)
+        if profile is not None:
+            profile.add_pixel_cost(pixel_x[batch_pixel], pixel_y[batch_pixel], profile.path_cost, settings.height)
+        for channel in range(3):
+            color_sum[:, channel] += np.bincount(batch_pixel, radiance[:, channel], minlength=pixel_count)
+            color_square_sum[:, channel] += np.bincount(batch_pixel, radiance[:, channel] ** 2, minlength=pixel_count)
+    return color_sum, color_square_sum
+
+
+def confidence_half_width(color_sum: np.ndarray, color_square_sum: np.ndarray, sample_counts: np.ndarray) -> np.ndarray:
+    #widest 95% confidence interval of the pixel mean over the three channels
+    counts = sample_counts[:, None].astype(np.float64)
+    mean = color_sum / counts
+    variance = np.maximum(color_square_sum - counts * mean * mean, 0.0) / np.maximum(counts - 1.0, 1.0)
+    return (CONFIDENCE_Z * np.sqrt(variance / counts)).max(axis=1)
+
+
+def render_tile(row_start: int,
+                row_end: int,
+                column_start: int,
+                column_end: int,
+                camera: Camera,
+                scene: FlatScene,
+                settings: RenderSettings,
+                key: np.ndarray,
+                profile: TileProfile | None = None) -> tuple[np.ndarray, np.ndarray]:
+    color_sum, sample_counts = render_tile_sums(row_start, row_end, column_start, column_end, camera, scene, settings,
+                                                key, profile)
+    return (color_sum / sample_counts[..., None]).astype(np.float32), sample_counts
+
+
+def render_tile_sums(row_start: int,
+                     row_end: int,
+                     column_start: int,
+                     column_end: int,
+                     camera: Camera,
+                     scene: FlatScene,
+                     settings: RenderSettings,
+                     key: np.ndarray,
+                     profile: TileProfile | None = None) -> tuple[np.ndarray, np.ndarray]:
+    #sum of every sample and the sample count of each pixel, sums from several renders can be added up.
+    #key is the render's sampler_key, the same for every tile
+    with profile_stage(profile, 'tile'):
+        return _render_tile(row_start, row_end, column_start, column_end, camera, scene, settings, key, profile)
+
+
+def _render_tile(row_start: int,
+                 row_end: int,
+                 column_start: int,
+                 column_end: int,
+                 camera: Camera,
+                 scene: FlatScene,
+                 settings: RenderSettings,
+                 key: np.ndarray,
+                 profile: TileProfile | None) -> tuple[np.ndarray, np.ndarray]:
+    #rows are image rows counted from the top, the camera counts y from the bottom
+    rows, columns = np.mgrid[row_start:row_end, column_start:column_end]
+    pixel_y = (settings.height - 1 - rows).ravel()
+    pixel_x = columns.ravel()
+    pixel_count = pixel_x.size
+
+    if not settings.adaptive_sampling:
+        sample_counts = np.full(pixel_count, settings.samples_per_pixel, dtype=np.int32)
+        color_sum, _ = sample_pixels(pixel_x, pixel_y, sample_counts, camera, scene, settings, key, profile)
+    else:
+        minimum_samples = min(settings.min_samples_per_pixel, settings.samples_per_pixel)
+        sample_counts = np.full(pixel_count, minimum_samples, dtype=np.int32)
+        color_sum, color_square_sum = sample_pixels(pixel_x, pixel_y, sample_counts, camera, scene, settings, key,
+                                                    profile)
+        while True:
+            unconverged = confidence_half_width(color_sum, color_square_sum, sample_counts) > settings.adaptive_tolerance
+            active = np.flatnonzero(unconverged & (sample_counts < settings.samples_per_pixel))
+            if active.size == 0:
+                break
+            pass_samples = np.minimum(minimum_samples, settings.samples_per_pixel - sample_counts[active])
+            pass_sum, pass_square_sum = sample_pixels(pixel_x[active], pixel_y[active], pass_samples,
+                                                      camera, scene, settings, key, profile, sample_counts[active])
+            color_sum[active] += pass_sum
+            color_square_sum[active] += pass_square_sum
+            sample_counts[active] += pass_samples
+
+    tile_shape = (row_end - row_start, column_end - column_start)
+    return color_sum.reshape(*tile_shape, 3), sample_counts.reshape(tile_shape)
+
+
+def tiles(settings: RenderSettings) -> list[tuple[int, int, int, int]]:
+    return [
+        (row, min(row + settings.tile_size, settings.height), column, min(column + settings.tile_size, settings.width))
+        for row in range(0, settings.height, settings.tile_size)
+        for column in range(0, settings.width, settings.tile_size)
+    ]
+
+
+def estimate_tile_costs(camera: Camera,
+                        scene: FlatScene,
+                        settings: RenderSettings,
+                        tile_list: list[tuple[int, int, int, int]]) -> np.ndarray:
+    #one path through every PREPASS_STRIDE-th pixel each way, traced with a profile so every path's node visits and
+    #primitive tests are counted. a tile is estimated at the mean cost of its sampled pixels times its area
+    rows = np.arange(min(PREPASS_STRIDE // 2, settings.height - 1), settings.height, PREPASS_STRIDE)
+    columns = np.arange(min(PREPASS_STRIDE // 2, settings.width - 1), settings.width, PREPASS_STRIDE)
+    rows, columns = (grid.ravel() for grid in np.meshgrid(rows, columns, indexing='ij'))
+    profile = TileProfile((0, settings.height, 0, settings.width), [])
+    sample_pixels(columns, settings.height - 1 - rows, np.ones(rows.size, dtype=np.int32), camera, scene, settings,
+                  sampler_key(PREPASS_SEED), profile)
+    pixel_cost = profile.pixel_cost.reshape(settings.height, settings.width)
+    sampled = np.zeros((settings.height, settings.width), dtype=bool)
+    sampled[rows, columns] = True
+    image_mean_cost = pixel_cost[sampled].mean()
+    costs = np.zeros(len(tile_list))
+    for index, (row_start, row_end, column_start, column_end) in enumerate(tile_list):
+        tile_sampled = sampled[row_start:row_end, column_start:column_end]
+        mean_cost = (pixel_cost[row_start:row_end, column_start:column_end][tile_sampled].mean()
+                     if tile_sampled.any() else image_mean_cost)
+        costs[index] = mean_cost * tile_sampled.size
+    return costs
+
+
+def tile_costs(camera: Camera,
+               scene: FlatScene,
+               settings: RenderSettings,
+               tile_list: list[tuple[int, int, int, int]],
+               worker_count: int) -> np.ndarray | None:
+    #with a tile for every worker the order does not matter and the pre-pass is skipped
+    if not settings.tile_cost_prepass or len(tile_list) <= worker_count:
+        return None
+    return estimate_tile_costs(camera, scene, settings, tile_list)
+
+
+def render_image(camera: Camera,
+                 scene: FlatScene,
+                 settings: RenderSettings,
+                 seed: int | None = None,
+                 max_workers: int | None = None,
+                 instrumentation: Instrumentation | None = None) -> tuple[np.ndarray, np.ndarray]:
+    image = np.zeros(shape=(settings.height, settings.width, 3), dtype=np.float32)
+    sample_counts = np.zeros(shape=(settings.height, settings.width), dtype=np.int32)
+    #the denoiser's guide pass follows the same camera streams, so it needs the seed the render was keyed with
+    seed = resolve_seed(seed)
+    key = sampler_key(seed)
+    max_workers = max_workers or os.cpu_count() or 4
+    tile_list = tiles(settings)
+    costs = tile_costs(camera, scene, settings, tile_list, max_workers)
+    scheduler = TileScheduler(tile_list, settings.tile_size, costs, max_workers, settings.min_tile_size)
+    instrumentation_lock = threading.Lock()
+
+    def render_tiles():
+        #every thread keeps taking tiles until the scheduler has none left
+        while (tile := scheduler.next_tile()) is not None:
+            row_start, row_end, column_start, column_end = tile
+            profile = None if instrumentation is None else instrumentation.tile_profile(tile)
+            tile_color, tile_sample_counts = render_tile(*tile, camera, scene, settings, key, profile)
+            image[row_start:row_end, column_start:column_end, :] = tile_color
+            sample_counts[row_start:row_end, column_start:column_end] = tile_sample_counts
+            if instrumentation is not None:
+                with instrumentation_lock:
+                    instrumentation.add_tile(profile)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for future in [executor.submit(render_tiles) for _ in range(max_workers)]:
+            future.result()
+
+    if settings.denoise:
+        image = denoise_render(image, camera, scene, settings, seed)
+    return image, sample_counts